@@ -1,10 +1,13 @@
 from langgraph.graph import StateGraph, END
 from dotenv import load_dotenv
-from langgraph.checkpoint.memory import MemorySaver
 import logging
+from typing import Optional
+from .utils.checkpoint import MeasuredMemorySaver
 from .utils.todoist import TodoistClient
 from .nodes.chat import ChatNode
 from .nodes.get_tasks import GetTasksNode
+from .nodes.insights import InsightsNode
+from .nodes.tools import ToolsNode, route_tools
 from .state import State
 from .utils.logging_setup import setup_logging
 
@@ -16,10 +19,13 @@ setup_logging()
 logger = logging.getLogger(__name__)  # Get module-specific logger
 
 
-def create_agent():
+def create_agent(todoist_client: Optional[TodoistClient] = None):
     """
     Creates and configures the agent graph with Todoist integration.
 
+    Args:
+        todoist_client: Client to use for this agent; a new one is created if omitted
+
     Returns:
         Compiled StateGraph instance with memory persistence
 
@@ -29,26 +35,34 @@ def create_agent():
     logger.info("Starting agent creation")
     try:
         # Initialize components
-        todoist_client = TodoistClient()
+        todoist_client = todoist_client or TodoistClient()
         get_tasks_node = GetTasksNode(todoist_client)
-        chat_node = ChatNode()
+        insights_node = InsightsNode(todoist_client)
+        chat_node = ChatNode(task_store=todoist_client.store)
+        tools_node = ToolsNode(todoist_client)
 
         # Create workflow
         workflow = StateGraph(State)
 
         # Add nodes to the graph
         workflow.add_node("get_tasks", get_tasks_node)
+        workflow.add_node("insights", insights_node)
         workflow.add_node("chat_node", chat_node)
+        workflow.add_node("tools", tools_node)
 
         # Define edges
-        workflow.add_edge("get_tasks", "chat_node")
-        workflow.add_edge("chat_node", END)
+        workflow.add_edge("get_tasks", "insights")
+        workflow.add_edge("insights", "chat_node")
+        workflow.add_conditional_edges(
+            "chat_node", route_tools, {"tools": "tools", "end": END}
+        )
+        workflow.add_edge("tools", "chat_node")
 
         # Set entry point
         workflow.set_entry_point("get_tasks")
 
         # Compile graph
-        compiled_graph = workflow.compile(checkpointer=MemorySaver())
+        compiled_graph = workflow.compile(checkpointer=MeasuredMemorySaver())
         logger.info("Agent created successfully")
 
         return compiled_graph
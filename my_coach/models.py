@@ -1,7 +1,9 @@
-from typing import Literal, Optional, List
+from datetime import datetime
+from typing import Dict, Literal, Optional, List
 from pydantic import BaseModel
 
 VIEW_STYLE = Literal["list", "board"]
+MEMORY_KIND = Literal["goal", "habit", "constraint", "preference"]
 
 
 class Project(BaseModel):
@@ -150,6 +152,29 @@ class CompletedItems(BaseModel):
     next_cursor: Optional[str] = None
 
 
+class ProductivitySummary(BaseModel):
+    """Precomputed analytics over a user's completed task history"""
+
+    window_days: int
+    completed: int
+    by_weekday: Dict[str, float] = {}
+    by_hour: Dict[int, float] = {}
+    current_streak_days: int = 0
+    longest_streak_days: int = 0
+    overdue_ratio: Optional[float] = None
+    priority_mix: Dict[str, float] = {}
+
+
+class UserMemory(BaseModel):
+    """Durable fact about a user extracted from conversations"""
+
+    id: str
+    kind: MEMORY_KIND
+    text: str
+    created_at: datetime
+    updated_at: datetime
+
+
 class SimpleTask(BaseModel):
     """Simplified task model for agent state management"""
 
@@ -161,6 +186,14 @@ class SimpleTask(BaseModel):
     due: Optional[Due]
     labels: Optional[List[str]] = None
     timezone: Optional[str] = None
+    project_id: Optional[str] = None
+    project_name: Optional[str] = None
+    section_id: Optional[str] = None
+    section_name: Optional[str] = None
+    parent_id: Optional[str] = None
+    child_order: int = 0
+    # UTC deadline parsed from `due` at ingest; all-day tasks are due by end of day
+    due_at: Optional[datetime] = None
 
 
 class UserPreferences(BaseModel):
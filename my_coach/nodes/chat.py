@@ -1,80 +1,371 @@
+import asyncio
 import logging
-from typing import List
-from langchain_core.messages import BaseMessage, HumanMessage
+import os
+import time
+from typing import Any, Dict, List, Optional, Tuple
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, SystemMessage, ToolMessage
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+from langchain_core.runnables import RunnableConfig
 from langchain_openai import ChatOpenAI
+from ..models import SimpleTask
 from ..state import State
 from ..utils.prompts import system_prompt
+from .tools import TODOIST_TOOLS
 from ..utils.logging_setup import setup_logging
+from ..utils.metrics import metrics
+from ..utils.model_router import ModelRouter
+from ..utils.hedging import HedgedRequests, llm_hedging
+from ..utils.task_store import TaskStore
+from ..utils.task_tree import Rollup
+from ..utils.usage import usage_tracker
+from ..utils.profiling import span
+from ..utils.long_term_memory import MemoryManager, format_memories, memory_manager
+from ..utils.briefings import BriefingService, briefing_service
 
 # Initialize logging
 setup_logging()
 logger = logging.getLogger(__name__)  # Get module-specific logger
 
-def create_chat_chain():
+def create_chat_chain(openai_llm: Optional[ChatOpenAI] = None):
     """Create the chat chain with LLM and prompt"""
     logger.debug("Creating chat chain")
     try:
-        openai_llm = ChatOpenAI(model="gpt-4o-mini", temperature=0, streaming=True)
+        # stream_usage makes streamed responses carry token usage, including
+        # the number of prompt tokens served from the provider's prompt cache
+        openai_llm = openai_llm or ChatOpenAI(
+            model="gpt-4o-mini", temperature=0, streaming=True, stream_usage=True
+        )
+        llm_with_tools = openai_llm.bind_tools(TODOIST_TOOLS)
 
+        # Ordered from most to least stable so the provider can reuse the
+        # longest possible cached prefix: static instructions, then context
+        # that changes only on task/history updates, then the append-only
+        # conversation, and finally this turn's message and tool scratchpad.
         prompt = ChatPromptTemplate.from_messages(
             [
-                (
-                    "system",
-                    system_prompt,
-                ),
+                # A literal message, not a template, so it is byte-identical every turn
+                SystemMessage(content=system_prompt),
+                MessagesPlaceholder(variable_name="tasks", optional=True),
+                MessagesPlaceholder(variable_name="insights", optional=True),
                 MessagesPlaceholder(variable_name="chat_history", optional=True),
+                # Long-term memories retrieved for this message
+                MessagesPlaceholder(variable_name="memories", optional=True),
+                # Tasks retrieved for this message when the list is too long to include
+                MessagesPlaceholder(variable_name="relevant_tasks", optional=True),
                 ("human", "{input}"),
-                MessagesPlaceholder(variable_name="tasks", optional=True)
+                # Tool calls and results of the current turn
+                MessagesPlaceholder(variable_name="scratchpad", optional=True),
             ]
-        ).partial(
-            # Pre-fill system prompt to avoid passing it each time
-            system_prompt=system_prompt
         )
 
         logger.info("Successfully created chat chain")
-        return prompt | openai_llm
+        return prompt | llm_with_tools
 
     except Exception as e:
         logger.error(f"Failed to create chat chain: {str(e)}", exc_info=True)
         raise
 
 
+def format_location(task: SimpleTask) -> str:
+    """Render the task's project and section names joined at ingest"""
+    if not task.project_name:
+        return "Unknown"
+    if task.section_name:
+        return f"{task.project_name} / {task.section_name}"
+    return task.project_name
+
+
+def task_sort_key(task: SimpleTask) -> Tuple[int, str]:
+    """Canonical task order: by id, numerically for Todoist's numeric ids.
+
+    Ids are assigned in creation order, so new tasks land at the end of the
+    block and leave the cached prefix of older tasks intact.
+    """
+    return (len(task.id), task.id)
+
+
+def format_task(task: SimpleTask) -> str:
+    return (
+        f"Task: {task.content}\n"
+        f"ID: {task.id}\n"
+        f"Project: {format_location(task)}\n"
+        f"Priority: {task.priority}\n"
+        f"Due: {task.due.string if task.due else 'No due date'}"
+    )
+
+
+def format_tasks(tasks: List[SimpleTask]) -> List[BaseMessage]:
+    """Render tasks as one deterministic context message"""
+    if not tasks:
+        return []
+    blocks = [format_task(task) for task in sorted(tasks, key=task_sort_key)]
+    return [SystemMessage(content="TODOIST TASKS\n\n" + "\n\n".join(blocks))]
+
+
+def format_rollup(rollup: Rollup, store: TaskStore) -> str:
+    parts = [f"{rollup.completed}/{rollup.total} done"]
+    next_due = store.tasks.get(rollup.next_due_id) if rollup.next_due_id else None
+    if next_due and next_due.due:
+        parts.append(f"next due {next_due.due.string} ({next_due.content})")
+    if rollup.top_priority:
+        parts.append(f"top priority {rollup.top_priority}")
+    return "Subtasks: " + ", ".join(parts)
+
+
+def format_task_outline(tasks: List[SimpleTask], store: TaskStore) -> List[BaseMessage]:
+    """Render top-level tasks with a rollup of their subtasks instead of every subtask"""
+    if not tasks:
+        return []
+    blocks = []
+    for task in sorted(tasks, key=task_sort_key):
+        if store.tree.is_subtask(task.id):
+            continue
+        rollup = store.rollup(task.id)
+        blocks.append(format_task(task) + (f"\n{format_rollup(rollup, store)}" if rollup else ""))
+    return [SystemMessage(
+        content="TODOIST TASKS (subtasks are summarized; ListSubtasks shows them)\n\n" + "\n\n".join(blocks)
+    )]
+
+
+def format_project_summary(store: TaskStore, limit: int = 20) -> List[BaseMessage]:
+    """Render open and completed task counts per project"""
+    if not store or not store.tree.projects:
+        return []
+    names = {task.project_id: task.project_name for task in store.tasks.values() if task.project_name}
+    counts = sorted(store.tree.projects.items(), key=lambda item: item[1][0], reverse=True)
+    lines = [
+        f"{names.get(project_id, project_id)}: {open_count} open, {completed} completed"
+        for project_id, (open_count, completed) in counts[:limit]
+    ]
+    return [SystemMessage(content="PROJECTS\n" + "\n".join(lines))]
+
+
+def format_relevant_tasks(tasks: List[SimpleTask]) -> List[BaseMessage]:
+    """Render search matches for the current message, best match first"""
+    if not tasks:
+        return []
+    blocks = [format_task(task) for task in tasks]
+    return [SystemMessage(content="TASKS MATCHING THE MESSAGE\n\n" + "\n\n".join(blocks))]
+
+
+def format_due_summary(store: TaskStore, limit: int = 10) -> List[BaseMessage]:
+    """Render overdue / today / next-7-days buckets from the due index"""
+    if not store or not len(store.due_index):
+        return []
+
+    def bucket(title: str, tasks: List[SimpleTask]) -> str:
+        names = "; ".join(task.content for task in tasks[:limit])
+        more = f" (+{len(tasks) - limit} more)" if len(tasks) > limit else ""
+        return f"{title} ({len(tasks)}): {names or 'none'}{more}"
+
+    lines = [
+        f"DUE SUMMARY (timezone {store.timezone or 'UTC'})",
+        bucket("Overdue", store.overdue()),
+        bucket("Due today", store.due_today()),
+        bucket("Due in the next 7 days", store.due_within(7)),
+    ]
+    return [SystemMessage(content="\n".join(lines))]
+
+
+def record_prompt_cache_usage(resp: Any, elapsed: float) -> None:
+    """Record prompt/cached token counts and latency split by cache hit"""
+    usage = getattr(resp, "usage_metadata", None) or {}
+    prompt_tokens = usage.get("input_tokens", 0)
+    cached_tokens = (usage.get("input_token_details") or {}).get("cache_read", 0) or 0
+
+    metrics.incr("llm.prompt_tokens", prompt_tokens)
+    metrics.incr("llm.cached_prompt_tokens", cached_tokens)
+    metrics.observe(
+        "llm.latency_cache_hit" if cached_tokens else "llm.latency_cache_miss", elapsed
+    )
+    hit_rate = metrics.ratio("llm.cached_prompt_tokens", "llm.prompt_tokens")
+    logger.info(
+        f"Prompt cache: {cached_tokens}/{prompt_tokens} tokens cached "
+        f"(cumulative hit rate {hit_rate or 0:.1%}), latency {elapsed:.2f}s"
+    )
+
+
+def trim_history(msgs: List[BaseMessage], limit: int) -> List[BaseMessage]:
+    """Keep the last `limit` messages, starting at a user message"""
+    if len(msgs) <= limit:
+        return msgs
+    trimmed = msgs[-limit:] if limit else []
+    # Never start mid tool exchange: tool results need their tool call
+    while trimmed and not isinstance(trimmed[0], HumanMessage):
+        trimmed = trimmed[1:]
+    return trimmed
+
+
+def split_scratchpad(msgs: List[BaseMessage]) -> Tuple[List[BaseMessage], List[BaseMessage]]:
+    """Separate trailing tool-call/tool-result messages from the conversation"""
+    index = len(msgs)
+    while index > 0 and (
+        isinstance(msgs[index - 1], ToolMessage)
+        or (isinstance(msgs[index - 1], AIMessage) and msgs[index - 1].tool_calls)
+    ):
+        index -= 1
+    return list(msgs[:index]), list(msgs[index:])
+
+
 class ChatNode:
-    def __init__(self):
+    def __init__(self, router: Optional[ModelRouter] = None, task_store: Optional[TaskStore] = None,
+                 memory: Optional[MemoryManager] = None, briefings: Optional[BriefingService] = None,
+                 hedging: Optional[HedgedRequests] = None):
         logger.info("Initializing ChatNode")
-        self.chain = create_chat_chain()
+        self.router = router or ModelRouter()
+        self.task_store = task_store
+        self.memory = memory or memory_manager
+        self.briefings = briefings or briefing_service
+        self.hedging = hedging or llm_hedging
+        # With long-term memory, older turns are recalled instead of replayed
+        self.history_limit = int(os.getenv("CHAT_HISTORY_MESSAGES", "20"))
+        # Above this many tasks only search matches are sent instead of the full list
+        self.full_task_limit = int(os.getenv("CHAT_FULL_TASK_LIMIT", "50"))
+        self.search_limit = int(os.getenv("CHAT_SEARCH_LIMIT", "15"))
+        # Conversation messages kept for users over their daily quota
+        self.degraded_history = int(os.getenv("CHAT_DEGRADED_HISTORY", "6"))
+        self.chains: Dict[str, Any] = {
+            tier: create_chat_chain(self.router.create_llm(tier)) for tier in self.router.tiers
+        }
+        # Hedged requests go to the tier's alternate endpoint, if it has one
+        self.hedge_chains: Dict[str, Any] = {
+            tier: create_chat_chain(self.router.create_llm(tier, hedge=True))
+            if self.hedging.enabled and self.router.has_hedge_endpoint(tier) else chain
+            for tier, chain in self.chains.items()
+        }
+
+    def _invoke(self, tier: str, inputs: Dict[str, Any]):
+        if not self.hedging.enabled:
+            return self.chains[tier].ainvoke(inputs)
+        return self.hedging.run(
+            tier,
+            lambda: self.chains[tier].astream(inputs),
+            lambda: self.hedge_chains[tier].astream(inputs),
+        )
+
+    async def _generate(self, tier: str, inputs: Dict[str, Any], user_id: str = "") -> BaseMessage:
+        """Generate a reply on the routed tier, falling back on errors or timeouts"""
+        last_error: Optional[BaseException] = None
+        for attempt in self.router.fallback_order(tier):
+            started = time.perf_counter()
+            if attempt == "canned":
+                content = self.router.canned_response(inputs["input"])
+                if content:
+                    self.router.record(attempt, time.perf_counter() - started)
+                    return AIMessage(content=content, response_metadata={"tier": attempt})
+                # Not actually cannable: escalate to the small model
+                return await self._generate("small", inputs, user_id)
+
+            try:
+                resp = await asyncio.wait_for(
+                    self._invoke(attempt, inputs), timeout=self.router.tiers[attempt].timeout
+                )
+            except Exception as e:
+                elapsed = time.perf_counter() - started
+                self.router.record(attempt, elapsed, failed=True)
+                logger.warning(
+                    f"{attempt} tier failed after {elapsed:.2f}s ({type(e).__name__}), trying fallback"
+                )
+                last_error = e
+                continue
 
-    async def __call__(self, state: State) -> dict[str, List[BaseMessage]]:
+            elapsed = time.perf_counter() - started
+            usage = getattr(resp, "usage_metadata", None)
+            cost = self.router.record(attempt, elapsed, usage)
+            usage_tracker.record(user_id, usage, cost)
+            record_prompt_cache_usage(resp, elapsed)
+            resp.response_metadata["tier"] = attempt
+            logger.debug(f"{attempt} tier responded in {elapsed:.2f}s (${cost:.5f})")
+            return resp
+
+        raise last_error or RuntimeError(f"No model tier available for {tier}")
+
+    async def __call__(self, state: State, config: RunnableConfig) -> dict[str, List[BaseMessage]]:
         logger.debug("Processing chat request")
+        configurable = config.get("configurable", {})
+        user_id = str(configurable.get("thread_id", ""))
+        # Set for users over their daily quota: cheaper model, shorter context
+        degraded = bool(configurable.get("degraded"))
         try:
+            # Split off this turn's tool calls/results that follow the user message
+            msgs, scratchpad = split_scratchpad(state["msgs"])
+
             # Get the last message
-            last_msg = state["msgs"][-1] if state["msgs"] else HumanMessage(content="")
+            last_msg = msgs[-1] if msgs else HumanMessage(content="")
             if not isinstance(last_msg, HumanMessage):
                 last_msg = HumanMessage(content=last_msg.content)
 
             logger.debug(f"Processing message: {last_msg.content[:100]}...")
 
-            # Format tasks
-            task_messages = [
-                HumanMessage(content=
-                    f"Task: {task.content}\n"
-                    f"Priority: {task.priority}\n"
-                    f"Due: {task.due.string if task.due else 'No due date'}"
+            tasks = state.get("tasks", [])
+
+            # Serve the day's plan from the precomputed briefing while the tasks are unchanged
+            if (
+                self.briefings.enabled and not scratchpad and user_id.isdigit()
+                and self.briefings.matches(last_msg.content)
+            ):
+                briefing = self.briefings.lookup(
+                    int(user_id), self.task_store.tasks.values() if self.task_store is not None else tasks
                 )
-                for task in state["tasks"]
-            ]
+                if briefing:
+                    logger.info(f"Serving precomputed briefing to user {user_id}")
+                    return {"msgs": [AIMessage(content=briefing, response_metadata={"tier": "briefing"})]}
+
+            # Format tasks
+            relevant_messages: List[BaseMessage] = []
+            task_limit = self.search_limit if degraded else self.full_task_limit
+            # Completed tasks stay in the mirror for history but are not sent in full
+            open_count = sum(1 for task in tasks if not task.is_completed)
+            with span("chat.format_tasks"):
+                if self.task_store is not None and open_count > task_limit:
+                    task_messages = format_project_summary(self.task_store) + format_due_summary(self.task_store)
+                    matches = self.task_store.search(last_msg.content, self.search_limit)
+                    relevant_messages = format_relevant_tasks(matches)
+                    logger.debug(f"Sending {len(matches)} search matches instead of {open_count} open tasks")
+                elif self.task_store is not None and self.task_store.tree.has_subtasks:
+                    # Parents carry rollups; subtasks are only sent when the message matches them
+                    task_messages = format_task_outline(tasks, self.task_store) + format_due_summary(self.task_store)
+                    matches = [
+                        task for task in self.task_store.search(last_msg.content, self.search_limit)
+                        if self.task_store.tree.is_subtask(task.id)
+                    ]
+                    relevant_messages = format_relevant_tasks(matches)
+                else:
+                    task_messages = format_tasks(tasks) + format_due_summary(self.task_store)
+
+            # Precomputed completed-history analytics, if available
+            insights = state.get("insights")
+            insight_messages = [SystemMessage(content=insights)] if insights else []
 
             # Get chat history excluding the last message
-            chat_history = state["msgs"][:-1] if len(state["msgs"]) > 1 else []
+            chat_history = msgs[:-1] if len(msgs) > 1 else []
+
+            tier = self.router.route(
+                last_msg.content, open_count, in_tool_loop=bool(scratchpad),
+                history=chat_history,
+            )
+            if degraded:
+                tier = self.router.degrade(tier)
+                chat_history = trim_history(chat_history, self.degraded_history)
+            elif self.memory.enabled:
+                chat_history = trim_history(chat_history, self.history_limit)
+
+            memories = []
+            if tier != "canned":
+                with span("memory.retrieve"):
+                    memories = await self.memory.retrieve(user_id, last_msg.content)
 
             # Generate response with improved context
-            logger.debug("Generating AI response")
-            resp = await self.chain.ainvoke({
+            logger.debug(f"Generating AI response on {tier} tier")
+            resp = await self._generate(tier, {
                 "input": last_msg.content,
                 "chat_history": chat_history,
-                "tasks": task_messages
-            })
+                "tasks": task_messages,
+                "relevant_tasks": relevant_messages,
+                "insights": insight_messages,
+                "memories": format_memories(memories),
+                "scratchpad": scratchpad,
+            }, user_id)
             logger.info("Successfully generated AI response")
 
             return {"msgs": [resp]}
@@ -1,5 +1,5 @@
 import logging
-from ..state import State
+from ..state import RemoveTask, State, diff_tasks
 
 logger = logging.getLogger(__name__)  # Just get the logger, don't initialize
 
@@ -8,35 +8,46 @@ class GetTasksNode:
         self.logger = logger.getChild('GetTasksNode')
         self.todoist_client = todoist_client
 
-    async def __call__(self, state: State) -> State:
-        """Fetch current tasks from Todoist and merge with existing tasks"""
-        self.logger.debug("Fetching and merging Todoist tasks")
+    async def __call__(self, state: State) -> dict:
+        """Sync tasks from Todoist and emit only the tasks that changed or were removed"""
+        self.logger.debug("Fetching Todoist task updates")
         try:
             existing_tasks = state.get("tasks", [])
             self.logger.debug(f"Found {len(existing_tasks)} existing tasks")
 
+            metadata = self.todoist_client.metadata
+            store = self.todoist_client.store
+            revision = metadata.revision
             updates = await self.todoist_client.get_tasks()
             self.logger.debug(
                 f"Received {len(updates) if updates else 0} task updates from Todoist"
             )
 
-            if not updates:
-                self.logger.info(
-                    "No updates received from Todoist, returning existing state"
-                )
-                return state
-
-            # Merge tasks
-            tasks_by_id = {task.id: task for task in existing_tasks}
-            self.logger.debug("Merging tasks with updates")
-
-            for update in updates:
-                tasks_by_id[update.id] = update
-
-            merged_tasks = list(tasks_by_id.values())
-            self.logger.info(f"Successfully merged tasks. Total tasks: {len(merged_tasks)}")
-
-            return {"msgs": state.get("msgs", []), "tasks": merged_tasks}
+            metadata_changed = metadata.revision != revision
+            if metadata_changed:
+                # Renamed/removed projects or sections: re-join cached names locally
+                self.logger.debug("Metadata changed, re-annotating stored tasks")
+                reannotated = [
+                    annotated for task in store.tasks.values()
+                    if (annotated := metadata.annotate(task)) is not task
+                ]
+                store.apply(reannotated)
+
+            if not updates and not metadata_changed and len(existing_tasks) == len(store):
+                self.logger.info("No updates received from Todoist, state unchanged")
+                return {}
+
+            # The store already holds the merged result; state only needs the difference
+            delta = diff_tasks(existing_tasks, list(store.tasks.values()))
+            if not delta:
+                return {}
+
+            removed = sum(isinstance(task, RemoveTask) for task in delta)
+            self.logger.info(
+                f"Task delta: {len(delta) - removed} changed, {removed} removed. "
+                f"Total tasks: {len(store)}"
+            )
+            return {"tasks": delta}
 
         except Exception as e:
             self.logger.error("Error fetching/merging Todoist tasks", exc_info=True)
@@ -0,0 +1,42 @@
+import logging
+import os
+import time
+from typing import Dict
+from langchain_core.runnables import RunnableConfig
+from ..state import State
+from ..utils.history import format_summary, get_history_store
+
+logger = logging.getLogger(__name__)  # Just get the logger, don't initialize
+
+
+class InsightsNode:
+    def __init__(self, todoist_client):
+        self.logger = logger.getChild('InsightsNode')
+        self.todoist_client = todoist_client
+        self.refresh_interval = int(os.getenv("HISTORY_REFRESH_SECONDS", "3600"))
+        self._last_refresh: Dict[str, float] = {}
+
+    async def __call__(self, state: State, config: RunnableConfig) -> dict:
+        """Refresh completed-task history incrementally and emit its summary"""
+        user_id = str(config.get("configurable", {}).get("thread_id", ""))
+        if not user_id:
+            return {}
+
+        last_refresh = self._last_refresh.get(user_id, 0.0)
+        if state.get("insights") and time.monotonic() - last_refresh < self.refresh_interval:
+            self.logger.debug("Productivity summary is fresh, skipping refresh")
+            return {}
+
+        try:
+            store = get_history_store(user_id)
+            tz_name = self.todoist_client.metadata.timezone or "UTC"
+            await store.refresh(self.todoist_client, tz_name)
+            self._last_refresh[user_id] = time.monotonic()
+            summary = format_summary(store.summarize(tz_name))
+            self.logger.info(f"Computed productivity summary from {len(store)} completions")
+            return {"insights": summary}
+
+        except Exception:
+            # History is optional context; never block the reply on it
+            self.logger.error("Error refreshing completed history", exc_info=True)
+            return {}
@@ -0,0 +1,209 @@
+import asyncio
+import logging
+import uuid
+from typing import Any, Dict, List, Optional, Tuple
+from langchain_core.messages import AIMessage, ToolMessage
+from pydantic import BaseModel, Field
+from ..models import SimpleTask
+from ..state import RemoveTask, State
+
+logger = logging.getLogger(__name__)  # Just get the logger, don't initialize
+
+
+class AddTask(BaseModel):
+    """Create a new task in the user's Todoist."""
+
+    content: str = Field(description="Task title")
+    description: Optional[str] = Field(None, description="Longer task notes")
+    due_string: Optional[str] = Field(
+        None, description="Natural-language due date, e.g. 'tomorrow 9am' or 'every monday'"
+    )
+    priority: Optional[int] = Field(
+        None, ge=1, le=4, description="Todoist API priority: 4 is most urgent (p1), 1 is normal"
+    )
+    project_id: Optional[str] = Field(None, description="Project to add the task to")
+
+
+class CompleteTask(BaseModel):
+    """Mark one of the user's existing tasks as completed."""
+
+    task_id: str = Field(description="Id of the task to complete")
+
+
+class UpdateTask(BaseModel):
+    """Change the title, notes, due date or priority of an existing task."""
+
+    task_id: str = Field(description="Id of the task to update")
+    content: Optional[str] = Field(None, description="New task title")
+    description: Optional[str] = Field(None, description="New task notes")
+    due_string: Optional[str] = Field(None, description="New natural-language due date")
+    priority: Optional[int] = Field(None, ge=1, le=4, description="New Todoist API priority")
+
+
+class ListProjects(BaseModel):
+    """List the user's Todoist projects with their ids."""
+
+
+class ListSubtasks(BaseModel):
+    """List the subtasks of a task, nested, with their ids, due dates and status."""
+
+    task_id: str = Field(description="Id of the parent task")
+
+
+TODOIST_TOOLS = [AddTask, CompleteTask, UpdateTask, ListProjects, ListSubtasks]
+
+
+def build_command(name: str, args: Dict[str, Any]) -> Dict[str, Any]:
+    """Translate a write tool call into a Todoist Sync API command"""
+    if name == "AddTask":
+        call = AddTask(**args)
+        command_args = {"content": call.content}
+        if call.description:
+            command_args["description"] = call.description
+        if call.due_string:
+            command_args["due"] = {"string": call.due_string}
+        if call.priority:
+            command_args["priority"] = call.priority
+        if call.project_id:
+            command_args["project_id"] = call.project_id
+        return {"type": "item_add", "temp_id": str(uuid.uuid4()), "args": command_args}
+
+    if name == "CompleteTask":
+        call = CompleteTask(**args)
+        return {"type": "item_close", "args": {"id": call.task_id}}
+
+    if name == "UpdateTask":
+        call = UpdateTask(**args)
+        command_args = {"id": call.task_id}
+        for field in ("content", "description", "priority"):
+            value = getattr(call, field)
+            if value is not None:
+                command_args[field] = value
+        if call.due_string:
+            command_args["due"] = {"string": call.due_string}
+        return {"type": "item_update", "args": command_args}
+
+    raise ValueError(f"Unknown Todoist tool: {name}")
+
+
+class ToolsNode:
+    """Executes the tool calls of the latest AI message against Todoist.
+
+    All write calls from one model response are coalesced into a single Sync
+    API request; read-only calls run concurrently alongside it. Task deltas
+    returned by the request are merged into State.tasks directly.
+    """
+
+    READ_TOOLS = {"ListProjects", "ListSubtasks"}
+
+    def __init__(self, todoist_client):
+        self.logger = logger.getChild('ToolsNode')
+        self.todoist_client = todoist_client
+
+    async def __call__(self, state: State) -> dict:
+        last_msg = state["msgs"][-1] if state["msgs"] else None
+        if not isinstance(last_msg, AIMessage) or not last_msg.tool_calls:
+            return {}
+
+        tool_calls = last_msg.tool_calls
+        self.logger.info(f"Executing {len(tool_calls)} tool calls")
+
+        writes = [call for call in tool_calls if call["name"] not in self.READ_TOOLS]
+        reads = [call for call in tool_calls if call["name"] in self.READ_TOOLS]
+
+        results = await asyncio.gather(
+            self._run_writes(writes),
+            *(self._run_read(call) for call in reads),
+        )
+        write_messages, tasks = results[0]
+        messages = write_messages + list(results[1:])
+
+        # Answer tool calls in the order the model issued them
+        order = {call["id"]: index for index, call in enumerate(tool_calls)}
+        messages.sort(key=lambda message: order.get(message.tool_call_id, 0))
+
+        update: Dict[str, Any] = {"msgs": messages}
+        if tasks:
+            # Tasks the batch deleted are gone from the store; drop them from state too
+            store = self.todoist_client.store
+            update["tasks"] = [
+                task if task.id in store.tasks else RemoveTask(id=task.id) for task in tasks
+            ]
+        return update
+
+    async def _run_writes(self, calls: List[Dict[str, Any]]) -> Tuple[List[ToolMessage], List[SimpleTask]]:
+        if not calls:
+            return [], []
+
+        messages: List[ToolMessage] = []
+        commands: List[Dict[str, Any]] = []
+        pending: List[Tuple[Dict[str, Any], Dict[str, Any]]] = []
+        for call in calls:
+            try:
+                command = {**build_command(call["name"], call["args"]), "uuid": str(uuid.uuid4())}
+            except Exception as e:
+                messages.append(self._tool_message(call, f"error: invalid arguments ({e})"))
+                continue
+            commands.append(command)
+            pending.append((call, command))
+
+        if not commands:
+            return messages, []
+
+        try:
+            result, tasks = await self.todoist_client.execute_commands(commands)
+        except Exception as e:
+            self.logger.error("Todoist command batch failed", exc_info=True)
+            return messages + [
+                self._tool_message(call, f"error: Todoist request failed ({e})") for call, _ in pending
+            ], []
+
+        sync_status = result.get("sync_status", {})
+        temp_id_mapping = result.get("temp_id_mapping", {})
+        for call, command in pending:
+            status = sync_status.get(command["uuid"])
+            if status == "ok":
+                task_id = temp_id_mapping.get(command.get("temp_id"), command["args"].get("id"))
+                messages.append(self._tool_message(call, f"ok: task {task_id}"))
+            else:
+                error = status.get("error") if isinstance(status, dict) else "no status returned"
+                messages.append(self._tool_message(call, f"error: {error}"))
+
+        self.logger.info(f"Command batch applied, {len(tasks)} tasks updated")
+        return messages, tasks
+
+    async def _run_read(self, call: Dict[str, Any]) -> ToolMessage:
+        try:
+            if call["name"] == "ListSubtasks":
+                task_id = ListSubtasks(**call["args"]).task_id
+                listing = "\n".join(self._subtask_lines(task_id))
+                return self._tool_message(call, listing or f"Task {task_id} has no subtasks")
+
+            projects = await self.todoist_client.get_projects()
+            listing = "\n".join(f"{project.id}: {project.name}" for project in projects)
+            return self._tool_message(call, listing or "No projects")
+        except Exception as e:
+            self.logger.error(f"Tool {call['name']} failed", exc_info=True)
+            return self._tool_message(call, f"error: {e}")
+
+    def _subtask_lines(self, task_id: str, depth: int = 0) -> List[str]:
+        store = self.todoist_client.store
+        lines = []
+        for task in store.subtasks(task_id):
+            status = "x" if task.is_completed else " "
+            due = f", due {task.due.string}" if task.due else ""
+            lines.append(f"{'  ' * depth}- [{status}] {task.content} (ID {task.id}, priority {task.priority}{due})")
+            lines.extend(self._subtask_lines(task.id, depth + 1))
+        return lines
+
+    @staticmethod
+    def _tool_message(call: Dict[str, Any], content: str) -> ToolMessage:
+        return ToolMessage(content=content, tool_call_id=call["id"], name=call["name"])
+
+
+def route_tools(state: State) -> str:
+    """Route to the tools node when the model requested tool calls"""
+    last_msg = state["msgs"][-1] if state["msgs"] else None
+    if isinstance(last_msg, AIMessage) and last_msg.tool_calls:
+        return "tools"
+    return "end"
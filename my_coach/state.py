@@ -1,23 +1,44 @@
-from typing import Annotated, TypedDict, List
+from typing import Annotated, Optional, TypedDict, List, Union
 from langgraph.graph.message import add_messages
+from pydantic import BaseModel
 from .models import SimpleTask
 
 
-def add_tasks(left: List[SimpleTask], right: List[SimpleTask]) -> List[SimpleTask]:
-    """Custom reducer for tasks that handles merging by ID"""
+class RemoveTask(BaseModel):
+    """Task update that drops the task with this id from state"""
+    id: str
+
+
+def add_tasks(left: List[SimpleTask], right: List[Union[SimpleTask, RemoveTask]]) -> List[SimpleTask]:
+    """Custom reducer for tasks that applies upserts and removals by ID"""
     if not left:
         left = []
     if not right:
-        right = []
+        return left
 
     tasks_by_id = {task.id: task for task in left}
 
     for task in right:
-        tasks_by_id[task.id] = task
+        if isinstance(task, RemoveTask):
+            tasks_by_id.pop(task.id, None)
+        else:
+            tasks_by_id[task.id] = task
 
     return list(tasks_by_id.values())
 
 
+def diff_tasks(current: List[SimpleTask], target: List[SimpleTask]) -> List[Union[SimpleTask, RemoveTask]]:
+    """Updates that turn the current task list into the target one"""
+    current_by_id = {task.id: task for task in current}
+    target_ids = {task.id for task in target}
+    changed: List[Union[SimpleTask, RemoveTask]] = [
+        task for task in target if current_by_id.get(task.id) != task
+    ]
+    changed.extend(RemoveTask(id=task_id) for task_id in current_by_id if task_id not in target_ids)
+    return changed
+
+
 class State(TypedDict):
     msgs: Annotated[list, add_messages]
     tasks: Annotated[List[SimpleTask], add_tasks]
+    insights: Optional[str]
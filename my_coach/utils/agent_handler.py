@@ -1,5 +1,8 @@
 import logging
 from typing import Any, Optional, Callable
+from .usage import usage_tracker
+from .long_term_memory import memory_manager
+from .profiling import ProfilingCallbackHandler, profiler
 
 # Configure logging
 logger = logging.getLogger(__name__)
@@ -11,6 +14,7 @@ async def handle_agent_interaction(
     send_message: Callable[[str], Any],
     show_typing: Optional[Callable[[], Any]] = None,
     user_id: str = "",
+    send_error: Optional[Callable[[str], Any]] = None,
 ) -> None:
     """
     Handle interaction with the LangGraph agent.
@@ -21,19 +25,30 @@ async def handle_agent_interaction(
         send_message: Async callback to send messages back to the user
         show_typing: Optional callback to show typing indicator
         user_id: Unique identifier for the user (from Telegram)
+        send_error: Optional async callback for the error notice, so it is not
+            handled as a reply; defaults to send_message
     """
     logger.info(f"Starting agent interaction for user_id: {user_id}")
     logger.debug(f"Received message: {message_text[:100]}...")  # Truncate long messages
     
     try:
+        # Users over their daily quota are served with a cheaper model and less context
+        degraded = await usage_tracker.over_quota(str(user_id))
+
         # Configure thread ID for state management
         config = {
             "configurable": {
                 "thread_id": str(user_id),
+                "degraded": degraded,
             }
         }
         logger.debug(f"Configured thread with ID: {user_id}")
 
+        # Callbacks are only attached to profiled requests
+        profile = profiler.begin(str(user_id))
+        if profile:
+            config["callbacks"] = [ProfilingCallbackHandler(profile)]
+
         new_message = {"role": "user", "msgs": message_text}
         
         # Show typing indicator if callback provided
@@ -45,12 +60,17 @@ async def handle_agent_interaction(
         logger.debug("Starting message stream processing")
 
         # Use user-specific graph instance with config
-        async for chunk in graph.astream(new_message, config, stream_mode="values"):
-            if "msgs" in chunk:
-                last_event = chunk["msgs"][-1]
-                if last_event.content:
-                    final_content = last_event.content
-                    logger.debug("Received content chunk from stream")
+        try:
+            with profiler.activate(profile):
+                async for chunk in graph.astream(new_message, config, stream_mode="values"):
+                    if "msgs" in chunk:
+                        last_event = chunk["msgs"][-1]
+                        if last_event.content:
+                            final_content = last_event.content
+                            logger.debug("Received content chunk from stream")
+        finally:
+            if profile:
+                profiler.finish(profile)
 
         logger.debug("Stream processing completed")
         
@@ -63,6 +83,10 @@ async def handle_agent_interaction(
         await send_message(final_content)
         logger.info(f"Response sent to user {user_id}")
 
+        # Learn durable facts from the exchange off the reply path
+        if final_content:
+            memory_manager.schedule_extraction(str(user_id), message_text, final_content)
+
     except Exception as e:
         error_msg = "Sorry, I encountered an error. Please try again later."
         logger.error(
@@ -73,5 +97,5 @@ async def handle_agent_interaction(
                 "message_text": message_text[:100],  # Truncate for logging
             }
         )
-        await send_message(error_msg)
+        await (send_error or send_message)(error_msg)
         logger.info(f"Error message sent to user {user_id}")
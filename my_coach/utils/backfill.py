@@ -0,0 +1,308 @@
+import asyncio
+import logging
+import os
+import sqlite3
+import time
+import uuid
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+import httpx
+from pydantic import BaseModel
+from .metrics import metrics
+from .runtime import data_path
+
+logger = logging.getLogger(__name__)
+
+FULL = "full"
+DELTA = "delta"
+
+
+def new_job_id() -> str:
+    return uuid.uuid4().hex[:8]
+
+
+class AccountRateLimiter:
+    """Token bucket per Todoist account, shared by every sync of that account"""
+
+    def __init__(self, rate_per_minute: float, burst: Optional[int] = None):
+        self.rate = rate_per_minute / 60
+        self.burst = burst or max(1, int(rate_per_minute // 6))
+        # Account -> (tokens, last refill)
+        self._buckets: Dict[str, Tuple[float, float]] = {}
+        self._locks: Dict[str, asyncio.Lock] = {}
+
+    async def acquire(self, account: str) -> None:
+        lock = self._locks.setdefault(account, asyncio.Lock())
+        # Waiters queue on the lock so tokens are handed out in order
+        async with lock:
+            while True:
+                now = time.monotonic()
+                tokens, refilled = self._buckets.get(account, (float(self.burst), now))
+                tokens = min(float(self.burst), tokens + (now - refilled) * self.rate)
+                if tokens >= 1:
+                    self._buckets[account] = (tokens - 1, now)
+                    return
+                self._buckets[account] = (tokens, now)
+                await asyncio.sleep((1 - tokens) / self.rate)
+
+
+class BackfillProgress(BaseModel):
+    """State of one re-sync job, persisted after every page"""
+
+    job_id: str
+    mode: str
+    # Every user id up to and including the cursor has been processed
+    cursor: int = 0
+    synced: int = 0
+    failed: int = 0
+    skipped: int = 0
+    # Seconds spent running, excluding time the job was interrupted
+    elapsed: float = 0.0
+    started_at: float
+    updated_at: float
+    finished_at: Optional[float] = None
+
+    @property
+    def processed(self) -> int:
+        return self.synced + self.failed
+
+    @property
+    def throughput(self) -> float:
+        """Users processed per second while running"""
+        return self.processed / self.elapsed if self.elapsed else 0.0
+
+    @classmethod
+    def combine(cls, parts: List["BackfillProgress"]) -> "BackfillProgress":
+        """Progress of a job run in shares by several workers.
+
+        Each worker counts the users owned by others as skipped, so skipped
+        is not meaningful across workers and is left at zero.
+        """
+        finished = [part.finished_at for part in parts]
+        return cls(
+            job_id=parts[0].job_id, mode=parts[0].mode,
+            cursor=min(part.cursor for part in parts),
+            synced=sum(part.synced for part in parts),
+            failed=sum(part.failed for part in parts),
+            # Shares run in parallel
+            elapsed=max(part.elapsed for part in parts),
+            started_at=min(part.started_at for part in parts),
+            updated_at=max(part.updated_at for part in parts),
+            finished_at=max(finished) if all(finished) else None,
+        )
+
+    def describe(self, running: bool = True) -> str:
+        state = "finished" if self.finished_at else "at" if running else "stopped at"
+        return (
+            f"Re-sync {self.job_id} ({self.mode}) {state} user {self.cursor}: "
+            f"{self.synced} synced, {self.failed} failed, {self.skipped} skipped, "
+            f"{self.throughput:.1f} users/s over {self.elapsed:.0f}s"
+        )
+
+
+class BackfillRunner:
+    """Bulk Todoist re-sync of every user, for outages and schema changes.
+
+    Users are read from Supabase a page at a time in id order and synced
+    through their sessions in the registry, with bounded concurrency and a
+    per-account request rate. Users with a loaded session are synced in
+    place, so chat turns see the result immediately. For the rest, a session
+    is loaded, synced, snapshotted and evicted again, so the next message
+    warm-starts from the fresh snapshot without the job holding every user
+    in memory. Progress is saved after every page, and a stopped or
+    interrupted job resumes after the last completed page.
+    """
+
+    def __init__(self, sessions, fetch_user_ids: Callable[[int, int], Awaitable[List[int]]],
+                 path: Optional[str] = None, concurrency: Optional[int] = None,
+                 page_size: Optional[int] = None, account_rate: Optional[float] = None):
+        self.logger = logger.getChild('BackfillRunner')
+        self.sessions = sessions
+        self.fetch_user_ids = fetch_user_ids
+        self.concurrency = concurrency or int(os.getenv("BACKFILL_CONCURRENCY", "8"))
+        self.page_size = page_size or int(os.getenv("BACKFILL_PAGE_SIZE", "100"))
+        # Todoist allows 1000 sync requests per account per 15 minutes; leave room for live traffic
+        self.limiter = AccountRateLimiter(account_rate or float(os.getenv("BACKFILL_ACCOUNT_RATE", "30")))
+        self.retries = int(os.getenv("BACKFILL_RETRIES", "3"))
+        # Which users this process syncs; set by clustered workers
+        self.owns: Callable[[int], bool] = lambda user_id: True
+        # Called with the progress and whether the job is running, e.g. to share it across workers
+        self.on_progress: Optional[Callable[[BackfillProgress, bool], Awaitable[None]]] = None
+        self.path = path or os.getenv("BACKFILL_DB_PATH") or data_path("backfill.db")
+        self._conn: Optional[sqlite3.Connection] = None
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        self.task: Optional[asyncio.Task] = None
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        if self._conn is None:
+            Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(self.path)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS backfill_jobs ("
+                "job_id TEXT PRIMARY KEY, progress TEXT NOT NULL, updated_at REAL NOT NULL)"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS backfill_failures ("
+                "job_id TEXT NOT NULL, user_id INTEGER NOT NULL, error TEXT NOT NULL, "
+                "PRIMARY KEY (job_id, user_id))"
+            )
+            self._conn.commit()
+        return self._conn
+
+    @property
+    def running(self) -> bool:
+        return self.task is not None and not self.task.done()
+
+    def latest(self) -> Optional[BackfillProgress]:
+        row = self.conn.execute(
+            "SELECT progress FROM backfill_jobs ORDER BY updated_at DESC LIMIT 1"
+        ).fetchone()
+        return BackfillProgress.model_validate_json(row[0]) if row else None
+
+    def failures(self, job_id: str, limit: int = 20) -> List[Tuple[int, str]]:
+        return self.conn.execute(
+            "SELECT user_id, error FROM backfill_failures WHERE job_id = ? ORDER BY user_id LIMIT ?",
+            (job_id, limit),
+        ).fetchall()
+
+    def _save(self, progress: BackfillProgress) -> None:
+        progress.updated_at = time.time()
+        self.conn.execute(
+            "INSERT OR REPLACE INTO backfill_jobs (job_id, progress, updated_at) VALUES (?, ?, ?)",
+            (progress.job_id, progress.model_dump_json(), progress.updated_at),
+        )
+        self.conn.commit()
+
+    def start(self, mode: str = DELTA, resume: bool = False, job_id: Optional[str] = None) -> BackfillProgress:
+        """Start a new job, or resume the latest unfinished one, in the background
+
+        Workers running shares of the same job are given the same `job_id`.
+        """
+        if self.running:
+            raise RuntimeError("A re-sync is already running")
+        if resume:
+            progress = self.latest()
+            if progress is None or progress.finished_at:
+                raise ValueError("No unfinished re-sync to resume")
+        else:
+            if mode not in (FULL, DELTA):
+                raise ValueError(f"Unknown re-sync mode: {mode}")
+            now = time.time()
+            progress = BackfillProgress(job_id=job_id or new_job_id(), mode=mode, started_at=now, updated_at=now)
+            self._save(progress)
+        self.task = asyncio.create_task(self.run(progress))
+        # Failures are logged and kept in the progress; mark them retrieved
+        self.task.add_done_callback(lambda task: task.cancelled() or task.exception())
+        return progress
+
+    async def stop(self) -> bool:
+        """Stop the running job; it can be resumed later"""
+        if not self.running:
+            return False
+        self.task.cancel()
+        await asyncio.gather(self.task, return_exceptions=True)
+        return True
+
+    async def sync_user(self, user_id: int, mode: str) -> None:
+        """Sync one user's tasks into the store their chat turns read from"""
+        loaded = self.sessions.peek(user_id) is not None
+        # Not touched, so the job does not keep idle sessions alive
+        session = self.sessions.get(user_id, touch=False)
+        client = session.todoist_client
+        if mode == FULL:
+            # A full sync replaces the mirror, dropping anything a delta would miss
+            client.sync_token = "*"
+
+        snapshots = self.sessions.snapshots
+        synced = False
+        try:
+            for attempt in range(self.retries + 1):
+                await self.limiter.acquire(client.api_token)
+                try:
+                    await client.get_tasks()
+                    break
+                except httpx.HTTPStatusError as e:
+                    if e.response.status_code != 429 or attempt == self.retries:
+                        raise
+                    metrics.incr("backfill.throttled")
+                    await asyncio.sleep(float(e.response.headers.get("Retry-After", 5 * 2 ** attempt)))
+            if snapshots:
+                await snapshots.asave(session)
+            synced = True
+        finally:
+            # Release sessions loaded only for the job, unless the user showed up meanwhile.
+            # Without snapshots a synced session is kept, as evicting it would discard the sync.
+            if not loaded and session.last_seen == session.created_at and (snapshots or not synced):
+                self.sessions.evict(user_id)
+
+    async def _sync_one(self, job_id: str, user_id: int, mode: str) -> bool:
+        async with self._semaphore:
+            started = time.perf_counter()
+            try:
+                await self.sync_user(user_id, mode)
+            except Exception as e:
+                metrics.incr("backfill.failed")
+                self.logger.error("Error re-syncing user", exc_info=True, extra={"user_id": user_id})
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO backfill_failures (job_id, user_id, error) VALUES (?, ?, ?)",
+                    (job_id, user_id, f"{type(e).__name__}: {e}"[:500]),
+                )
+                self.conn.commit()
+                return False
+            metrics.incr("backfill.synced")
+            metrics.observe("backfill.latency", time.perf_counter() - started)
+            return True
+
+    async def _report(self, progress: BackfillProgress, running: bool) -> None:
+        if self.on_progress is None:
+            return
+        try:
+            await self.on_progress(progress, running)
+        except Exception:
+            self.logger.warning("Failed to report re-sync progress", exc_info=True)
+
+    async def run(self, progress: BackfillProgress) -> BackfillProgress:
+        self.logger.info(f"Starting re-sync {progress.job_id} ({progress.mode}) after user {progress.cursor}")
+        try:
+            await self._report(progress, True)
+            while True:
+                page_started = time.perf_counter()
+                user_ids = await self.fetch_user_ids(progress.cursor, self.page_size)
+                if not user_ids:
+                    break
+                owned = [user_id for user_id in user_ids if self.owns(user_id)]
+                results = await asyncio.gather(
+                    *(self._sync_one(progress.job_id, user_id, progress.mode) for user_id in owned)
+                )
+                progress.synced += sum(results)
+                progress.failed += len(results) - sum(results)
+                progress.skipped += len(user_ids) - len(owned)
+                progress.cursor = user_ids[-1]
+                progress.elapsed += time.perf_counter() - page_started
+                self._save(progress)
+                await self._report(progress, True)
+                self.logger.info(progress.describe())
+                if len(user_ids) < self.page_size:
+                    break
+        except asyncio.CancelledError:
+            self.logger.info(f"Re-sync {progress.job_id} stopped after user {progress.cursor}")
+            await self._report(progress, False)
+            raise
+        except Exception:
+            self.logger.error("Re-sync failed, resume to continue", exc_info=True,
+                              extra={"job_id": progress.job_id, "cursor": progress.cursor})
+            await self._report(progress, False)
+            raise
+
+        progress.finished_at = time.time()
+        self._save(progress)
+        await self._report(progress, False)
+        self.logger.info(progress.describe())
+        return progress
+
+    def close(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
@@ -0,0 +1,306 @@
+import asyncio
+import hashlib
+import logging
+import os
+import re
+import sqlite3
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional
+from langchain_core.messages import HumanMessage, SystemMessage
+from pydantic import BaseModel, ValidationError
+from ..models import SimpleTask, UserPreferences
+from .due_index import get_zone
+from .metrics import metrics
+from .model_router import ModelRouter
+from .usage import usage_tracker
+
+logger = logging.getLogger(__name__)
+
+# The whole message must ask for today's plan, optionally after a greeting
+BRIEFING_PATTERN = re.compile(
+    r"^\s*(?:(?:hi|hello|hey|good morning|morning|gm)\b[\s!,.]*)?"
+    r"(?:what should i (?:focus|work) on today"
+    r"|what (?:should|do) i (?:do|tackle|prioriti[sz]e) today"
+    r"|what(?:'?s| is) (?:on )?(?:my )?(?:plan|agenda|schedule|focus) (?:for )?today"
+    r"|(?:my )?(?:plan|agenda|priorities|focus) for today"
+    r"|(?:my )?(?:morning|daily) (?:briefing|plan|summary)"
+    r"|brief me)"
+    r"(?:,? please)?[\s?!.🙏]*$",
+    re.IGNORECASE,
+)
+
+BRIEFING_PROMPT = """Write my briefing for today, {day}.
+Name the three tasks I should focus on first and why, point out anything overdue, and end with one practical tip.
+Keep it under 200 words."""
+
+
+class Briefing(BaseModel):
+    """A user's precomputed plan for one local day"""
+
+    user_id: int
+    day: str
+    timezone: str
+    # Fingerprint of the open tasks the briefing was written from
+    fingerprint: str
+    content: str
+    created_at: float
+    # Served until this time; later in the day the question goes to the model
+    expires_at: Optional[float] = None
+
+
+def task_fingerprint(tasks: Iterable[SimpleTask]) -> str:
+    """Digest of the task fields a briefing depends on"""
+    digest = hashlib.blake2b(digest_size=16)
+    for task in sorted(tasks, key=lambda task: (len(task.id), task.id)):
+        if task.is_completed:
+            continue
+        due = task.due
+        digest.update(
+            f"{task.id}\x1f{task.content}\x1f{task.priority}\x1f{task.project_id}\x1f"
+            f"{due.date if due else ''}\x1f{due.datetime if due else ''}\x1e".encode()
+        )
+    return digest.hexdigest()
+
+
+def local_day(tz_name: str, now: Optional[datetime] = None) -> str:
+    return (now or datetime.now(timezone.utc)).astimezone(get_zone(tz_name)).date().isoformat()
+
+
+def summary_at(preferences: UserPreferences, now: Optional[datetime] = None) -> datetime:
+    """Today's daily summary time in the user's zone, as an aware datetime"""
+    zone = get_zone(preferences.timezone)
+    local_now = (now or datetime.now(timezone.utc)).astimezone(zone)
+    hour, minute = (int(part) for part in preferences.daily_summary_time.split(":")[:2])
+    return local_now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+
+
+class BriefingService:
+    """Daily plans generated ahead of each user's summary time.
+
+    A background loop picks the users whose daily summary time is within the
+    lead window and writes their briefing with bounded concurrency, so the
+    morning "what should I focus on today?" spike is served from storage
+    instead of the model. Each briefing records a fingerprint of the open
+    tasks it was written from; once the tasks differ it is dropped and the
+    question goes to the model as usual.
+    """
+
+    def __init__(self, path: Optional[str] = None, concurrency: Optional[int] = None,
+                 lead_minutes: Optional[float] = None, interval: Optional[float] = None):
+        self.logger = logger.getChild('BriefingService')
+        self.enabled = os.getenv("BRIEFINGS_ENABLED", "true").lower() == "true"
+        self.concurrency = concurrency or int(os.getenv("BRIEFING_CONCURRENCY", "4"))
+        self.lead = timedelta(minutes=lead_minutes or float(os.getenv("BRIEFING_LEAD_MINUTES", "180")))
+        self.interval = interval or float(os.getenv("BRIEFING_INTERVAL", "600"))
+        self.tier = os.getenv("BRIEFING_TIER", "full")
+        self.serve_window = timedelta(hours=float(os.getenv("BRIEFING_SERVE_HOURS", "6")))
+        self.router = ModelRouter()
+        # Which users this process generates for; set by clustered workers
+        self.owns: Callable[[int], bool] = lambda user_id: True
+        self.cache: Dict[int, Optional[Briefing]] = {}
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        self.path = path or os.getenv("BRIEFING_DB_PATH", "data/briefings.db")
+        self._conn: Optional[sqlite3.Connection] = None
+        self._llm = None
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        if self._conn is None:
+            Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(self.path)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS briefings ("
+                "user_id INTEGER PRIMARY KEY, day TEXT NOT NULL, timezone TEXT NOT NULL, "
+                "fingerprint TEXT NOT NULL, content TEXT NOT NULL, created_at REAL NOT NULL, "
+                "expires_at REAL)"
+            )
+            columns = {row[1] for row in self._conn.execute("PRAGMA table_info(briefings)")}
+            if "expires_at" not in columns:
+                self._conn.execute("ALTER TABLE briefings ADD COLUMN expires_at REAL")
+            self._conn.commit()
+        return self._conn
+
+    @property
+    def llm(self):
+        if self._llm is None:
+            self._llm = self.router.create_llm(self.tier)
+        return self._llm
+
+    @staticmethod
+    def matches(text: str) -> bool:
+        """Whether a message asks for the day's plan and nothing else"""
+        return len(text) <= 200 and BRIEFING_PATTERN.match(text) is not None
+
+    def get(self, user_id: int) -> Optional[Briefing]:
+        if user_id not in self.cache:
+            row = self.conn.execute(
+                "SELECT day, timezone, fingerprint, content, created_at, expires_at FROM briefings "
+                "WHERE user_id = ?",
+                (user_id,),
+            ).fetchone()
+            self.cache[user_id] = Briefing(
+                user_id=user_id, day=row[0], timezone=row[1], fingerprint=row[2],
+                content=row[3], created_at=row[4], expires_at=row[5],
+            ) if row else None
+        return self.cache[user_id]
+
+    def save(self, briefing: Briefing) -> None:
+        self.conn.execute(
+            "INSERT OR REPLACE INTO briefings "
+            "(user_id, day, timezone, fingerprint, content, created_at, expires_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (briefing.user_id, briefing.day, briefing.timezone, briefing.fingerprint,
+             briefing.content, briefing.created_at, briefing.expires_at),
+        )
+        self.conn.commit()
+        self.cache[briefing.user_id] = briefing
+
+    def invalidate(self, user_id: int) -> None:
+        self.conn.execute("DELETE FROM briefings WHERE user_id = ?", (user_id,))
+        self.conn.commit()
+        self.cache[user_id] = None
+
+    def lookup(self, user_id: int, tasks: Iterable[SimpleTask]) -> Optional[str]:
+        """Today's briefing for the user, if it still matches their tasks"""
+        briefing = self.get(user_id)
+        if briefing is None or briefing.day != local_day(briefing.timezone):
+            metrics.incr("briefings.miss")
+            return None
+        if briefing.expires_at is not None and time.time() > briefing.expires_at:
+            metrics.incr("briefings.expired")
+            return None
+        if briefing.fingerprint != task_fingerprint(tasks):
+            self.logger.info(f"Tasks changed since briefing for user {user_id}, invalidating")
+            self.invalidate(user_id)
+            metrics.incr("briefings.invalidated")
+            return None
+        metrics.incr("briefings.served")
+        return briefing.content
+
+    def due(self, preferences: UserPreferences, now: Optional[datetime] = None) -> bool:
+        """Whether the user's summary time is within the lead window"""
+        now = now or datetime.now(timezone.utc)
+        if not preferences.daily_summary_enabled or not self.owns(preferences.user_id):
+            return False
+        try:
+            at = summary_at(preferences, now)
+        except ValueError:
+            return False
+        return at - self.lead <= now <= at
+
+    async def generate(self, preferences: UserPreferences, sessions: Any) -> Optional[Briefing]:
+        """Write one user's briefing from their current tasks"""
+        from ..nodes.chat import format_due_summary, format_tasks
+        from .prompts import system_prompt
+
+        async with self._semaphore:
+            user_id = preferences.user_id
+            started = time.perf_counter()
+            loaded = sessions.peek(user_id) is not None
+            session = None
+            generated = False
+            try:
+                # Not touched, so the batch does not keep idle sessions alive
+                session = sessions.get(user_id, touch=False)
+                client = session.todoist_client
+                await client.get_tasks()
+                store = client.store
+                tasks = list(store.tasks.values())
+                day = local_day(preferences.timezone)
+
+                resp = await asyncio.wait_for(
+                    self.llm.ainvoke(
+                        [SystemMessage(content=system_prompt)]
+                        + format_tasks(tasks)
+                        + format_due_summary(store)
+                        + [HumanMessage(content=BRIEFING_PROMPT.format(day=day))]
+                    ),
+                    timeout=self.router.tiers[self.tier].timeout,
+                )
+                elapsed = time.perf_counter() - started
+                usage = getattr(resp, "usage_metadata", None)
+                cost = self.router.record(self.tier, elapsed, usage)
+                usage_tracker.record(str(user_id), usage, cost)
+
+                briefing = Briefing(
+                    user_id=user_id, day=day, timezone=preferences.timezone,
+                    fingerprint=task_fingerprint(tasks), content=resp.content,
+                    created_at=time.time(),
+                    expires_at=(summary_at(preferences) + self.serve_window).timestamp(),
+                )
+                self.save(briefing)
+                metrics.incr("briefings.generated")
+                metrics.observe("briefings.latency", elapsed)
+                generated = True
+                if sessions.snapshots:
+                    await sessions.snapshots.asave(session)
+                return briefing
+
+            except Exception:
+                metrics.incr("briefings.errors")
+                self.logger.error("Error generating briefing", exc_info=True, extra={"user_id": user_id})
+                return None
+
+            finally:
+                # Release sessions loaded only for the briefing, unless the user showed up
+                # meanwhile. Without snapshots a synced session is kept until the reaper
+                # takes it, as evicting it would discard the sync.
+                if (session is not None and not loaded and session.last_seen == session.created_at
+                        and (sessions.snapshots or not generated)):
+                    sessions.evict(user_id)
+
+    def stale(self, preferences: UserPreferences, sessions: Any) -> bool:
+        """Whether a due user still needs a briefing for today"""
+        briefing = self.get(preferences.user_id)
+        if briefing is None or briefing.day != local_day(preferences.timezone):
+            return True
+        # Tasks of users with a loaded session are current; compare without a sync
+        session = sessions.peek(preferences.user_id)
+        return session is not None and briefing.fingerprint != task_fingerprint(
+            session.todoist_client.store.tasks.values()
+        )
+
+    async def run_batch(self, users: Iterable[Dict[str, Any]], sessions: Any,
+                        now: Optional[datetime] = None) -> int:
+        """Generate briefings for every due user without a current one"""
+        pending: List[UserPreferences] = []
+        for row in users:
+            try:
+                preferences = UserPreferences(**row)
+            except ValidationError:
+                metrics.incr("briefings.invalid_preferences")
+                self.logger.warning(
+                    "Skipping invalid preferences row", exc_info=True, extra={"user_id": row.get("user_id")}
+                )
+                continue
+            if self.due(preferences, now) and self.stale(preferences, sessions):
+                pending.append(preferences)
+        if not pending:
+            return 0
+
+        started = time.perf_counter()
+        results = await asyncio.gather(*(self.generate(preferences, sessions) for preferences in pending))
+        generated = sum(1 for briefing in results if briefing)
+        self.logger.info(
+            f"Generated {generated}/{len(pending)} briefings in {time.perf_counter() - started:.1f}s"
+        )
+        return generated
+
+    async def run(self, fetch_users: Callable[[], Awaitable[List[Dict[str, Any]]]], sessions: Any) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.run_batch(await fetch_users(), sessions)
+            except Exception:
+                self.logger.error("Error in briefing batch", exc_info=True)
+
+    def close(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+
+briefing_service = BriefingService()
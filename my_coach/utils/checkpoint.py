@@ -0,0 +1,59 @@
+import logging
+from collections import defaultdict
+from typing import Any, Dict, Sequence, Tuple
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.memory import MemorySaver
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class MeasuredMemorySaver(MemorySaver):
+    """MemorySaver that accounts for the serialized bytes it stores.
+
+    Sizes are taken by serializing the checkpoint and writes passed in with
+    the saver's own serde, the way the base class stores them, so they do
+    not depend on its storage layout. Totals are kept per thread and
+    observed in metrics as checkpoint.bytes (updated channels plus
+    checkpoint header) and checkpoint.write_bytes (pending node writes).
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.logger = logger.getChild('MeasuredMemorySaver')
+        self.bytes_by_thread: Dict[str, int] = defaultdict(int)
+
+    def _size(self, value: Any) -> int:
+        return len(self.serde.dumps_typed(value)[1])
+
+    def put(self, config: RunnableConfig, checkpoint, metadata, new_versions) -> RunnableConfig:
+        next_config = super().put(config, checkpoint, metadata, new_versions)
+        thread_id = config["configurable"]["thread_id"]
+
+        # Only channels with a new version are stored again
+        header = {key: value for key, value in checkpoint.items() if key != "channel_values"}
+        values = checkpoint["channel_values"]
+        size = sum(self._size(values[channel]) for channel in new_versions if channel in values)
+        size += self._size(header) + self._size(metadata)
+
+        self._record(thread_id, "checkpoint.bytes", size)
+        self.logger.debug(
+            f"Checkpoint for thread {thread_id}: {size} bytes, "
+            f"{len(new_versions)} channels updated"
+        )
+        return next_config
+
+    def put_writes(self, config: RunnableConfig, writes: Sequence[Tuple[str, Any]],
+                   task_id: str, task_path: str = "") -> None:
+        super().put_writes(config, writes, task_id, task_path)
+        size = sum(self._size(value) for _, value in writes)
+        self._record(config["configurable"]["thread_id"], "checkpoint.write_bytes", size)
+
+    def delete_thread(self, thread_id: str) -> None:
+        super().delete_thread(thread_id)
+        self.bytes_by_thread.pop(thread_id, None)
+
+    def _record(self, thread_id: str, name: str, size: int) -> None:
+        self.bytes_by_thread[thread_id] += size
+        metrics.observe(name, size)
+        metrics.incr(f"{name}_total", size)
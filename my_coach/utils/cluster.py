@@ -0,0 +1,240 @@
+import asyncio
+import bisect
+import hashlib
+import inspect
+import logging
+import os
+from typing import Any, Callable, Dict, List, Optional
+import redis.asyncio as redis
+from .metrics import metrics
+from .runtime import json_dumps, json_loads
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = "focuscoach"
+INVALIDATION_CHANNEL = f"{KEY_PREFIX}:invalidate"
+RESYNC_LATEST_KEY = f"{KEY_PREFIX}:resync:latest"
+# Re-sync progress reports are kept for a week
+RESYNC_REPORT_TTL = 7 * 24 * 3600
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], "big")
+
+
+class HashRing:
+    """Consistent-hash ring mapping user ids to worker ids.
+
+    Each worker owns `replicas` virtual points so load spreads evenly and
+    adding or removing a worker only moves the users adjacent to its points.
+    """
+
+    def __init__(self, nodes: List[str], replicas: int = 128):
+        if not nodes:
+            raise ValueError("HashRing needs at least one node")
+        self.nodes = list(nodes)
+        points = sorted(
+            (_hash(f"{node}#{replica}"), node) for node in nodes for replica in range(replicas)
+        )
+        self._keys = [point for point, _ in points]
+        self._owners = [node for _, node in points]
+
+    def node_for(self, key: Any) -> str:
+        index = bisect.bisect(self._keys, _hash(str(key))) % len(self._keys)
+        return self._owners[index]
+
+
+def update_user_id(update: Dict[str, Any]) -> Optional[int]:
+    """Telegram user id an update belongs to, used as the shard key"""
+    for field in ("message", "edited_message", "callback_query", "inline_query",
+                  "my_chat_member", "chat_member", "pre_checkout_query", "shipping_query"):
+        event = update.get(field)
+        # Telegram's field is "from"; pydantic dumps without aliases use "from_user"
+        sender = event and (event.get("from") or event.get("from_user"))
+        if sender:
+            return sender["id"]
+    return None
+
+
+class ClusterCoordinator:
+    """Redis-backed routing of Telegram updates to worker shards plus
+    pub/sub invalidation of per-user caches across processes.
+
+    One ingress process polls Telegram and pushes each update to the list of
+    the worker that owns the user on the hash ring; each worker consumes only
+    its own list, so a user's updates are processed in order by one process.
+    Admin commands that every worker must run are broadcast on the same
+    channel as invalidations and handled by `command_handlers`.
+    """
+
+    MAX_ROUTE_ATTEMPTS = 5
+
+    def __init__(self, redis_url: Optional[str] = None, worker_id: Optional[str] = None,
+                 workers: Optional[List[str]] = None):
+        self.logger = logger.getChild('ClusterCoordinator')
+        self.redis = redis.from_url(redis_url or os.environ["REDIS_URL"], decode_responses=True)
+        self.worker_id = worker_id or os.getenv("WORKER_ID", "worker-0")
+        worker_ids = workers or [
+            worker.strip() for worker in os.getenv("WORKER_IDS", self.worker_id).split(",")
+            if worker.strip()
+        ]
+        self.ring = HashRing(worker_ids)
+        # Command name -> handler called with the command's arguments
+        self.command_handlers: Dict[str, Callable[..., Any]] = {}
+        self.logger.info(
+            f"Cluster member {self.worker_id} of {len(worker_ids)} workers: {worker_ids}"
+        )
+
+    @staticmethod
+    def shard_key(worker_id: str) -> str:
+        return f"{KEY_PREFIX}:shard:{worker_id}"
+
+    def owner(self, user_id: Any) -> str:
+        return self.ring.node_for(user_id)
+
+    async def route_update(self, update: Dict[str, Any]) -> str:
+        """Queue an update on the shard of the worker that owns its user"""
+        user_id = update_user_id(update)
+        worker = self.owner(user_id if user_id is not None else update.get("update_id", 0))
+        await self.redis.rpush(self.shard_key(worker), json_dumps(update))
+        metrics.incr(f"cluster.routed.{worker}")
+        return worker
+
+    async def run_ingress(self, bot, poll_timeout: int = 30) -> None:
+        """Poll Telegram and fan updates out to worker shards"""
+        offset: Optional[int] = None
+        # Consecutive routing failures of the update at the offset
+        failures = 0
+        self.logger.info("Starting ingress polling")
+        while True:
+            try:
+                updates = await bot.get_updates(offset=offset, timeout=poll_timeout)
+            except Exception:
+                self.logger.error("Failed to poll Telegram updates", exc_info=True)
+                await asyncio.sleep(1)
+                continue
+            for update in updates:
+                try:
+                    await self.route_update(update.model_dump(mode="json", exclude_none=True, by_alias=True))
+                except Exception as e:
+                    failures += 1
+                    metrics.incr("cluster.route_errors")
+                    self.logger.error(
+                        "Failed to route update", exc_info=True,
+                        extra={"update_id": update.update_id, "attempt": failures},
+                    )
+                    # Redis being down is retried indefinitely; an update that
+                    # cannot be routed for any other reason is eventually dropped
+                    if isinstance(e, redis.RedisError) or failures < self.MAX_ROUTE_ATTEMPTS:
+                        # Offset stays put, so the update is fetched and routed again
+                        await asyncio.sleep(min(30, 2 ** failures))
+                        break
+                    metrics.incr("cluster.dropped")
+                    self.logger.error(f"Dropping update {update.update_id} after {failures} attempts")
+                failures = 0
+                offset = update.update_id + 1
+
+    async def run_worker(self, dispatcher, bot, concurrency: Optional[int] = None) -> None:
+        """Consume this worker's shard and feed updates to the dispatcher
+
+        Different users are processed concurrently; updates of the same user
+        run one at a time in arrival order.
+        """
+        key = self.shard_key(self.worker_id)
+        semaphore = asyncio.Semaphore(concurrency or int(os.getenv("WORKER_CONCURRENCY", "64")))
+        # user id -> [lock, number of updates holding or waiting for it]
+        user_locks: Dict[Any, list] = {}
+        self.logger.info(f"Consuming updates from {key}")
+
+        async def process(update: Dict[str, Any]) -> None:
+            user_id = update_user_id(update)
+            entry = user_locks.setdefault(user_id, [asyncio.Lock(), 0])
+            entry[1] += 1
+            try:
+                async with entry[0]:
+                    await dispatcher.feed_raw_update(bot, update)
+            except Exception:
+                self.logger.error("Failed to process routed update", exc_info=True)
+            finally:
+                semaphore.release()
+                entry[1] -= 1
+                if not entry[1]:
+                    del user_locks[user_id]
+
+        while True:
+            await semaphore.acquire()
+            item = await self.redis.blpop([key], timeout=5)
+            if not item:
+                semaphore.release()
+                continue
+            asyncio.create_task(process(json_loads(item[1])))
+
+    async def publish_invalidation(self, user_id: int, scope: str = "session") -> None:
+        await self.redis.publish(
+            INVALIDATION_CHANNEL,
+            json_dumps({"origin": self.worker_id, "user_id": user_id, "scope": scope}),
+        )
+        metrics.incr("cluster.invalidations_sent")
+
+    async def publish_command(self, command: str, **args: Any) -> None:
+        """Have every other worker run a command"""
+        await self.redis.publish(
+            INVALIDATION_CHANNEL,
+            json_dumps({"origin": self.worker_id, "command": command, "args": args}),
+        )
+        metrics.incr("cluster.commands_sent")
+
+    async def _run_command(self, event: Dict[str, Any]) -> None:
+        handler = self.command_handlers.get(event["command"])
+        if handler is None:
+            self.logger.warning(f"No handler for cluster command {event['command']}")
+            return
+        try:
+            result = handler(**event.get("args", {}))
+            if inspect.isawaitable(result):
+                await result
+        except Exception:
+            self.logger.error("Failed to run cluster command", exc_info=True, extra={"event": event})
+
+    async def report_resync(self, job_id: str, report: Dict[str, Any]) -> None:
+        """Share this worker's progress on a re-sync job"""
+        key = f"{KEY_PREFIX}:resync:{job_id}"
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.hset(key, self.worker_id, json_dumps(report))
+            pipe.expire(key, RESYNC_REPORT_TTL)
+            pipe.set(RESYNC_LATEST_KEY, job_id, ex=RESYNC_REPORT_TTL)
+            await pipe.execute()
+
+    async def resync_reports(self, job_id: Optional[str] = None) -> Dict[str, Dict[str, Any]]:
+        """Progress reports per worker on a re-sync job, by default the latest"""
+        job_id = job_id or await self.redis.get(RESYNC_LATEST_KEY)
+        if not job_id:
+            return {}
+        reports = await self.redis.hgetall(f"{KEY_PREFIX}:resync:{job_id}")
+        return {worker: json_loads(report) for worker, report in reports.items()}
+
+    async def listen_invalidations(self, callback: Callable[[int, str], Any]) -> None:
+        """Apply invalidations and run commands published by other processes"""
+        pubsub = self.redis.pubsub()
+        await pubsub.subscribe(INVALIDATION_CHANNEL)
+        self.logger.info("Listening for cache invalidations")
+        try:
+            async for message in pubsub.listen():
+                if message.get("type") != "message":
+                    continue
+                event = json_loads(message["data"])
+                if event.get("origin") == self.worker_id:
+                    continue
+                if "command" in event:
+                    metrics.incr("cluster.commands_received")
+                    await self._run_command(event)
+                    continue
+                metrics.incr("cluster.invalidations_received")
+                result = callback(event["user_id"], event.get("scope", "session"))
+                if inspect.isawaitable(result):
+                    await result
+        finally:
+            await pubsub.unsubscribe(INVALIDATION_CHANNEL)
+
+    async def close(self) -> None:
+        await self.redis.aclose()
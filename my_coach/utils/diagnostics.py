@@ -0,0 +1,184 @@
+import asyncio
+import logging
+import os
+import time
+import tracemalloc
+from typing import Any, Dict, List, Optional
+from .history import evict_history_store, loaded_history_stores, peek_history_store
+from .long_term_memory import memory_manager
+from .sessions import SessionRegistry, UserSession
+from .usage import usage_tracker
+
+logger = logging.getLogger(__name__)
+
+# Tasks serialized per user to estimate the average task size
+TASK_SAMPLE_SIZE = 50
+
+
+def estimate_task_bytes(session: UserSession) -> int:
+    """Rough task store footprint from the serialized size of a sample of tasks"""
+    tasks = session.todoist_client.store.tasks
+    if not tasks:
+        return 0
+    sample = [task for _, task in zip(range(TASK_SAMPLE_SIZE), tasks.values())]
+    average = sum(len(task.model_dump_json()) for task in sample) / len(sample)
+    return int(average * len(tasks))
+
+
+def session_report(user_id: int, session: UserSession, now: Optional[float] = None) -> Dict[str, Any]:
+    """Memory-relevant counts and estimated bytes held for one user"""
+    thread_id = str(user_id)
+    checkpointer = getattr(session.graph, "checkpointer", None)
+    store = session.todoist_client.store
+    history = peek_history_store(thread_id)
+    return {
+        "user_id": user_id,
+        "idle_seconds": int((now or time.time()) - session.last_seen),
+        "checkpoints": len((getattr(checkpointer, "storage", {}).get(thread_id) or {}).get("", {})),
+        "checkpoint_bytes": getattr(checkpointer, "bytes_by_thread", {}).get(thread_id, 0),
+        "tasks": len(store),
+        "task_bytes": estimate_task_bytes(session),
+        "search_terms": len(store.search_index.postings),
+        "history_rows": len(history) if history else 0,
+        "history_bytes": history.nbytes if history else 0,
+    }
+
+
+def memory_report(sessions: SessionRegistry, storage: Any = None) -> Dict[str, Any]:
+    """Estimated memory per subsystem plus the per-user breakdown"""
+    now = time.time()
+    users = [session_report(user_id, session, now) for user_id, session in sessions.items()]
+    history_stores = loaded_history_stores()
+    subsystems = {
+        "sessions": len(users),
+        "checkpoint_bytes": sum(user["checkpoint_bytes"] for user in users),
+        "checkpoints": sum(user["checkpoints"] for user in users),
+        "tasks": sum(user["tasks"] for user in users),
+        "task_bytes": sum(user["task_bytes"] for user in users),
+        "history_stores": len(history_stores),
+        "history_bytes": sum(store.nbytes for store in history_stores),
+        "usage_rows": len(usage_tracker.usage),
+        "memory_indexes": len(memory_manager.indexes),
+    }
+    # MemoryStorage keeps FSM state in a plain dict; Redis-backed storage has none
+    fsm_storage = getattr(storage, "storage", None)
+    if isinstance(fsm_storage, dict):
+        subsystems["fsm_entries"] = len(fsm_storage)
+    if tracemalloc.is_tracing():
+        current, peak = tracemalloc.get_traced_memory()
+        subsystems["traced_bytes"] = current
+        subsystems["traced_peak_bytes"] = peak
+    return {"subsystems": subsystems, "users": users}
+
+
+def format_report(report: Dict[str, Any], top: int = 10) -> str:
+    """Plain-text memory report listing the users holding the most state"""
+    lines = ["MEMORY"]
+    lines += [f"{name}: {value:,}" for name, value in report["subsystems"].items()]
+    users = sorted(
+        report["users"],
+        key=lambda user: user["checkpoint_bytes"] + user["task_bytes"] + user["history_bytes"],
+        reverse=True,
+    )
+    if users:
+        lines.append("")
+        lines.append(f"TOP USERS ({min(top, len(users))} of {len(users)})")
+        for user in users[:top]:
+            lines.append(
+                f"{user['user_id']}: {user['checkpoints']} checkpoints "
+                f"{user['checkpoint_bytes'] // 1024} KiB, {user['tasks']} tasks "
+                f"{user['task_bytes'] // 1024} KiB, {user['history_rows']} completions, "
+                f"idle {user['idle_seconds']}s"
+            )
+    return "\n".join(lines)
+
+
+class AllocationTracer:
+    """On-demand tracemalloc snapshots diffed against the previous one.
+
+    Tracing costs memory and CPU, so it only runs between start() and stop().
+    """
+
+    def __init__(self, frames: int = 5):
+        self.frames = frames
+        self.previous: Optional[tracemalloc.Snapshot] = None
+
+    @property
+    def active(self) -> bool:
+        return tracemalloc.is_tracing()
+
+    def start(self) -> None:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+        self.previous = self._snapshot()
+
+    def stop(self) -> None:
+        self.previous = None
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+    def diff(self, limit: int = 15) -> List[str]:
+        """Allocation sites that grew most since the previous snapshot"""
+        if not tracemalloc.is_tracing():
+            return ["tracing is off"]
+        snapshot = self._snapshot()
+        previous, self.previous = self.previous, snapshot
+        if previous is None:
+            return ["baseline snapshot taken"]
+        stats = snapshot.compare_to(previous, "lineno")
+        return [str(stat) for stat in stats[:limit] if stat.size_diff]
+
+    @staticmethod
+    def _snapshot() -> tracemalloc.Snapshot:
+        return tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+        ))
+
+
+class SessionReaper:
+    """Evicts sessions of users idle for longer than a TTL.
+
+    Their graphs, checkpoints, task stores and history arrays are released;
+    everything is rebuilt from Todoist and disk on the next message.
+    """
+
+    def __init__(self, sessions: SessionRegistry, ttl: Optional[float] = None,
+                 interval: Optional[float] = None):
+        self.logger = logger.getChild('SessionReaper')
+        self.sessions = sessions
+        self.ttl = ttl or float(os.getenv("SESSION_IDLE_TTL", str(6 * 3600)))
+        self.interval = interval or float(os.getenv("SESSION_REAP_INTERVAL", "300"))
+
+    async def reap(self, now: Optional[float] = None) -> int:
+        """Evict every idle session, returning how many were evicted"""
+        cutoff = (now or time.time()) - self.ttl
+        evicted = 0
+        for user_id, session in self.sessions.items():
+            if session.last_seen >= cutoff:
+                continue
+            if self.sessions.snapshots:
+                try:
+                    # Keep the state on disk so the user's next message starts warm
+                    await self.sessions.snapshots.asave(session)
+                except Exception:
+                    self.logger.error("Failed to snapshot idle session", exc_info=True)
+                if session.last_seen >= cutoff:
+                    # The user came back while the snapshot was written
+                    continue
+            if self.sessions.evict(user_id):
+                evict_history_store(user_id)
+                memory_manager.evict(str(user_id))
+                evicted += 1
+        if evicted:
+            self.logger.info(f"Reaped {evicted} idle sessions, {len(self.sessions)} remain")
+        return evicted
+
+    async def run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.reap()
+            except Exception:
+                self.logger.error("Error reaping idle sessions", exc_info=True)
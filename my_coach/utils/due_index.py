@@ -0,0 +1,118 @@
+import bisect
+from datetime import datetime, time, timedelta, timezone
+from typing import Dict, List, Optional, Set, Tuple
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+from ..models import Due, SimpleTask
+
+
+def get_zone(name: Optional[str]) -> ZoneInfo:
+    """Resolve an IANA timezone name, falling back to UTC"""
+    try:
+        return ZoneInfo(name or "UTC")
+    except (ZoneInfoNotFoundError, ValueError):
+        return ZoneInfo("UTC")
+
+
+def parse_timestamp(value: str) -> datetime:
+    """Parse a Todoist ISO timestamp, tolerating a trailing Z"""
+    if value.endswith("Z"):
+        value = value[:-1] + "+00:00"
+    parsed = datetime.fromisoformat(value)
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+def parse_due(due: Optional[Due], user_tz: Optional[str] = None) -> Tuple[Optional[datetime], Optional[str]]:
+    """Normalize a Todoist due date to a UTC deadline
+
+    Returns the deadline and the timezone it was interpreted in. Fixed-time
+    dues carry their own zone, floating times and all-day dates are read in
+    the user's zone, and all-day tasks are due by the end of that day.
+    """
+    if not due:
+        return None, None
+    try:
+        if due.datetime:
+            value = due.datetime
+        else:
+            value = due.date
+        tz_name = due.timezone or user_tz or "UTC"
+        zone = get_zone(tz_name)
+
+        if "T" not in value:
+            day = datetime.fromisoformat(value).date()
+            deadline = datetime.combine(day + timedelta(days=1), time.min, tzinfo=zone)
+        else:
+            parsed = datetime.fromisoformat(value[:-1] + "+00:00" if value.endswith("Z") else value)
+            deadline = parsed if parsed.tzinfo else parsed.replace(tzinfo=zone)
+        return deadline.astimezone(timezone.utc), tz_name
+    except ValueError:
+        return None, None
+
+
+def local_day_bounds(now: datetime, tz_name: Optional[str], days: int = 1) -> Tuple[datetime, datetime]:
+    """UTC bounds of `days` local calendar days starting with today"""
+    zone = get_zone(tz_name)
+    today = now.astimezone(zone).date()
+    start = datetime.combine(today, time.min, tzinfo=zone)
+    end = datetime.combine(today + timedelta(days=days), time.min, tzinfo=zone)
+    return start.astimezone(timezone.utc), end.astimezone(timezone.utc)
+
+
+class DueIndex:
+    """Sorted index of open tasks by due deadline.
+
+    Entries are (deadline epoch, task id) kept in a sorted list, so range
+    queries are a pair of binary searches plus the matching slice.
+    """
+
+    def __init__(self):
+        self._entries: List[Tuple[float, str]] = []
+        self._deadlines: Dict[str, float] = {}
+        self.recurring: Set[str] = set()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def upsert(self, task: SimpleTask) -> None:
+        self.remove(task.id)
+        if task.is_completed or not task.due_at:
+            return
+        deadline = task.due_at.timestamp()
+        bisect.insort(self._entries, (deadline, task.id))
+        self._deadlines[task.id] = deadline
+        if task.due and task.due.is_recurring:
+            self.recurring.add(task.id)
+
+    def remove(self, task_id: str) -> None:
+        deadline = self._deadlines.pop(task_id, None)
+        self.recurring.discard(task_id)
+        if deadline is None:
+            return
+        index = bisect.bisect_left(self._entries, (deadline, task_id))
+        if index < len(self._entries) and self._entries[index] == (deadline, task_id):
+            del self._entries[index]
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._deadlines.clear()
+        self.recurring.clear()
+
+    def between(self, start: datetime, end: datetime) -> List[str]:
+        """Ids of tasks due in (start, end], earliest first"""
+        low = bisect.bisect_right(self._entries, (start.timestamp(), "\uffff"))
+        high = bisect.bisect_right(self._entries, (end.timestamp(), "\uffff"))
+        return [task_id for _, task_id in self._entries[low:high]]
+
+    def overdue(self, now: datetime) -> List[str]:
+        """Ids of open tasks whose deadline has passed"""
+        high = bisect.bisect_left(self._entries, (now.timestamp(), ""))
+        return [task_id for _, task_id in self._entries[:high]]
+
+    def due_today(self, now: datetime, tz_name: Optional[str]) -> List[str]:
+        start, end = local_day_bounds(now, tz_name)
+        return self.between(start, end)
+
+    def due_within(self, now: datetime, tz_name: Optional[str], days: int) -> List[str]:
+        """Ids of tasks due from the start of today through the next `days` days"""
+        start, end = local_day_bounds(now, tz_name, days)
+        return self.between(start, end)
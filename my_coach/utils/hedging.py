@@ -0,0 +1,118 @@
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from typing import AsyncIterator, Callable, Deque, List, Optional
+from langchain_core.messages import BaseMessage, BaseMessageChunk, message_chunk_to_message
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+StreamFactory = Callable[[], AsyncIterator[BaseMessageChunk]]
+
+
+class HedgedRequests:
+    """Backup model requests for responses whose first token is late.
+
+    A response is streamed. If its first token has not arrived within the
+    tier's rolling first-token percentile, a second identical request is
+    started, on the tier's hedge endpoint when one is configured. The first
+    request to complete wins and the other is cancelled. Hedges are capped
+    at a share of recent requests so a slow provider does not get twice the
+    load.
+    """
+
+    def __init__(self, percentile: Optional[float] = None, max_rate: Optional[float] = None):
+        self.logger = logger.getChild('HedgedRequests')
+        self.enabled = os.getenv("LLM_HEDGING", "false").lower() == "true"
+        self.percentile = percentile or float(os.getenv("LLM_HEDGE_PERCENTILE", "90"))
+        self.max_rate = max_rate if max_rate is not None else float(os.getenv("LLM_HEDGE_MAX_RATE", "0.1"))
+        # Delay used until a tier has enough first-token samples
+        self.initial_delay = float(os.getenv("LLM_HEDGE_INITIAL_DELAY", "3"))
+        self.min_delay = float(os.getenv("LLM_HEDGE_MIN_DELAY", "0.5"))
+        self.min_samples = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+        # Whether each of the most recent requests was hedged
+        self.recent: Deque[bool] = deque(maxlen=int(os.getenv("LLM_HEDGE_WINDOW", "200")))
+
+    def delay(self, tier: str) -> float:
+        """Seconds to wait for a first token before hedging"""
+        name = f"llm.tier.{tier}.first_token"
+        samples = metrics.samples.get(name)
+        if samples is None or len(samples) < self.min_samples:
+            return self.initial_delay
+        return max(self.min_delay, metrics.percentile(name, self.percentile) or self.initial_delay)
+
+    def _allow(self) -> bool:
+        hedged = sum(self.recent) + 1
+        return hedged / (len(self.recent) + 1) <= self.max_rate
+
+    async def _collect(self, tier: str, stream: AsyncIterator[BaseMessageChunk],
+                       first_token: Optional[asyncio.Event] = None) -> BaseMessageChunk:
+        started = time.perf_counter()
+        message: Optional[BaseMessageChunk] = None
+        try:
+            async for chunk in stream:
+                if message is None:
+                    metrics.observe(f"llm.tier.{tier}.first_token", time.perf_counter() - started)
+                    if first_token is not None:
+                        first_token.set()
+                    message = chunk
+                else:
+                    message += chunk
+        finally:
+            aclose = getattr(stream, "aclose", None)
+            if aclose is not None:
+                await aclose()
+        if message is None:
+            raise ValueError("Model returned an empty stream")
+        return message
+
+    async def run(self, tier: str, primary: StreamFactory, backup: StreamFactory) -> BaseMessage:
+        """Stream a response, hedging with a backup request if it starts late"""
+        started = time.perf_counter()
+        first_token = asyncio.Event()
+        primary_task = asyncio.ensure_future(self._collect(tier, primary(), first_token))
+        tasks: List[asyncio.Future] = [primary_task]
+        backup_task: Optional[asyncio.Future] = None
+        try:
+            waiter = asyncio.ensure_future(first_token.wait())
+            try:
+                await asyncio.wait([primary_task, waiter], timeout=self.delay(tier),
+                                   return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                waiter.cancel()
+
+            if not first_token.is_set() and not primary_task.done():
+                if self._allow():
+                    self.logger.debug(f"No first token from {tier} tier after {time.perf_counter() - started:.2f}s, hedging")
+                    backup_task = asyncio.ensure_future(self._collect(tier, backup()))
+                    tasks.append(backup_task)
+                    metrics.incr("llm.hedge.sent")
+                else:
+                    metrics.incr("llm.hedge.capped")
+            self.recent.append(backup_task is not None)
+
+            error: Optional[BaseException] = None
+            pending = list(tasks)
+            while pending:
+                done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    pending.remove(task)
+                    if task.exception() is None:
+                        if backup_task is not None:
+                            metrics.incr("llm.hedge.won" if task is backup_task else "llm.hedge.lost")
+                            metrics.observe("llm.hedge.latency", time.perf_counter() - started)
+                        return message_chunk_to_message(task.result())
+                    error = task.exception()
+            raise error
+
+        finally:
+            # Cancel the loser, or both requests if the caller gave up
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+
+llm_hedging = HedgedRequests()
@@ -0,0 +1,244 @@
+import logging
+import os
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Set
+from zoneinfo import ZoneInfo
+import numpy as np
+from ..models import Item, ProductivitySummary
+from .due_index import get_zone, parse_due, parse_timestamp
+
+logger = logging.getLogger(__name__)
+
+# Sentinel for "no due date" in the int64 due column
+NO_DUE = np.int64(-1)
+WEEKDAYS = ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]
+
+
+def _due_epoch(item: Item, tz_name: str) -> int:
+    """Deadline of a completed item in epoch seconds, or NO_DUE"""
+    deadline, _ = parse_due(item.due, tz_name)
+    return int(deadline.timestamp()) if deadline else int(NO_DUE)
+
+
+class CompletedHistoryStore:
+    """Columnar per-user store of completed tasks backed by a compressed .npz file.
+
+    Each completion is one row across parallel NumPy arrays; rows are appended
+    page by page as history streams in and the pagination cursor is persisted
+    with them so an interrupted or later fetch resumes where it left off.
+    """
+
+    def __init__(self, user_id: str, base_dir: Optional[str] = None):
+        self.logger = logger.getChild('CompletedHistoryStore')
+        self.user_id = str(user_id)
+        self.path = Path(base_dir or os.getenv("HISTORY_DIR", "data/history")) / f"{self.user_id}.npz"
+
+        self.item_ids = np.empty(0, dtype="U40")
+        self.completed_at = np.empty(0, dtype=np.int64)
+        self.due_at = np.empty(0, dtype=np.int64)
+        self.priority = np.empty(0, dtype=np.int8)
+        self.cursor: Optional[str] = None
+        self.since: Optional[str] = None
+        self._seen: Optional[Set[str]] = None
+        self.load()
+
+    def __len__(self) -> int:
+        return len(self.completed_at)
+
+    @property
+    def nbytes(self) -> int:
+        return self.item_ids.nbytes + self.completed_at.nbytes + self.due_at.nbytes + self.priority.nbytes
+
+    def load(self) -> None:
+        """Load the persisted columns if the user has a history file"""
+        if not self.path.exists():
+            return
+        try:
+            with np.load(self.path, allow_pickle=False) as data:
+                self.item_ids = data["item_ids"]
+                self.completed_at = data["completed_at"]
+                self.due_at = data["due_at"]
+                self.priority = data["priority"]
+                self.cursor = str(data["cursor"]) or None
+                self.since = str(data["since"]) or None
+            self.logger.debug(f"Loaded {len(self)} completed items for user {self.user_id}")
+        except Exception:
+            self.logger.error(
+                "Failed to load completed history, starting empty",
+                exc_info=True,
+                extra={"user_id": self.user_id, "path": str(self.path)}
+            )
+
+    def save(self) -> None:
+        """Atomically persist the columns and pagination state"""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_suffix(".tmp.npz")
+        np.savez_compressed(
+            tmp_path,
+            item_ids=self.item_ids,
+            completed_at=self.completed_at,
+            due_at=self.due_at,
+            priority=self.priority,
+            cursor=np.array(self.cursor or ""),
+            since=np.array(self.since or ""),
+        )
+        os.replace(tmp_path, self.path)
+
+    def append(self, items: Iterable[Item], tz_name: str) -> int:
+        """Append completed items as new rows, skipping completions already stored"""
+        if self._seen is None:
+            self._seen = {
+                f"{item_id}:{ts}" for item_id, ts in zip(self.item_ids, self.completed_at)
+            }
+
+        ids: List[str] = []
+        completed: List[int] = []
+        due: List[int] = []
+        priority: List[int] = []
+        for item in items:
+            if not item.completed_at:
+                continue
+            completed_ts = int(parse_timestamp(item.completed_at).timestamp())
+            key = f"{item.id}:{completed_ts}"
+            if key in self._seen:
+                continue
+            self._seen.add(key)
+            ids.append(item.id)
+            completed.append(completed_ts)
+            due.append(_due_epoch(item, tz_name))
+            priority.append(item.priority)
+            if not self.since or item.completed_at > self.since:
+                self.since = item.completed_at
+
+        if ids:
+            self.item_ids = np.concatenate([self.item_ids, np.array(ids, dtype=self.item_ids.dtype)])
+            self.completed_at = np.concatenate([self.completed_at, np.array(completed, dtype=np.int64)])
+            self.due_at = np.concatenate([self.due_at, np.array(due, dtype=np.int64)])
+            self.priority = np.concatenate([self.priority, np.array(priority, dtype=np.int8)])
+        return len(ids)
+
+    async def refresh(self, todoist_client, tz_name: str = "UTC") -> int:
+        """Stream new completions from Todoist, persisting after every page"""
+        added = 0
+        async for page in todoist_client.iter_completed_items(
+            cursor=self.cursor, since=None if self.cursor else self.since
+        ):
+            added += self.append(page.items, tz_name)
+            # Keep the cursor only while pagination is unfinished; afterwards
+            # the newest completed_at is the resume point
+            self.cursor = page.next_cursor if page.has_more else None
+            self.save()
+        self.logger.info(f"Added {added} completed items for user {self.user_id}")
+        return added
+
+    def summarize(self, tz_name: str = "UTC", days: int = 90,
+                  now: Optional[datetime] = None) -> ProductivitySummary:
+        """Vectorized productivity analytics over the last `days` days"""
+        tz = get_zone(tz_name)
+        now = now or datetime.now(timezone.utc)
+        window_start = int((now - timedelta(days=days)).timestamp())
+
+        mask = self.completed_at >= window_start
+        completed_at = self.completed_at[mask]
+        due_at = self.due_at[mask]
+        priority = self.priority[mask]
+        total = int(completed_at.size)
+        if not total:
+            return ProductivitySummary(window_days=days, completed=0)
+
+        local = self._to_local(completed_at, tz)
+        local_days = local // 86400
+        # 1970-01-01 was a Thursday
+        weekday = (local_days + 3) % 7
+        hour = (local % 86400) // 3600
+
+        weekday_counts = np.bincount(weekday, minlength=7)
+        hour_counts = np.bincount(hour, minlength=24)
+
+        has_due = due_at != NO_DUE
+        overdue = np.count_nonzero(completed_at[has_due] > due_at[has_due])
+        priority_counts = np.bincount(np.clip(priority, 1, 4), minlength=5)[1:]
+
+        current_streak, longest_streak = self._streaks(
+            np.unique(local_days), self._to_local(np.array([int(now.timestamp())]), tz)[0] // 86400
+        )
+
+        return ProductivitySummary(
+            window_days=days,
+            completed=total,
+            by_weekday={WEEKDAYS[i]: round(float(c) / total, 3) for i, c in enumerate(weekday_counts)},
+            by_hour={int(h): round(float(c) / total, 3) for h, c in enumerate(hour_counts) if c},
+            current_streak_days=current_streak,
+            longest_streak_days=longest_streak,
+            overdue_ratio=round(float(overdue) / int(has_due.sum()), 3) if has_due.any() else None,
+            # Todoist API priority 4 is what users see as p1
+            priority_mix={f"p{5 - p}": round(float(priority_counts[p - 1]) / total, 3) for p in range(4, 0, -1)},
+        )
+
+    @staticmethod
+    def _to_local(epochs: np.ndarray, tz: ZoneInfo) -> np.ndarray:
+        """Shift UTC epochs to local wall-clock seconds, resolving DST per UTC day"""
+        utc_days, inverse = np.unique(epochs // 86400, return_inverse=True)
+        offsets = np.array([
+            int(datetime.fromtimestamp(int(day) * 86400 + 43200, tz).utcoffset().total_seconds())
+            for day in utc_days
+        ], dtype=np.int64)
+        return epochs + offsets[inverse]
+
+    @staticmethod
+    def _streaks(active_days: np.ndarray, today: int) -> tuple:
+        """Current and longest runs of consecutive days with a completion"""
+        if not active_days.size:
+            return 0, 0
+        breaks = np.flatnonzero(np.diff(active_days) != 1)
+        starts = np.concatenate([[0], breaks + 1])
+        ends = np.concatenate([breaks, [active_days.size - 1]])
+        lengths = ends - starts + 1
+        longest = int(lengths.max())
+        # A streak is still alive if the last active day is today or yesterday
+        current = int(lengths[-1]) if today - active_days[-1] <= 1 else 0
+        return current, longest
+
+
+def format_summary(summary: ProductivitySummary) -> str:
+    """Render a compact, prompt-friendly productivity summary"""
+    if not summary.completed:
+        return f"Productivity ({summary.window_days}d): no completed tasks recorded."
+
+    best_days = sorted(summary.by_weekday.items(), key=lambda kv: kv[1], reverse=True)[:2]
+    peak_hours = sorted(summary.by_hour.items(), key=lambda kv: kv[1], reverse=True)[:3]
+    lines = [
+        f"Productivity ({summary.window_days}d): {summary.completed} tasks completed",
+        "Most productive days: " + ", ".join(f"{day} {share:.0%}" for day, share in best_days),
+        "Peak hours: " + ", ".join(f"{hour:02d}:00 {share:.0%}" for hour, share in peak_hours),
+        f"Streak: {summary.current_streak_days} days (longest {summary.longest_streak_days})",
+        "Priority mix: " + ", ".join(f"{p} {share:.0%}" for p, share in summary.priority_mix.items()),
+    ]
+    if summary.overdue_ratio is not None:
+        lines.append(f"Completed after due date: {summary.overdue_ratio:.0%}")
+    return "\n".join(lines)
+
+
+_stores: Dict[str, CompletedHistoryStore] = {}
+
+
+def get_history_store(user_id: str) -> CompletedHistoryStore:
+    """Return the process-wide history store for a user, loading it on first use"""
+    user_id = str(user_id)
+    if user_id not in _stores:
+        _stores[user_id] = CompletedHistoryStore(user_id)
+    return _stores[user_id]
+
+
+def peek_history_store(user_id: str) -> Optional[CompletedHistoryStore]:
+    return _stores.get(str(user_id))
+
+
+def loaded_history_stores() -> List[CompletedHistoryStore]:
+    return list(_stores.values())
+
+
+def evict_history_store(user_id: str) -> bool:
+    """Drop a user's history arrays from memory; they reload from disk on next use"""
+    return _stores.pop(str(user_id), None) is not None
@@ -10,6 +10,30 @@ load_dotenv()
 
 _LOGGING_INITIALIZED = False
 
+# Attributes every LogRecord has; anything else was passed through `extra`
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record, including fields passed through `extra`"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        from .runtime import json_dumps
+
+        entry = {
+            "time": self.formatTime(record, "%Y-%m-%dT%H:%M:%S"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS:
+                entry[key] = value
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json_dumps(entry, default=str)
+
+
 def setup_logging(
     logger_name: Optional[str] = None,
     log_file: Optional[str] = None,
@@ -45,6 +69,10 @@ def setup_logging(
             '%(asctime)s | %(levelname)-8s | %(message)s',
             datefmt='%H:%M:%S'
         )
+
+        # Structured logs for log shippers
+        if os.getenv("LOG_FORMAT", "text") == "json":
+            detailed_formatter = console_formatter = JsonFormatter()
         
         # Console handler (always enabled)
         console_handler = logging.StreamHandler()
@@ -0,0 +1,317 @@
+import asyncio
+import logging
+import os
+import time
+import uuid
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+import numpy as np
+from langchain_core.messages import HumanMessage, SystemMessage
+from langchain_openai import OpenAIEmbeddings
+from pydantic import BaseModel, Field
+from ..models import MEMORY_KIND, UserMemory
+from .metrics import metrics
+from .model_router import ModelRouter
+from .usage import usage_tracker
+
+logger = logging.getLogger(__name__)
+
+EXTRACTION_PROMPT = """You maintain long-term notes about a coaching client.
+From the exchange below, extract durable facts worth remembering for weeks: goals, habits, constraints and preferences.
+Ignore small talk, one-off requests and anything about a single task.
+Write each fact as a short third-person sentence. Return no facts if there are none.
+
+Already known:
+{known}"""
+
+
+class ExtractedFact(BaseModel):
+    kind: MEMORY_KIND
+    text: str = Field(description="Short third-person sentence, e.g. 'Wants to run a marathon in May'")
+
+
+class ExtractedFacts(BaseModel):
+    """Durable facts about the user stated in the exchange"""
+
+    facts: List[ExtractedFact] = []
+
+
+def estimate_tokens(text: str) -> int:
+    # Roughly four characters per token for English text
+    return len(text) // 4 + 1
+
+
+class LocalMemoryIndex:
+    """A user's memories with unit-normalized embeddings in a numpy matrix.
+
+    Search is one matrix-vector product; persisted to a compressed .npz file.
+    """
+
+    def __init__(self, user_id: str, base_dir: Optional[str] = None):
+        self.logger = logger.getChild('LocalMemoryIndex')
+        self.user_id = user_id
+        self.path = Path(base_dir or os.getenv("MEMORY_DIR", "data/memory")) / f"{user_id}.npz"
+        self.memories: List[UserMemory] = []
+        self.vectors: Optional[np.ndarray] = None
+        self.load()
+
+    def __len__(self) -> int:
+        return len(self.memories)
+
+    def load(self) -> None:
+        if not self.path.exists():
+            return
+        try:
+            with np.load(self.path, allow_pickle=False) as data:
+                self.vectors = data["vectors"]
+                self.memories = [
+                    UserMemory(
+                        id=str(memory_id), kind=str(kind), text=str(text),
+                        created_at=datetime.fromtimestamp(int(created), timezone.utc),
+                        updated_at=datetime.fromtimestamp(int(updated), timezone.utc),
+                    )
+                    for memory_id, kind, text, created, updated in zip(
+                        data["ids"], data["kinds"], data["texts"], data["created_at"], data["updated_at"]
+                    )
+                ]
+        except Exception:
+            self.logger.error(
+                "Failed to load memories, starting empty",
+                exc_info=True,
+                extra={"user_id": self.user_id, "path": str(self.path)}
+            )
+
+    def save(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_suffix(".tmp.npz")
+        np.savez_compressed(
+            tmp_path,
+            ids=np.array([memory.id for memory in self.memories], dtype="U40"),
+            kinds=np.array([memory.kind for memory in self.memories], dtype="U16"),
+            texts=np.array([memory.text for memory in self.memories]),
+            created_at=np.array([int(memory.created_at.timestamp()) for memory in self.memories], dtype=np.int64),
+            updated_at=np.array([int(memory.updated_at.timestamp()) for memory in self.memories], dtype=np.int64),
+            vectors=self.vectors if self.vectors is not None else np.empty((0, 0), dtype=np.float32),
+        )
+        os.replace(tmp_path, self.path)
+
+    async def search(self, vector: List[float], k: int) -> List[Tuple[UserMemory, float]]:
+        """Memories most similar to the query vector with their cosine similarity"""
+        if not self.memories:
+            return []
+        query = np.asarray(vector, dtype=np.float32)
+        scores = self.vectors @ (query / (np.linalg.norm(query) or 1.0))
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(self.memories[index], float(scores[index])) for index in top]
+
+    async def upsert(self, memory: UserMemory, vector: List[float]) -> None:
+        row = np.asarray(vector, dtype=np.float32)
+        row = row / (np.linalg.norm(row) or 1.0)
+        for index, existing in enumerate(self.memories):
+            if existing.id == memory.id:
+                self.memories[index] = memory
+                self.vectors[index] = row
+                break
+        else:
+            self.memories.append(memory)
+            self.vectors = row[None, :] if self.vectors is None or not len(self.vectors) else np.vstack([self.vectors, row])
+        self.save()
+
+
+class SupabaseMemoryIndex:
+    """A user's memories in a pgvector-backed Supabase table.
+
+    Expects a user_memories table and a match_user_memories function that
+    returns the rows nearest to a query embedding (see README).
+    """
+
+    def __init__(self, user_id: str, supabase: Any):
+        self.user_id = user_id
+        self.supabase = supabase
+
+    async def search(self, vector: List[float], k: int) -> List[Tuple[UserMemory, float]]:
+        response = self.supabase.client.rpc(
+            'match_user_memories',
+            {"p_user_id": self.user_id, "query_embedding": vector, "match_count": k},
+        ).execute()
+        return [
+            (UserMemory(**{field: row[field] for field in UserMemory.model_fields}), row["similarity"])
+            for row in response.data or []
+        ]
+
+    async def upsert(self, memory: UserMemory, vector: List[float]) -> None:
+        self.supabase.client.table('user_memories').upsert({
+            **memory.model_dump(mode="json"), "user_id": self.user_id, "embedding": vector,
+        }).execute()
+
+
+class MemoryManager:
+    """Long-term memory: extraction after replies, retrieval before them.
+
+    Facts are extracted by the small model in background tasks once a reply
+    has been sent, embedded, and merged into the user's index; near
+    duplicates replace the older fact. Before a reply the user's message is
+    embedded and the most similar facts that fit the token budget are
+    returned for the prompt.
+    """
+
+    def __init__(self, index_factory: Optional[Callable[[str], Any]] = None):
+        self.logger = logger.getChild('MemoryManager')
+        self.enabled = os.getenv("MEMORY_ENABLED", "true").lower() == "true"
+        self.top_k = int(os.getenv("MEMORY_TOP_K", "8"))
+        self.token_budget = int(os.getenv("MEMORY_TOKEN_BUDGET", "300"))
+        self.min_similarity = float(os.getenv("MEMORY_MIN_SIMILARITY", "0.25"))
+        self.duplicate_similarity = float(os.getenv("MEMORY_DUPLICATE_SIMILARITY", "0.9"))
+        self.index_factory = index_factory or LocalMemoryIndex
+        self.indexes: Dict[str, Any] = {}
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._pending: Set[asyncio.Task] = set()
+        # Retrieval for the last query per user, reused across tool-loop turns
+        self._last_retrieval: Dict[str, Tuple[str, List[UserMemory]]] = {}
+        self._embeddings: Optional[OpenAIEmbeddings] = None
+        self._extractor = None
+        self.router: Optional[ModelRouter] = None
+
+    @property
+    def embeddings(self) -> OpenAIEmbeddings:
+        if self._embeddings is None:
+            self._embeddings = OpenAIEmbeddings(
+                model=os.getenv("COACH_EMBEDDING_MODEL", "text-embedding-3-small"),
+                base_url=os.getenv("COACH_EMBEDDING_BASE_URL") or os.getenv("COACH_LLM_BASE_URL"),
+                api_key=os.getenv("COACH_EMBEDDING_API_KEY") or os.getenv("COACH_LLM_API_KEY"),
+                # Memories and messages are short; skip client-side token splitting
+                check_embedding_ctx_length=False,
+            )
+        return self._embeddings
+
+    @property
+    def extractor(self):
+        if self._extractor is None:
+            self.router = ModelRouter()
+            # The raw response carries the token usage
+            self._extractor = self.router.create_llm("small").with_structured_output(
+                ExtractedFacts, method="function_calling", include_raw=True
+            )
+        return self._extractor
+
+    def index(self, user_id: str) -> Any:
+        if user_id not in self.indexes:
+            self.indexes[user_id] = self.index_factory(user_id)
+        return self.indexes[user_id]
+
+    def evict(self, user_id: str) -> None:
+        self.indexes.pop(user_id, None)
+        self._locks.pop(user_id, None)
+        self._last_retrieval.pop(user_id, None)
+
+    async def retrieve(self, user_id: str, query: str) -> List[UserMemory]:
+        """Most relevant memories for a message, within the token budget"""
+        if not self.enabled or not user_id or not query.strip():
+            return []
+        cached = self._last_retrieval.get(user_id)
+        if cached and cached[0] == query:
+            return cached[1]
+
+        index = self.index(user_id)
+        if isinstance(index, LocalMemoryIndex) and not len(index):
+            return []
+        try:
+            vector = await self.embeddings.aembed_query(query)
+            matches = await index.search(vector, self.top_k)
+        except Exception:
+            self.logger.error("Error retrieving memories", exc_info=True, extra={"user_id": user_id})
+            return []
+
+        selected: List[UserMemory] = []
+        budget = self.token_budget
+        for memory, score in matches:
+            cost = estimate_tokens(memory.text)
+            if score < self.min_similarity or cost > budget:
+                continue
+            selected.append(memory)
+            budget -= cost
+        metrics.observe("memory.retrieved", len(selected))
+        self._last_retrieval[user_id] = (query, selected)
+        return selected
+
+    def schedule_extraction(self, user_id: str, user_text: str, reply_text: str) -> None:
+        """Extract memories from an exchange in the background"""
+        if not self.enabled or not user_id or len(user_text.strip()) < 15:
+            return
+        if ModelRouter.canned_kind(user_text.strip()):
+            return
+        task = asyncio.create_task(self.extract(user_id, user_text, reply_text))
+        self._pending.add(task)
+        task.add_done_callback(self._pending.discard)
+
+    async def extract(self, user_id: str, user_text: str, reply_text: str) -> List[UserMemory]:
+        """Extract durable facts from one exchange and merge them into the index"""
+        # One extraction per user at a time so merges see each other's facts
+        lock = self._locks.setdefault(user_id, asyncio.Lock())
+        async with lock:
+            try:
+                known = await self.retrieve(user_id, user_text)
+                started = time.perf_counter()
+                output = await self.extractor.ainvoke([
+                    SystemMessage(content=EXTRACTION_PROMPT.format(
+                        known="\n".join(f"- {memory.text}" for memory in known) or "nothing yet"
+                    )),
+                    HumanMessage(content=f"Client: {user_text}\n\nCoach: {reply_text}"),
+                ])
+                # Spent on the user's behalf, so it counts toward their daily quota
+                usage = getattr(output["raw"], "usage_metadata", None)
+                cost = self.router.record("small", time.perf_counter() - started, usage)
+                usage_tracker.record(user_id, usage, cost)
+                if output["parsing_error"]:
+                    raise output["parsing_error"]
+
+                result: Optional[ExtractedFacts] = output["parsed"]
+                if not result or not result.facts:
+                    return []
+
+                vectors = await self.embeddings.aembed_documents([fact.text for fact in result.facts])
+                index = self.index(user_id)
+                now = datetime.now(timezone.utc)
+                saved = []
+                for fact, vector in zip(result.facts, vectors):
+                    nearest = await index.search(vector, 1)
+                    if nearest and nearest[0][1] >= self.duplicate_similarity:
+                        # Restated or refined fact: keep one, with the newer wording
+                        memory = nearest[0][0].model_copy(
+                            update={"kind": fact.kind, "text": fact.text, "updated_at": now}
+                        )
+                    else:
+                        memory = UserMemory(
+                            id=uuid.uuid4().hex, kind=fact.kind, text=fact.text,
+                            created_at=now, updated_at=now,
+                        )
+                    await index.upsert(memory, vector)
+                    saved.append(memory)
+
+                self._last_retrieval.pop(user_id, None)
+                metrics.incr("memory.extracted", len(saved))
+                self.logger.info(f"Stored {len(saved)} memories for user {user_id}")
+                return saved
+
+            except Exception:
+                self.logger.error("Error extracting memories", exc_info=True, extra={"user_id": user_id})
+                return []
+
+    async def drain(self, timeout: float = 10.0) -> None:
+        """Wait for in-flight extractions, e.g. before shutdown"""
+        if self._pending:
+            await asyncio.wait(list(self._pending), timeout=timeout)
+
+
+def format_memories(memories: List[UserMemory]) -> List[SystemMessage]:
+    """Format retrieved memories as a context message"""
+    if not memories:
+        return []
+    lines = [f"- ({memory.kind}) {memory.text}" for memory in memories]
+    return [SystemMessage(content="WHAT YOU KNOW ABOUT THE USER\n" + "\n".join(lines))]
+
+
+memory_manager = MemoryManager()
@@ -0,0 +1,61 @@
+import threading
+from collections import defaultdict, deque
+from typing import Deque, Dict, Optional
+
+
+class Metrics:
+    """Process-wide counters and rolling latency/size samples.
+
+    Deliberately minimal: counters are monotonically increasing floats and
+    observations keep the most recent `window` values per name, which is
+    enough for hit rates and rolling percentiles in logs and diagnostics.
+    """
+
+    def __init__(self, window: int = 1024):
+        self.window = window
+        self._lock = threading.Lock()
+        self.counters: Dict[str, float] = defaultdict(float)
+        self.samples: Dict[str, Deque[float]] = {}
+
+    def incr(self, name: str, value: float = 1.0) -> None:
+        with self._lock:
+            self.counters[name] += value
+
+    def observe(self, name: str, value: float) -> None:
+        with self._lock:
+            if name not in self.samples:
+                self.samples[name] = deque(maxlen=self.window)
+            self.samples[name].append(value)
+
+    def percentile(self, name: str, q: float) -> Optional[float]:
+        """Rolling percentile (0-100) of an observed series, or None if empty"""
+        with self._lock:
+            values = sorted(self.samples.get(name, ()))
+        if not values:
+            return None
+        index = min(len(values) - 1, int(round(q / 100 * (len(values) - 1))))
+        return values[index]
+
+    def ratio(self, numerator: str, denominator: str) -> Optional[float]:
+        with self._lock:
+            total = self.counters.get(denominator, 0.0)
+            return self.counters.get(numerator, 0.0) / total if total else None
+
+    def snapshot(self) -> Dict[str, Dict[str, float]]:
+        """Counters plus p50/p90/p99 of every observed series"""
+        with self._lock:
+            counters = dict(self.counters)
+            names = list(self.samples)
+        summaries = {
+            name: {
+                "count": len(self.samples[name]),
+                "p50": self.percentile(name, 50),
+                "p90": self.percentile(name, 90),
+                "p99": self.percentile(name, 99),
+            }
+            for name in names
+        }
+        return {"counters": counters, "samples": summaries}
+
+
+metrics = Metrics()
@@ -0,0 +1,180 @@
+import logging
+import os
+import re
+from typing import Any, Dict, List, Literal, Optional, Sequence
+from langchain_openai import ChatOpenAI
+from pydantic import BaseModel
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+TIER = Literal["canned", "small", "full"]
+
+GREETING_PATTERN = re.compile(
+    r"^\s*(hi|hello|hey|yo|hiya|good (morning|afternoon|evening)|gm)\b[\s!.,👋]*$",
+    re.IGNORECASE,
+)
+# Only thanks: "ok" or "sounds good" may be agreeing to something the coach proposed
+ACK_PATTERN = re.compile(
+    r"^\s*(thanks|thank you|thanks a lot|many thanks|thx|ty|👍|🙏)[\s!.,👍🙏]*$",
+    re.IGNORECASE,
+)
+PLANNING_PATTERN = re.compile(
+    r"\b(plan|planning|week|weekly|month|prioriti[sz]e|schedule|strategy|goals?|review|"
+    r"overwhelm\w*|reorganize|break down|roadmap|habit)\b",
+    re.IGNORECASE,
+)
+
+CANNED_RESPONSES = {
+    "greeting": "Hi! 👋 What would you like to focus on today?",
+    "ack": "You're welcome! Let me know whenever you want to look at your tasks again. 💪",
+}
+
+
+def awaits_answer(history: Sequence[Any]) -> bool:
+    """Whether the coach's last message asked a question or proposed an action"""
+    for message in reversed(history):
+        if getattr(message, "type", None) != "ai":
+            continue
+        content = message.content if isinstance(message.content, str) else ""
+        return bool(getattr(message, "tool_calls", None)) or "?" in content
+    return False
+
+
+class TierConfig(BaseModel):
+    """Model, endpoint and pricing for one LLM tier"""
+
+    name: TIER
+    model: str
+    base_url: Optional[str] = None
+    api_key: Optional[str] = None
+    timeout: float
+    # Optional second OpenAI-compatible endpoint for hedged requests
+    hedge_model: Optional[str] = None
+    hedge_base_url: Optional[str] = None
+    hedge_api_key: Optional[str] = None
+    # USD per million tokens
+    input_cost: float
+    output_cost: float
+
+
+def _tier_from_env(name: TIER, model: str, timeout: str, input_cost: str, output_cost: str) -> TierConfig:
+    prefix = f"COACH_{name.upper()}"
+    return TierConfig(
+        name=name,
+        model=os.getenv(f"{prefix}_MODEL", model),
+        # Any OpenAI-compatible endpoint works, e.g. a local server for testing
+        base_url=os.getenv(f"{prefix}_BASE_URL") or os.getenv("COACH_LLM_BASE_URL"),
+        api_key=os.getenv(f"{prefix}_API_KEY") or os.getenv("COACH_LLM_API_KEY"),
+        timeout=float(os.getenv(f"{prefix}_TIMEOUT", timeout)),
+        hedge_model=os.getenv(f"{prefix}_HEDGE_MODEL"),
+        hedge_base_url=os.getenv(f"{prefix}_HEDGE_BASE_URL"),
+        hedge_api_key=os.getenv(f"{prefix}_HEDGE_API_KEY"),
+        input_cost=float(os.getenv(f"{prefix}_INPUT_COST", input_cost)),
+        output_cost=float(os.getenv(f"{prefix}_OUTPUT_COST", output_cost)),
+    )
+
+
+class ModelRouter:
+    """Picks a model tier per turn from cheap local features of the message.
+
+    Greetings and thanks get a canned reply, unless they may be answering a
+    question or proposal from the coach; planning-style or long requests go
+    to the full model and everything else to the small model.
+    Each tier has a fallback order used when a model errors or times out.
+    """
+
+    FALLBACKS: Dict[str, List[str]] = {
+        "canned": ["canned"],
+        "small": ["small", "full"],
+        "full": ["full", "small"],
+    }
+    DEGRADED: Dict[str, str] = {"full": "small"}
+
+    def __init__(self):
+        self.logger = logger.getChild('ModelRouter')
+        self.tiers: Dict[str, TierConfig] = {
+            "small": _tier_from_env("small", "gpt-4o-mini", "20", "0.15", "0.60"),
+            "full": _tier_from_env("full", "gpt-4o", "45", "2.50", "10.00"),
+        }
+        self.long_message_chars = int(os.getenv("COACH_FULL_MIN_CHARS", "280"))
+        self.many_tasks = int(os.getenv("COACH_FULL_MIN_TASKS", "40"))
+
+    def has_hedge_endpoint(self, tier: str) -> bool:
+        config = self.tiers[tier]
+        return bool(config.hedge_model or config.hedge_base_url)
+
+    def create_llm(self, tier: str, hedge: bool = False) -> ChatOpenAI:
+        """Build the chat model for an LLM tier, or for its hedge endpoint"""
+        config = self.tiers[tier]
+        return ChatOpenAI(
+            model=(hedge and config.hedge_model) or config.model,
+            temperature=0,
+            streaming=True,
+            stream_usage=True,
+            base_url=(hedge and config.hedge_base_url) or config.base_url,
+            api_key=(hedge and config.hedge_api_key) or config.api_key,
+            max_retries=0,  # retries are handled by tier fallback
+        )
+
+    def route(self, message: str, task_count: int, in_tool_loop: bool = False,
+              history: Sequence[Any] = ()) -> str:
+        """Choose the cheapest tier expected to handle this turn well"""
+        text = message.strip()
+        if not in_tool_loop and self.canned_kind(text) and not awaits_answer(history):
+            tier = "canned"
+        elif (
+            len(text) >= self.long_message_chars
+            or PLANNING_PATTERN.search(text)
+            or (task_count >= self.many_tasks and "?" in text)
+        ):
+            tier = "full"
+        else:
+            tier = "small"
+        metrics.incr(f"llm.tier.{tier}.routed")
+        self.logger.debug(f"Routed message ({len(text)} chars, {task_count} tasks) to {tier} tier")
+        return tier
+
+    def degrade(self, tier: str) -> str:
+        """The tier to use instead for users over their quota"""
+        degraded = self.DEGRADED.get(tier, tier)
+        if degraded != tier:
+            metrics.incr(f"llm.tier.{tier}.degraded")
+        return degraded
+
+    def fallback_order(self, tier: str) -> List[str]:
+        return self.FALLBACKS[tier]
+
+    @staticmethod
+    def canned_kind(text: str) -> Optional[str]:
+        if GREETING_PATTERN.match(text):
+            return "greeting"
+        if ACK_PATTERN.match(text):
+            return "ack"
+        return None
+
+    def canned_response(self, message: str) -> Optional[str]:
+        kind = self.canned_kind(message.strip())
+        return CANNED_RESPONSES[kind] if kind else None
+
+    def estimate_cost(self, tier: str, usage: Dict[str, Any]) -> float:
+        """USD cost of one response from its usage metadata"""
+        config = self.tiers.get(tier)
+        if not config or not usage:
+            return 0.0
+        return (
+            usage.get("input_tokens", 0) * config.input_cost
+            + usage.get("output_tokens", 0) * config.output_cost
+        ) / 1_000_000
+
+    def record(self, tier: str, elapsed: float, usage: Optional[Dict[str, Any]] = None,
+               failed: bool = False) -> float:
+        """Record latency, cost and outcome for one tier attempt"""
+        metrics.observe(f"llm.tier.{tier}.latency", elapsed)
+        if failed:
+            metrics.incr(f"llm.tier.{tier}.errors")
+            return 0.0
+        cost = self.estimate_cost(tier, usage or {})
+        metrics.incr(f"llm.tier.{tier}.requests")
+        metrics.incr(f"llm.tier.{tier}.cost_usd", cost)
+        return cost
@@ -0,0 +1,326 @@
+import asyncio
+import itertools
+import logging
+import os
+import sqlite3
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, Optional, Set
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError, TelegramRetryAfter
+from .metrics import metrics
+from .runtime import data_path, json_dumps, json_loads
+
+logger = logging.getLogger(__name__)
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BULK = 1
+
+
+class TokenBucket:
+    """Classic token bucket; `delay()` reports how long until a token is free"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self) -> float:
+        now = time.monotonic()
+        self._refill(now)
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self) -> None:
+        self._refill(time.monotonic())
+        self.tokens -= 1
+
+    def block(self, seconds: float) -> None:
+        """Stop handing out tokens for `seconds`, e.g. after a 429 retry_after"""
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+        self.tokens = min(self.tokens, 0)
+
+
+class OutboundBacklog:
+    """SQLite-persisted record of messages accepted but not yet delivered"""
+
+    def __init__(self, path: str):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS outbound ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, chat_id INTEGER NOT NULL, "
+            "priority INTEGER NOT NULL, payload TEXT NOT NULL, created_at REAL NOT NULL, "
+            "update_key TEXT)"
+        )
+        columns = {row[1] for row in self.conn.execute("PRAGMA table_info(outbound)")}
+        if "update_key" not in columns:
+            # Backlogs written before replies were linked to their update
+            self.conn.execute("ALTER TABLE outbound ADD COLUMN update_key TEXT")
+        self.conn.commit()
+
+    def add(self, chat_id: int, priority: int, payload: Dict[str, Any],
+            update_key: Optional[str] = None) -> int:
+        cursor = self.conn.execute(
+            "INSERT INTO outbound (chat_id, priority, payload, created_at, update_key) VALUES (?, ?, ?, ?, ?)",
+            (chat_id, priority, json_dumps(payload), time.time(), update_key),
+        )
+        self.conn.commit()
+        return cursor.lastrowid
+
+    def remove(self, row_id: int) -> None:
+        self.conn.execute("DELETE FROM outbound WHERE id = ?", (row_id,))
+        self.conn.commit()
+
+    def pending(self) -> Iterable[tuple]:
+        return self.conn.execute(
+            "SELECT id, chat_id, priority, payload, update_key FROM outbound ORDER BY priority, id"
+        ).fetchall()
+
+    def close(self) -> None:
+        self.conn.close()
+
+
+class OutboundJob:
+    __slots__ = ("chat_id", "method", "payload", "priority", "future", "row_id",
+                 "expires_at", "attempts", "update_key")
+
+    def __init__(self, chat_id: int, method: str, payload: Dict[str, Any], priority: int,
+                 future: Optional[asyncio.Future], row_id: Optional[int] = None,
+                 expires_at: Optional[float] = None, update_key: Optional[str] = None):
+        self.chat_id = chat_id
+        self.method = method
+        self.payload = payload
+        self.priority = priority
+        self.future = future
+        self.row_id = row_id
+        self.expires_at = expires_at
+        self.attempts = 0
+        # Ledger key of the incoming update this message replies to
+        self.update_key = update_key
+
+
+class OutboundSender:
+    """Central rate-limited sender for everything the bot posts to Telegram.
+
+    A global token bucket keeps the bot under Telegram's ~30 msg/s limit and
+    per-chat buckets under ~1 msg/s per chat. Interactive replies always
+    dequeue ahead of bulk sends, jobs whose chat is throttled are parked
+    instead of blocking other chats, 429 responses pause sending for
+    `retry_after`, and undelivered messages survive restarts in a backlog.
+    Chat actions only count against the global bucket, so a typing
+    indicator does not delay the reply that follows it.
+    """
+
+    MAX_ATTEMPTS = 5
+    TYPING_TTL = 5.0
+
+    def __init__(self, bot, global_rate: Optional[float] = None, chat_rate: Optional[float] = None,
+                 backlog_path: Optional[str] = None):
+        self.logger = logger.getChild('OutboundSender')
+        self.bot = bot
+        # Telegram counts over a sliding second, so pace evenly instead of
+        # allowing a burst on top of the steady rate
+        self.global_bucket = TokenBucket(
+            global_rate or float(os.getenv("TELEGRAM_GLOBAL_RATE", "30")),
+            float(os.getenv("TELEGRAM_GLOBAL_BURST", "1")),
+        )
+        self.chat_rate = chat_rate or float(os.getenv("TELEGRAM_CHAT_RATE", "1"))
+        self.chat_buckets: Dict[int, TokenBucket] = {}
+        self.backlog = OutboundBacklog(
+            backlog_path or os.getenv("OUTBOUND_BACKLOG_PATH") or data_path("outbound.db")
+        )
+        self.queue: "asyncio.PriorityQueue[tuple]" = asyncio.PriorityQueue()
+        self._seq = itertools.count()
+        self._worker: Optional[asyncio.Task] = None
+        self._parked = 0
+        # Deliveries awaiting the Bot API; the loop only holds tasks weakly
+        self._inflight: Set[asyncio.Task] = set()
+        # Restored backlog messages per update key, and a hook called once all are sent
+        self.pending_updates: Dict[str, int] = {}
+        self.on_delivered: Optional[Callable[[str], Any]] = None
+
+    async def start(self) -> None:
+        """Reload the persisted backlog and start the delivery loop"""
+        for row_id, chat_id, priority, payload, update_key in self.backlog.pending():
+            self._track(update_key)
+            self._put(OutboundJob(chat_id, "send_message", json_loads(payload), priority,
+                                  None, row_id=row_id, update_key=update_key))
+        if self.queue.qsize():
+            self.logger.info(f"Restored {self.queue.qsize()} undelivered messages from backlog")
+        self._worker = asyncio.create_task(self._run())
+
+    async def stop(self, drain_timeout: float = 5.0) -> None:
+        """Give queued messages a moment to go out; the rest stay in the backlog"""
+        deadline = time.monotonic() + drain_timeout
+        while (self.queue.qsize() or self._parked) and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        if self._worker:
+            self._worker.cancel()
+        # Deliveries still in flight update the backlog when they finish
+        if self._inflight:
+            _, pending = await asyncio.wait(self._inflight, timeout=drain_timeout)
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+        self.backlog.close()
+
+    async def send_message(self, chat_id: int, text: str, priority: int = PRIORITY_INTERACTIVE,
+                           wait: bool = True, update_key: Optional[str] = None, **kwargs) -> Any:
+        """Queue a message; by default wait until Telegram accepted it
+
+        update_key links a reply to the incoming update it answers, so that if
+        it is only delivered from the backlog after a restart, that update is
+        marked delivered (and not replayed) once all its messages are sent.
+        """
+        payload = {"text": text, **kwargs}
+        row_id = self.backlog.add(chat_id, priority, payload, update_key)
+        future = asyncio.get_running_loop().create_future() if wait else None
+        self._put(OutboundJob(chat_id, "send_message", payload, priority, future, row_id=row_id,
+                              update_key=update_key))
+        metrics.incr("telegram.outbound.enqueued")
+        return await future if future else None
+
+    async def send_chat_action(self, chat_id: int, action: str = "typing") -> None:
+        """Queue a chat action; stale actions are dropped rather than sent late"""
+        self._put(OutboundJob(chat_id, "send_chat_action", {"action": action},
+                              PRIORITY_INTERACTIVE, None,
+                              expires_at=time.monotonic() + self.TYPING_TTL))
+
+    async def broadcast(self, chat_ids: Iterable[int], text: str, **kwargs) -> None:
+        """Queue a bulk message to many chats without waiting for delivery"""
+        for chat_id in chat_ids:
+            await self.send_message(chat_id, text, priority=PRIORITY_BULK, wait=False, **kwargs)
+
+    def has_pending(self, update_key: str) -> bool:
+        """Whether a reply to this update is still waiting in the backlog"""
+        return update_key in self.pending_updates
+
+    def _track(self, update_key: Optional[str]) -> None:
+        if update_key is not None:
+            self.pending_updates[update_key] = self.pending_updates.get(update_key, 0) + 1
+
+    def _settle(self, job: OutboundJob, delivered: bool) -> None:
+        if job.row_id is not None:
+            self.backlog.remove(job.row_id)
+        key = job.update_key
+        if key is None or key not in self.pending_updates:
+            return
+        self.pending_updates[key] -= 1
+        if self.pending_updates[key] <= 0:
+            del self.pending_updates[key]
+            if delivered and self.on_delivered:
+                self.on_delivered(key)
+
+    def _put(self, job: OutboundJob) -> None:
+        self.queue.put_nowait((job.priority, next(self._seq), job))
+
+    def _park(self, job: OutboundJob, delay: float) -> None:
+        """Re-queue a job once its chat can accept messages again"""
+        self._parked += 1
+
+        def requeue():
+            self._parked -= 1
+            self._put(job)
+
+        asyncio.get_running_loop().call_later(delay, requeue)
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self.chat_buckets) > 10_000:
+                # Drop buckets of chats that are idle (full) to bound memory
+                self.chat_buckets = {
+                    key: value for key, value in self.chat_buckets.items()
+                    if value.delay() > 0 or value.tokens < value.capacity
+                }
+            bucket = self.chat_buckets[chat_id] = TokenBucket(self.chat_rate, 1)
+        return bucket
+
+    async def _run(self) -> None:
+        while True:
+            _, _, job = await self.queue.get()
+            try:
+                await self._dispatch(job)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                self.logger.error("Unexpected error in outbound loop", exc_info=True)
+
+    async def _dispatch(self, job: OutboundJob) -> None:
+        if job.expires_at and time.monotonic() > job.expires_at:
+            metrics.incr("telegram.outbound.expired")
+            return
+
+        chat_bucket = self._chat_bucket(job.chat_id)
+        # Chat actions are not messages: they leave the chat's token for the reply
+        # and only wait out a 429 on the chat
+        action = job.method == "send_chat_action"
+        chat_delay = max(0.0, chat_bucket.blocked_until - time.monotonic()) if action else chat_bucket.delay()
+        if chat_delay > 0:
+            self._park(job, chat_delay)
+            return
+
+        global_delay = self.global_bucket.delay()
+        while global_delay > 0:
+            await asyncio.sleep(global_delay)
+            global_delay = self.global_bucket.delay()
+
+        if not action:
+            chat_bucket.take()
+        self.global_bucket.take()
+        job.attempts += 1
+        task = asyncio.create_task(self._deliver(job, chat_bucket))
+        self._inflight.add(task)
+        task.add_done_callback(self._inflight.discard)
+
+    async def _deliver(self, job: OutboundJob, chat_bucket: TokenBucket) -> None:
+        started = time.monotonic()
+        try:
+            result = await getattr(self.bot, job.method)(chat_id=job.chat_id, **job.payload)
+        except TelegramRetryAfter as e:
+            metrics.incr("telegram.outbound.retry_after")
+            self.logger.warning(f"Telegram asked to retry chat {job.chat_id} after {e.retry_after}s")
+            chat_bucket.block(e.retry_after)
+            # A flood wait may be bot-wide; other chats would only collect more 429s
+            self.global_bucket.block(e.retry_after)
+            self._retry_or_fail(job, e, delay=e.retry_after)
+            return
+        except Exception as e:
+            metrics.incr("telegram.outbound.errors")
+            self.logger.error(
+                f"Failed to deliver {job.method} to chat {job.chat_id}",
+                exc_info=True,
+                extra={"chat_id": job.chat_id, "attempt": job.attempts},
+            )
+            # Client errors (blocked bot, bad markup) will not succeed on retry
+            self._retry_or_fail(job, e, delay=2 ** job.attempts, retry=self._is_transient(e))
+            return
+
+        metrics.incr(f"telegram.outbound.sent.p{job.priority}")
+        metrics.observe("telegram.outbound.send_latency", time.monotonic() - started)
+        self._settle(job, delivered=True)
+        if job.future and not job.future.done():
+            job.future.set_result(result)
+
+    def _retry_or_fail(self, job: OutboundJob, error: Exception, delay: float, retry: bool = True) -> None:
+        if retry and job.attempts < self.MAX_ATTEMPTS and not (
+            job.expires_at and time.monotonic() + delay > job.expires_at
+        ):
+            self._park(job, delay)
+            return
+        self._settle(job, delivered=False)
+        if job.future and not job.future.done():
+            job.future.set_exception(error)
+
+    @staticmethod
+    def _is_transient(error: Exception) -> bool:
+        return not isinstance(error, (TelegramBadRequest, TelegramForbiddenError))
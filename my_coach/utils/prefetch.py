@@ -0,0 +1,267 @@
+import asyncio
+import logging
+import os
+import sqlite3
+import time
+from array import array
+from collections import deque
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Deque, Dict, Iterable, List, Optional, Set, Tuple
+from pydantic import ValidationError
+from ..models import UserPreferences
+from .briefings import summary_at
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+HOURS_PER_WEEK = 7 * 24
+# Weight of the same hour on other weekdays, so daily habits count before a week repeats
+DAILY_WEIGHT = 0.25
+
+
+def hour_of_week(ts: float) -> int:
+    """UTC hour of the week, 0 being Monday 00:00"""
+    return int(ts // 3600 + 72) % HOURS_PER_WEEK
+
+
+class ActivityProfile:
+    """Decayed counts of the hours of the week a user has been active in"""
+
+    __slots__ = ("hours", "updated_at", "last_hour")
+
+    def __init__(self, hours: Optional[array] = None, updated_at: float = 0.0, last_hour: int = -1):
+        self.hours = hours if hours is not None else array("f", bytes(4 * HOURS_PER_WEEK))
+        self.updated_at = updated_at
+        # Epoch hour of the last recorded activity; an hour is counted once
+        self.last_hour = last_hour
+
+    def record(self, ts: float, half_life: float) -> bool:
+        """Count activity at a time, returning whether the profile changed"""
+        hour = int(ts // 3600)
+        if hour == self.last_hour:
+            return False
+        if self.updated_at:
+            decay = 0.5 ** (max(0.0, ts - self.updated_at) / half_life)
+            for index, weight in enumerate(self.hours):
+                self.hours[index] = weight * decay
+        self.hours[hour_of_week(ts)] += 1.0
+        self.updated_at = ts
+        self.last_hour = hour
+        return True
+
+    def score(self, ts: float, half_life: float) -> float:
+        """Expected activity in the hour containing a time"""
+        slot = hour_of_week(ts)
+        same_hour = sum(self.hours[slot % 24::24]) - self.hours[slot]
+        decay = 0.5 ** (max(0.0, ts - self.updated_at) / half_life)
+        return (self.hours[slot] + DAILY_WEIGHT * same_hour) * decay
+
+
+class TaskPrefetcher:
+    """Warms the task store of users shortly before they usually show up.
+
+    Message timestamps build a per-user profile of active hours of the
+    week, and each user's daily summary time counts as an active window.
+    Shortly before a predicted window the user's session is loaded (from
+    its snapshot, where there is one) and synced, so their first message
+    finds a delta sync instead of a cold fetch. Warm-ups run with bounded
+    concurrency and within an hourly request budget. A warm-up followed by a
+    message within the hit window counts as a hit, one that expires unused
+    as wasted.
+    """
+
+    def __init__(self, path: Optional[str] = None, concurrency: Optional[int] = None,
+                 budget: Optional[int] = None, lead_minutes: Optional[float] = None,
+                 interval: Optional[float] = None):
+        self.logger = logger.getChild('TaskPrefetcher')
+        self.enabled = os.getenv("PREFETCH_ENABLED", "true").lower() == "true"
+        self.concurrency = concurrency or int(os.getenv("PREFETCH_CONCURRENCY", "4"))
+        # Warm-up syncs allowed per rolling hour across all users
+        self.budget = budget or int(os.getenv("PREFETCH_BUDGET", "600"))
+        self.lead = timedelta(minutes=lead_minutes or float(os.getenv("PREFETCH_LEAD_MINUTES", "10")))
+        self.interval = interval or float(os.getenv("PREFETCH_INTERVAL", "300"))
+        self.threshold = float(os.getenv("PREFETCH_THRESHOLD", "1.0"))
+        self.half_life = float(os.getenv("PREFETCH_HALF_LIFE_DAYS", "28")) * 86400
+        self.hit_window = float(os.getenv("PREFETCH_HIT_WINDOW", "3600"))
+        # Sessions synced more recently than this are already warm
+        self.fresh_for = float(os.getenv("PREFETCH_FRESH_SECONDS", "900"))
+        # Which users this process warms; set by clustered workers
+        self.owns: Callable[[int], bool] = lambda user_id: True
+        self.profiles: Dict[int, ActivityProfile] = {}
+        # User id -> (warmed at, seconds the warm-up took)
+        self.warmed: Dict[int, Tuple[float, float]] = {}
+        self._spent: Deque[float] = deque()
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        self.path = path or os.getenv("PREFETCH_DB_PATH", "data/activity.db")
+        self._conn: Optional[sqlite3.Connection] = None
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        if self._conn is None:
+            Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(self.path)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS activity ("
+                "user_id INTEGER PRIMARY KEY, hours BLOB NOT NULL, "
+                "updated_at REAL NOT NULL, last_hour INTEGER NOT NULL)"
+            )
+            self._conn.commit()
+            for user_id, hours, updated_at, last_hour in self._conn.execute(
+                "SELECT user_id, hours, updated_at, last_hour FROM activity"
+            ):
+                self.profiles[user_id] = ActivityProfile(array("f", hours), updated_at, last_hour)
+            self.logger.info(f"Loaded activity profiles of {len(self.profiles)} users")
+        return self._conn
+
+    def record(self, user_id: int, cold: bool = False, now: Optional[float] = None) -> None:
+        """Note a message from a user; cold means it found no loaded session"""
+        now = now or time.time()
+        conn = self.conn
+        warmed = self.warmed.pop(user_id, None)
+        if warmed is not None and now - warmed[0] <= self.hit_window:
+            metrics.incr("prefetch.hits")
+            metrics.observe("prefetch.saved", warmed[1])
+        elif warmed is not None:
+            metrics.incr("prefetch.wasted")
+        elif cold:
+            metrics.incr("prefetch.cold_starts")
+
+        profile = self.profiles.get(user_id)
+        if profile is None:
+            profile = self.profiles[user_id] = ActivityProfile()
+        if profile.record(now, self.half_life):
+            conn.execute(
+                "INSERT OR REPLACE INTO activity (user_id, hours, updated_at, last_hour) VALUES (?, ?, ?, ?)",
+                (user_id, profile.hours.tobytes(), profile.updated_at, profile.last_hour),
+            )
+            conn.commit()
+
+    def predicted(self, at: float) -> List[int]:
+        """Users whose profile expects them to be active in the hour containing `at`"""
+        self.conn  # Loads the stored profiles on first use
+        return [
+            user_id for user_id, profile in self.profiles.items()
+            if profile.score(at, self.half_life) >= self.threshold
+        ]
+
+    def scheduled(self, users: Iterable[Dict[str, Any]], now: datetime) -> List[int]:
+        """Users whose daily summary time falls within the lead window"""
+        horizon = now + self.lead + timedelta(seconds=self.interval)
+        user_ids = []
+        for row in users:
+            try:
+                preferences = UserPreferences(**row)
+            except ValidationError:
+                metrics.incr("prefetch.invalid_preferences")
+                self.logger.warning(
+                    "Skipping invalid preferences row", exc_info=True, extra={"user_id": row.get("user_id")}
+                )
+                continue
+            if not preferences.daily_summary_enabled:
+                continue
+            try:
+                at = summary_at(preferences, now)
+            except ValueError:
+                continue
+            if now <= at <= horizon:
+                user_ids.append(preferences.user_id)
+        return user_ids
+
+    def candidates(self, users: Iterable[Dict[str, Any]], sessions: Any,
+                   now: Optional[datetime] = None) -> List[int]:
+        """Users expected soon whose task store is not already warm"""
+        now = now or datetime.now(timezone.utc)
+        ts = now.timestamp()
+        expected: Set[int] = set(self.predicted(ts + self.lead.total_seconds()))
+        expected.update(self.scheduled(users, now))
+
+        pending = []
+        for user_id in sorted(expected):
+            if user_id in self.warmed or not self.owns(user_id):
+                continue
+            session = sessions.peek(user_id)
+            if session is not None and ts - session.todoist_client.synced_at < self.fresh_for:
+                continue
+            pending.append(user_id)
+        return pending
+
+    def _take_budget(self, now: float) -> bool:
+        while self._spent and now - self._spent[0] >= 3600:
+            self._spent.popleft()
+        if len(self._spent) >= self.budget:
+            return False
+        self._spent.append(now)
+        return True
+
+    async def warm(self, user_id: int, sessions: Any) -> bool:
+        """Load a user's session and sync their tasks ahead of their first message"""
+        async with self._semaphore:
+            started = time.perf_counter()
+            try:
+                # Not touched, so an unused warm session still ages out
+                session = sessions.get(user_id, touch=False)
+                await session.todoist_client.get_tasks()
+            except Exception:
+                metrics.incr("prefetch.errors")
+                self.logger.error("Error prefetching tasks", exc_info=True, extra={"user_id": user_id})
+                return False
+            elapsed = time.perf_counter() - started
+            self.warmed[user_id] = (time.time(), elapsed)
+            metrics.incr("prefetch.warmed")
+            metrics.observe("prefetch.latency", elapsed)
+            return True
+
+    def expire(self, now: Optional[float] = None) -> int:
+        """Count warm-ups not followed by a message within the hit window as wasted"""
+        cutoff = (now or time.time()) - self.hit_window
+        expired = [user_id for user_id, (warmed_at, _) in self.warmed.items() if warmed_at < cutoff]
+        for user_id in expired:
+            del self.warmed[user_id]
+        if expired:
+            metrics.incr("prefetch.wasted", len(expired))
+        return len(expired)
+
+    async def run_batch(self, users: Iterable[Dict[str, Any]], sessions: Any,
+                        now: Optional[datetime] = None) -> int:
+        """Warm every expected user, as far as the budget allows"""
+        self.expire(now.timestamp() if now else None)
+        pending = self.candidates(users, sessions, now)
+        if not pending:
+            return 0
+
+        selected = []
+        for user_id in pending:
+            if not self._take_budget(time.time()):
+                metrics.incr("prefetch.over_budget", len(pending) - len(selected))
+                self.logger.warning(
+                    f"Prefetch budget of {self.budget}/h spent, skipping {len(pending) - len(selected)} users"
+                )
+                break
+            selected.append(user_id)
+
+        started = time.perf_counter()
+        results = await asyncio.gather(*(self.warm(user_id, sessions) for user_id in selected))
+        warmed = sum(results)
+        self.logger.info(
+            f"Prefetched tasks of {warmed}/{len(selected)} users in {time.perf_counter() - started:.1f}s"
+        )
+        return warmed
+
+    async def run(self, fetch_users: Callable[[], Awaitable[List[Dict[str, Any]]]], sessions: Any) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.run_batch(await fetch_users(), sessions)
+            except Exception:
+                self.logger.error("Error in prefetch batch", exc_info=True)
+
+    def close(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+
+task_prefetcher = TaskPrefetcher()
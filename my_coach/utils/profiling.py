@@ -0,0 +1,242 @@
+import logging
+import os
+import random
+import sys
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Set
+from langchain_core.callbacks import BaseCallbackHandler
+
+logger = logging.getLogger(__name__)
+
+_current_profile: ContextVar[Optional["RequestProfile"]] = ContextVar("current_profile", default=None)
+_NO_SPAN = nullcontext()
+
+
+class Span:
+    __slots__ = ("name", "parent", "wall_start", "cpu_start", "wall", "cpu")
+
+    def __init__(self, name: str, parent: Any):
+        self.name = name
+        self.parent = parent
+        self.wall_start = time.perf_counter()
+        self.cpu_start = time.process_time()
+        self.wall = 0.0
+        self.cpu = 0.0
+
+
+class StackSampler(threading.Thread):
+    """Samples one thread's Python stack at a fixed interval into folded stacks"""
+
+    def __init__(self, thread_id: int, interval: float):
+        super().__init__(daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.counts: Dict[str, int] = defaultdict(int)
+        self._stopped = threading.Event()
+
+    def run(self) -> None:
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{Path(code.co_filename).stem}:{code.co_name}")
+                frame = frame.f_back
+            if stack:
+                self.counts[";".join(reversed(stack))] += 1
+
+    def stop(self) -> Dict[str, int]:
+        self._stopped.set()
+        self.join()
+        return dict(self.counts)
+
+
+class RequestProfile:
+    """Wall-clock and CPU timings of one profiled request, as a tree of spans.
+
+    CPU time is process time while the span was open, so it includes other
+    coroutines that ran while the span was awaiting I/O.
+    """
+
+    def __init__(self, user_id: str, sample_interval: Optional[float] = None):
+        self.user_id = user_id
+        self.root = Span("turn", None)
+        self.spans: Dict[Any, Span] = {}
+        self.open: List[Any] = []
+        self.sampler: Optional[StackSampler] = None
+        if sample_interval:
+            self.sampler = StackSampler(threading.get_ident(), sample_interval)
+            self.sampler.start()
+
+    def start(self, key: Any, name: str, parent: Any = None) -> None:
+        # Spans outside the run tree (client calls) nest under the newest open run
+        if parent not in self.spans:
+            parent = self.open[-1] if self.open else None
+        self.spans[key] = Span(name, parent)
+        self.open.append(key)
+
+    def end(self, key: Any) -> None:
+        span = self.spans.get(key)
+        if span is None:
+            return
+        span.wall = time.perf_counter() - span.wall_start
+        span.cpu = time.process_time() - span.cpu_start
+        if key in self.open:
+            self.open.remove(key)
+
+    @contextmanager
+    def span(self, name: str) -> Iterator[None]:
+        key = object()
+        self.start(key, name)
+        try:
+            yield
+        finally:
+            self.end(key)
+
+    def finish(self) -> Dict[str, int]:
+        self.root.wall = time.perf_counter() - self.root.wall_start
+        self.root.cpu = time.process_time() - self.root.cpu_start
+        return self.sampler.stop() if self.sampler else {}
+
+    def path(self, key: Any) -> str:
+        names = []
+        while key is not None:
+            span = self.spans[key]
+            names.append(span.name.replace(";", ","))
+            key = span.parent
+        return ";".join(["turn"] + names[::-1])
+
+    def folded_spans(self) -> Dict[str, int]:
+        """Self wall time in microseconds per span path, in folded-stack format"""
+        child_wall: Dict[Any, float] = defaultdict(float)
+        for span in self.spans.values():
+            child_wall[span.parent] += span.wall
+        folded: Dict[str, int] = defaultdict(int)
+        folded["turn"] = int(max(0.0, self.root.wall - child_wall[None]) * 1e6)
+        for key, span in self.spans.items():
+            folded[self.path(key)] += int(max(0.0, span.wall - child_wall[key]) * 1e6)
+        return folded
+
+    def summary(self) -> str:
+        totals: Dict[str, List[float]] = defaultdict(lambda: [0.0, 0.0])
+        for span in self.spans.values():
+            totals[span.name][0] += span.wall
+            totals[span.name][1] += span.cpu
+        top = sorted(totals.items(), key=lambda item: item[1][0], reverse=True)[:8]
+        parts = [f"{name} {wall * 1000:.1f}ms/{cpu * 1000:.1f}ms cpu" for name, (wall, cpu) in top]
+        return f"turn {self.root.wall * 1000:.1f}ms/{self.root.cpu * 1000:.1f}ms cpu: " + ", ".join(parts)
+
+
+class ProfilingCallbackHandler(BaseCallbackHandler):
+    """Times graph nodes, chains and model calls of one run via callbacks"""
+
+    run_inline = True
+
+    def __init__(self, profile: RequestProfile):
+        self.profile = profile
+
+    def on_chain_start(self, serialized, inputs, *, run_id, parent_run_id=None, **kwargs) -> None:
+        name = kwargs.get("name") or (serialized or {}).get("name") or "chain"
+        self.profile.start(run_id, name, parent_run_id)
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs) -> None:
+        self.profile.end(run_id)
+
+    def on_chain_error(self, error, *, run_id, **kwargs) -> None:
+        self.profile.end(run_id)
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, parent_run_id=None, **kwargs) -> None:
+        name = kwargs.get("name") or (serialized or {}).get("name") or "chat_model"
+        self.profile.start(run_id, f"llm:{name}", parent_run_id)
+
+    def on_llm_start(self, serialized, prompts, *, run_id, parent_run_id=None, **kwargs) -> None:
+        self.profile.start(run_id, "llm", parent_run_id)
+
+    def on_llm_end(self, response, *, run_id, **kwargs) -> None:
+        self.profile.end(run_id)
+
+    def on_llm_error(self, error, *, run_id, **kwargs) -> None:
+        self.profile.end(run_id)
+
+
+def span(name: str):
+    """Time a block under the current request's profile; a no-op when not profiling"""
+    profile = _current_profile.get()
+    if profile is None:
+        return _NO_SPAN
+    return profile.span(name)
+
+
+class Profiler:
+    """Decides which requests are profiled and writes their results.
+
+    Requests of enabled users and a random PROFILE_SAMPLE_RATE share of all
+    requests are profiled. Each profile is written as folded stacks, which
+    flamegraph.pl, speedscope and similar tools read directly: span self
+    times in microseconds and, with PROFILE_STACK_SAMPLING, sampled Python
+    stacks. Requests that are not profiled run without callbacks or timers.
+    """
+
+    def __init__(self):
+        self.logger = logger.getChild('Profiler')
+        self.users: Set[str] = {
+            user_id.strip() for user_id in os.getenv("PROFILE_USER_IDS", "").split(",") if user_id.strip()
+        }
+        self.sample_rate = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+        self.stack_sampling = os.getenv("PROFILE_STACK_SAMPLING", "false").lower() == "true"
+        self.sample_interval = float(os.getenv("PROFILE_SAMPLE_INTERVAL_MS", "5")) / 1000
+        self.output_dir = Path(os.getenv("PROFILE_DIR", "data/profiles"))
+
+    def toggle_user(self, user_id: str) -> bool:
+        """Switch profiling for a user on or off, returning the new state"""
+        if user_id in self.users:
+            self.users.discard(user_id)
+            return False
+        self.users.add(user_id)
+        return True
+
+    def begin(self, user_id: str) -> Optional[RequestProfile]:
+        """Start profiling this request if the user or the sample calls for it"""
+        if user_id not in self.users and not (self.sample_rate and random.random() < self.sample_rate):
+            return None
+        return RequestProfile(user_id, self.sample_interval if self.stack_sampling else None)
+
+    @contextmanager
+    def activate(self, profile: Optional[RequestProfile]) -> Iterator[None]:
+        """Make the profile current so client spans record into it"""
+        if profile is None:
+            yield
+            return
+        token = _current_profile.set(profile)
+        try:
+            yield
+        finally:
+            _current_profile.reset(token)
+
+    def finish(self, profile: RequestProfile) -> Optional[Path]:
+        """Stop timers and write the profile files, returning the spans file"""
+        stacks = profile.finish()
+        self.logger.info(f"Profile for user {profile.user_id}: {profile.summary()}")
+        try:
+            self.output_dir.mkdir(parents=True, exist_ok=True)
+            prefix = self.output_dir / f"{profile.user_id}-{int(time.time() * 1000)}"
+            spans_path = prefix.with_suffix(".spans.folded")
+            spans_path.write_text(
+                "".join(f"{path} {weight}\n" for path, weight in profile.folded_spans().items() if weight)
+            )
+            if stacks:
+                prefix.with_suffix(".stacks.folded").write_text(
+                    "".join(f"{stack} {count}\n" for stack, count in stacks.items())
+                )
+            return spans_path
+        except Exception:
+            self.logger.error("Failed to write profile", exc_info=True, extra={"user_id": profile.user_id})
+            return None
+
+
+profiler = Profiler()
@@ -0,0 +1,75 @@
+import asyncio
+import json
+import logging
+import os
+from pathlib import Path
+from typing import Any, Callable, Coroutine, Optional, Union
+from dotenv import load_dotenv
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+# Opt-in: uvloop for the event loop and orjson for JSON, where installed
+FAST_RUNTIME = os.getenv("FAST_RUNTIME", "false").lower() == "true"
+USE_ORJSON = FAST_RUNTIME and orjson is not None
+USE_UVLOOP = FAST_RUNTIME and uvloop is not None
+
+
+def data_path(name: str) -> str:
+    """Default location of a process-local SQLite store.
+
+    Workers on one host each get their own directory, so they never read
+    another worker's state as their own.
+    """
+    worker_id = os.getenv("WORKER_ID")
+    return str(Path("data", worker_id, name) if worker_id else Path("data", name))
+
+
+def json_dumps(obj: Any, default: Optional[Callable[[Any], Any]] = None) -> str:
+    """Serialize to a JSON string, with orjson in the fast runtime"""
+    if USE_ORJSON:
+        try:
+            return orjson.dumps(obj, default=default).decode()
+        except TypeError:
+            # Types orjson does not handle, e.g. non-string dict keys
+            pass
+    return json.dumps(obj, default=default)
+
+
+def json_loads(data: Union[str, bytes]) -> Any:
+    if USE_ORJSON:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def run(main: Coroutine) -> Any:
+    """Run the application's main coroutine on uvloop when enabled"""
+    if USE_UVLOOP:
+        if hasattr(asyncio, "Runner"):
+            with asyncio.Runner(loop_factory=uvloop.new_event_loop) as runner:
+                return runner.run(main)
+        # asyncio.Runner is 3.11+; older versions pick the loop through the policy
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    return asyncio.run(main)
+
+
+def describe() -> str:
+    """One line summarizing the runtime in use, for startup logs"""
+    if not FAST_RUNTIME:
+        return "default runtime (asyncio, json)"
+    missing = [name for name, module in (("uvloop", uvloop), ("orjson", orjson)) if module is None]
+    return (
+        f"fast runtime: {'uvloop' if USE_UVLOOP else 'asyncio'}, {'orjson' if USE_ORJSON else 'json'}"
+        + (f" ({', '.join(missing)} not installed)" if missing else "")
+    )
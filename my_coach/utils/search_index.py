@@ -0,0 +1,163 @@
+import heapq
+import math
+import re
+from collections import defaultdict
+from typing import Dict, List, Set, Tuple
+from ..models import SimpleTask
+
+TOKEN_PATTERN = re.compile(r"\w+", re.UNICODE)
+STOPWORDS = {
+    "a", "an", "and", "the", "to", "of", "in", "on", "for", "with", "at", "by", "is", "it",
+    "my", "me", "i", "how", "what", "whats", "s", "going", "thing", "do", "did", "about",
+}
+# Matches in the title count more than label matches, which count more than notes
+FIELD_WEIGHTS = {"content": 3.0, "labels": 2.0, "description": 1.0}
+
+
+def tokenize(text: str) -> List[str]:
+    return [token for token in TOKEN_PATTERN.findall(text.lower()) if token not in STOPWORDS]
+
+
+def trigrams(term: str) -> Set[str]:
+    padded = f"  {term} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class TaskSearchIndex:
+    """In-process inverted index with fuzzy term matching over task text.
+
+    Postings map each term to the tasks containing it with a field-weighted
+    frequency. Query terms that are not in the vocabulary are expanded to
+    similar terms through a trigram index, so typos and word variants still
+    match ("taxs" -> "taxes"). Updated per task as deltas arrive.
+    """
+
+    MIN_SIMILARITY = 0.35
+    MAX_EXPANSIONS = 5
+    # Terms in more than this share of tasks only re-score candidates found
+    # through rarer terms instead of walking their whole posting list
+    COMMON_TERM_RATIO = 0.05
+
+    def __init__(self):
+        self.postings: Dict[str, Dict[str, float]] = defaultdict(dict)
+        self.doc_terms: Dict[str, Set[str]] = {}
+        self.term_trigrams: Dict[str, Set[str]] = defaultdict(set)
+        # Number of trigrams of each vocabulary term, for similarity scoring
+        self.gram_counts: Dict[str, int] = {}
+        self._expansions: Dict[str, List[Tuple[str, float]]] = {}
+
+    def __len__(self) -> int:
+        return len(self.doc_terms)
+
+    def upsert(self, task: SimpleTask) -> None:
+        self.remove(task.id)
+        if task.is_completed:
+            return
+
+        weights: Dict[str, float] = defaultdict(float)
+        for field, text in (
+            ("content", task.content),
+            ("description", task.description),
+            ("labels", " ".join(task.labels or [])),
+        ):
+            for term in tokenize(text or ""):
+                weights[term] += FIELD_WEIGHTS[field]
+
+        for term, weight in weights.items():
+            if term not in self.postings:
+                self._add_term(term)
+            self.postings[term][task.id] = weight
+        self.doc_terms[task.id] = set(weights)
+
+    def remove(self, task_id: str) -> None:
+        for term in self.doc_terms.pop(task_id, ()):
+            postings = self.postings.get(term)
+            if postings is None:
+                continue
+            postings.pop(task_id, None)
+            if not postings:
+                del self.postings[term]
+                self._remove_term(term)
+
+    def clear(self) -> None:
+        self.postings.clear()
+        self.doc_terms.clear()
+        self.term_trigrams.clear()
+        self.gram_counts.clear()
+        self._expansions.clear()
+
+    def search(self, query: str, limit: int = 10) -> List[Tuple[str, float]]:
+        """Ranked (task_id, score) pairs for tasks matching the query"""
+        total_docs = len(self.doc_terms)
+        if not total_docs:
+            return []
+
+        matches = [
+            (term, quality)
+            for query_term in set(tokenize(query))
+            for term, quality in self._expand(query_term)
+        ]
+        # Rarest terms first so common ones can be restricted to their candidates
+        matches.sort(key=lambda match: len(self.postings[match[0]]))
+        common_threshold = max(50, total_docs * self.COMMON_TERM_RATIO)
+
+        scores: Dict[str, float] = defaultdict(float)
+        for term, quality in matches:
+            postings = self.postings[term]
+            factor = quality * math.log(1 + total_docs / len(postings))
+            if scores and len(postings) > common_threshold:
+                for task_id in list(scores):
+                    weight = postings.get(task_id)
+                    if weight:
+                        scores[task_id] += factor * weight
+                continue
+            for task_id, weight in postings.items():
+                scores[task_id] += factor * weight
+
+        return heapq.nlargest(limit, scores.items(), key=lambda item: item[1])
+
+    def _expand(self, query_term: str) -> List[Tuple[str, float]]:
+        """Vocabulary terms matching a query term with a match-quality factor"""
+        cached = self._expansions.get(query_term)
+        if cached is not None:
+            return cached
+
+        if query_term in self.postings:
+            matches = [(query_term, 1.0)]
+        else:
+            query_grams = trigrams(query_term)
+            overlap: Dict[str, int] = defaultdict(int)
+            for gram in query_grams:
+                for term in self.term_trigrams.get(gram, ()):
+                    overlap[term] += 1
+            matches = []
+            for term, shared in overlap.items():
+                if term.startswith(query_term) and len(query_term) >= 3:
+                    matches.append((term, 0.8))
+                    continue
+                similarity = shared / (len(query_grams) + self.gram_counts[term] - shared)
+                if similarity >= self.MIN_SIMILARITY:
+                    matches.append((term, similarity * 0.8))
+            matches.sort(key=lambda match: match[1], reverse=True)
+            matches = matches[:self.MAX_EXPANSIONS]
+
+        self._expansions[query_term] = matches
+        return matches
+
+    def _add_term(self, term: str) -> None:
+        grams = trigrams(term)
+        self.gram_counts[term] = len(grams)
+        for gram in grams:
+            self.term_trigrams[gram].add(term)
+        # New vocabulary can change fuzzy expansions
+        self._expansions.clear()
+
+    def _remove_term(self, term: str) -> None:
+        self.gram_counts.pop(term, None)
+        for gram in trigrams(term):
+            terms = self.term_trigrams.get(gram)
+            if terms is not None:
+                terms.discard(term)
+                if not terms:
+                    del self.term_trigrams[gram]
+        self._expansions.clear()
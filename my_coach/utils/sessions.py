@@ -0,0 +1,106 @@
+import logging
+import time
+from typing import Any, Callable, Dict, Iterator, Optional, Tuple
+from .todoist import TodoistClient
+
+logger = logging.getLogger(__name__)
+
+
+class UserSession:
+    """Per-user in-memory state: the compiled graph and its Todoist client"""
+
+    def __init__(self, user_id: int, graph: Any, todoist_client: TodoistClient):
+        self.user_id = user_id
+        self.graph = graph
+        self.todoist_client = todoist_client
+        self.created_at = time.time()
+        self.last_seen = self.created_at
+
+    def touch(self) -> None:
+        self.last_seen = time.time()
+
+
+def create_session(user_id: int) -> UserSession:
+    """Build a fresh session with its own Todoist client and agent graph"""
+    from ..agent import create_agent
+
+    todoist_client = TodoistClient()
+    return UserSession(user_id, create_agent(todoist_client), todoist_client)
+
+
+class SessionRegistry:
+    """Process-local registry of user sessions.
+
+    The single place where cache invalidations, local or received from other
+    processes, land.
+    """
+
+    def __init__(self, factory: Callable[[int], UserSession] = create_session):
+        self.logger = logger.getChild('SessionRegistry')
+        self.factory = factory
+        self.sessions: Dict[int, UserSession] = {}
+        # Optional hook that fans invalidations out to other processes
+        self.publisher: Optional[Callable[[int, str], Any]] = None
+        # Optional SnapshotStore new sessions are warm-started from
+        self.snapshots: Optional[Any] = None
+
+    def __contains__(self, user_id: int) -> bool:
+        return user_id in self.sessions
+
+    def __len__(self) -> int:
+        return len(self.sessions)
+
+    def items(self) -> Iterator[Tuple[int, UserSession]]:
+        return iter(list(self.sessions.items()))
+
+    def get(self, user_id: int, touch: bool = True) -> UserSession:
+        """Return the user's session, creating it on first access
+
+        Background work passes touch=False so it does not keep the session alive.
+        """
+        session = self.sessions.get(user_id)
+        if session is None:
+            self.logger.debug(f"Creating new session for user {user_id}")
+            session = self.sessions[user_id] = self.factory(user_id)
+            if self.snapshots:
+                self.snapshots.restore(session)
+        if touch:
+            session.touch()
+        return session
+
+    def peek(self, user_id: int) -> Optional[UserSession]:
+        return self.sessions.get(user_id)
+
+    def reset(self, user_id: int) -> UserSession:
+        """Replace the user's session with a fresh one"""
+        self.sessions.pop(user_id, None)
+        return self.get(user_id)
+
+    def evict(self, user_id: int) -> bool:
+        session = self.sessions.pop(user_id, None)
+        if session:
+            self.logger.info(f"Evicted session for user {user_id}")
+        return session is not None
+
+    def invalidate(self, user_id: int, scope: str = "session") -> None:
+        """Drop cached state for a user in this process
+
+        scope "session" drops the graph and everything attached to it;
+        scope "tasks" keeps the conversation but forces a full task resync.
+        Either way the user's snapshot is stale and is deleted.
+        """
+        if self.snapshots:
+            self.snapshots.delete(user_id)
+        if scope == "tasks":
+            session = self.sessions.get(user_id)
+            if session:
+                session.todoist_client.sync_token = "*"
+                self.logger.debug(f"Reset task sync state for user {user_id}")
+            return
+        self.evict(user_id)
+
+    async def broadcast_invalidation(self, user_id: int, scope: str = "session") -> None:
+        """Invalidate locally and notify other processes, if clustered"""
+        self.invalidate(user_id, scope)
+        if self.publisher:
+            await self.publisher(user_id, scope)
@@ -0,0 +1,169 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+from langchain_core.messages import messages_from_dict, messages_to_dict
+from langgraph.checkpoint.serde.jsonplus import JsonPlusSerializer
+from pydantic import TypeAdapter
+from ..models import Label, Project, Section, SimpleTask
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_MAGIC = b"FCSNAP1\n"
+TASK_LIST = TypeAdapter(List[SimpleTask])
+
+
+class SnapshotStore:
+    """Per-user warm-start snapshots of the task mirror and recent conversation.
+
+    A snapshot holds the Todoist sync token, metadata cache, task mirror and
+    the last few conversation messages as msgpack-encoded plain data, one
+    file per user. Restoring one replaces the first full sync and empty
+    conversation after a restart with a delta sync from the saved token.
+    """
+
+    def __init__(self, base_dir: Optional[str] = None, interval: Optional[float] = None,
+                 max_messages: Optional[int] = None):
+        self.logger = logger.getChild('SnapshotStore')
+        self.base_dir = Path(base_dir or os.getenv("SNAPSHOT_DIR", "data/snapshots"))
+        self.interval = interval or float(os.getenv("SNAPSHOT_INTERVAL", "300"))
+        self.max_messages = max_messages or int(os.getenv("SNAPSHOT_MESSAGES", "20"))
+        self.serde = JsonPlusSerializer()
+        # When each user's session was last written, to skip idle sessions
+        self.saved_at: Dict[int, float] = {}
+
+    def path(self, user_id: int) -> Path:
+        return self.base_dir / f"{user_id}.snap"
+
+    def collect(self, session: Any) -> Dict[str, Any]:
+        """Copy a session's task mirror and recent conversation into plain data.
+
+        Reads live session state, so it runs on the event loop; the result
+        can be serialized and written from another thread.
+        """
+        from ..nodes.chat import split_scratchpad, trim_history
+
+        client = session.todoist_client
+        metadata = client.metadata
+        values = session.graph.get_state({"configurable": {"thread_id": str(session.user_id)}}).values
+        # Only completed turns: drop an unfinished tool exchange at the end
+        msgs, _ = split_scratchpad(values.get("msgs", []))
+        return {
+            "user_id": session.user_id,
+            "saved_at": time.time(),
+            "sync_token": client.sync_token,
+            "timezone": metadata.timezone,
+            "projects": [project.model_dump() for project in metadata.projects.values()],
+            "sections": [section.model_dump() for section in metadata.sections.values()],
+            "labels": [label.model_dump() for label in metadata.labels.values()],
+            "tasks": [task.model_dump(mode="json") for task in client.store.tasks.values()],
+            "msgs": messages_to_dict(trim_history(msgs, self.max_messages)),
+            "insights": values.get("insights"),
+        }
+
+    def encode(self, session: Any) -> bytes:
+        """Serialize a session's task mirror and recent conversation"""
+        return self._serialize(self.collect(session))
+
+    def _serialize(self, data: Dict[str, Any]) -> bytes:
+        _, payload = self.serde.dumps_typed(data)
+        return SNAPSHOT_MAGIC + payload
+
+    def decode(self, raw: bytes) -> Dict[str, Any]:
+        if not raw.startswith(SNAPSHOT_MAGIC):
+            raise ValueError("Not a session snapshot")
+        return self.serde.loads_typed(("msgpack", raw[len(SNAPSHOT_MAGIC):]))
+
+    def _write(self, data: Dict[str, Any]) -> None:
+        """Atomically write collected snapshot data; safe to run in a thread"""
+        path = self.path(data["user_id"])
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Unique per writer, as a periodic pass and a backfill may save a user at once
+        tmp_path = path.with_name(f"{path.name}.{threading.get_ident()}.tmp")
+        tmp_path.write_bytes(self._serialize(data))
+        os.replace(tmp_path, path)
+        # As of collection: a session used during the write is saved again next pass
+        self.saved_at[data["user_id"]] = data["saved_at"]
+
+    def save(self, session: Any) -> None:
+        """Write a session's snapshot, blocking the caller"""
+        self._write(self.collect(session))
+
+    async def asave(self, session: Any) -> None:
+        """Write a session's snapshot with serialization and file I/O off the event loop"""
+        await asyncio.to_thread(self._write, self.collect(session))
+
+    def restore(self, session: Any) -> bool:
+        """Load a user's snapshot into a fresh session, if one exists"""
+        path = self.path(session.user_id)
+        try:
+            raw = path.read_bytes()
+        except FileNotFoundError:
+            return False
+
+        started = time.perf_counter()
+        try:
+            data = self.decode(raw)
+            client = session.todoist_client
+            metadata = client.metadata
+            metadata.projects = {item["id"]: Project(**item) for item in data["projects"]}
+            metadata.sections = {item["id"]: Section(**item) for item in data["sections"]}
+            metadata.labels = {item["id"]: Label(**item) for item in data["labels"]}
+            metadata.labels_by_name = {label.name: label for label in metadata.labels.values()}
+            metadata.timezone = data["timezone"]
+            metadata.loaded = True
+
+            tasks = TASK_LIST.validate_python(data["tasks"])
+            client.store.timezone = data["timezone"]
+            client.store.apply(tasks)
+            client.sync_token = data["sync_token"]
+
+            values: Dict[str, Any] = {"msgs": messages_from_dict(data["msgs"]), "tasks": tasks}
+            if data.get("insights"):
+                values["insights"] = data["insights"]
+            session.graph.update_state(
+                {"configurable": {"thread_id": str(session.user_id)}}, values, as_node="chat_node"
+            )
+        except Exception:
+            self.logger.error(
+                "Failed to restore snapshot, starting cold",
+                exc_info=True,
+                extra={"user_id": session.user_id, "path": str(path)}
+            )
+            # A half-restored client could sync deltas onto a partial mirror
+            session.todoist_client.sync_token = "*"
+            return False
+
+        self.saved_at[session.user_id] = time.time()
+        self.logger.info(
+            f"Restored snapshot for user {session.user_id}: {len(tasks)} tasks, "
+            f"{len(data['msgs'])} messages in {(time.perf_counter() - started) * 1000:.1f}ms"
+        )
+        return True
+
+    def delete(self, user_id: int) -> None:
+        self.path(user_id).unlink(missing_ok=True)
+        self.saved_at.pop(user_id, None)
+
+    async def save_active(self, sessions: Any) -> int:
+        """Snapshot every session used since its last snapshot"""
+        saved = 0
+        for user_id, session in sessions.items():
+            if session.last_seen <= self.saved_at.get(user_id, 0.0):
+                continue
+            try:
+                await self.asave(session)
+                saved += 1
+            except Exception:
+                self.logger.error("Failed to write snapshot", exc_info=True, extra={"user_id": user_id})
+        if saved:
+            self.logger.debug(f"Wrote {saved} session snapshots")
+        return saved
+
+    async def run(self, sessions: Any) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.save_active(sessions)
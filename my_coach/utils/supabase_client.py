@@ -3,7 +3,8 @@ from supabase.client import create_client, Client
 from dotenv import load_dotenv
 import logging
 from .logging_setup import setup_logging
-from typing import Optional, Dict, Any
+from .write_behind import UserWriteBuffer
+from typing import Optional, Dict, Any, List
 
 # Initialize logging
 setup_logging()
@@ -23,6 +24,8 @@ class SupabaseClient:
             )
 
         self.client: Client = create_client(self.url, self.key)
+        # User rows are written behind and flushed in bulk
+        self.user_writes = UserWriteBuffer(self)
         logger.info("Supabase client initialized")
 
     async def get_user(self, telegram_id: int) -> Optional[Dict[str, Any]]:
@@ -35,7 +38,12 @@ class SupabaseClient:
         """
         try:
             response = self.client.table('users').select("*").eq('id', telegram_id).execute()
-            return response.data[0] if response.data else None
+            user = response.data[0] if response.data else None
+            # Overlay writes that have not been flushed yet
+            pending = self.user_writes.pending_fields(telegram_id)
+            if pending:
+                user = {**(user or {"id": telegram_id}), **pending}
+            return user
         except Exception as e:
             logger.error(f"Error getting user {telegram_id}", exc_info=True)
             raise
@@ -47,16 +55,12 @@ class SupabaseClient:
             telegram_id: Unique identifier for Telegram user
             first_name: User's first name from Telegram
         Returns:
-            Dict[str, Any]: Created user data
+            Dict[str, Any]: User data as it will be written
         """
         try:
-            data = {
-                'id': telegram_id,
-                'first_name': first_name
-            }
-            response = self.client.table('users').insert(data).execute()
-            logger.info(f"Created new user: {telegram_id}")
-            return response.data[0]
+            self.user_writes.write(telegram_id, first_name=first_name)
+            logger.info(f"Queued new user: {telegram_id}")
+            return {'id': telegram_id, **self.user_writes.pending_fields(telegram_id)}
         except Exception as e:
             logger.error(f"Error creating user {telegram_id}", exc_info=True)
             raise
@@ -68,12 +72,105 @@ class SupabaseClient:
             telegram_id: Unique identifier for Telegram user
             **kwargs: Fields to update (e.g., first_name, last_name, age, occupation)
         Returns:
-            Dict[str, Any]: Updated user data
+            Dict[str, Any]: Fields pending for the user, including this update
         """
         try:
-            response = self.client.table('users').update(kwargs).eq('telegram_id', telegram_id).execute()
-            logger.info(f"Updated user {telegram_id}: {kwargs}")
-            return response.data[0]
+            self.user_writes.write(telegram_id, **kwargs)
+            logger.info(f"Queued update for user {telegram_id}: {kwargs}")
+            return {'id': telegram_id, **self.user_writes.pending_fields(telegram_id)}
         except Exception as e:
             logger.error(f"Error updating user {telegram_id}", exc_info=True)
             raise
+
+    async def upsert_users(self, rows: List[Dict[str, Any]]) -> None:
+        """
+        Insert or update user rows in one request
+        Args:
+            rows: User rows keyed by id, all with the same columns
+        """
+        if not rows:
+            return
+        try:
+            self.client.table('users').upsert(rows, on_conflict='id').execute()
+            logger.debug(f"Upserted {len(rows)} user rows")
+        except Exception as e:
+            logger.error(f"Error upserting {len(rows)} user rows", exc_info=True)
+            raise
+
+    async def get_usage(self, user_id: str, day: str) -> Optional[Dict[str, Any]]:
+        """
+        Get a user's LLM usage totals for one day
+        Args:
+            user_id: Telegram user ID as used for the agent thread
+            day: UTC day in YYYY-MM-DD format
+        Returns:
+            Optional[Dict[str, Any]]: Usage row or None if not found
+        """
+        try:
+            response = (
+                self.client.table('usage_daily').select("*")
+                .eq('user_id', user_id).eq('day', day).execute()
+            )
+            return response.data[0] if response.data else None
+        except Exception as e:
+            logger.error(f"Error getting usage for user {user_id}", exc_info=True)
+            raise
+
+    async def upsert_usage(self, rows: List[Dict[str, Any]]) -> None:
+        """
+        Insert or overwrite daily usage totals in one request
+        Args:
+            rows: Usage rows keyed by user_id and day
+        """
+        if not rows:
+            return
+        try:
+            self.client.table('usage_daily').upsert(rows, on_conflict='user_id,day').execute()
+            logger.debug(f"Upserted {len(rows)} usage rows")
+        except Exception as e:
+            logger.error(f"Error upserting {len(rows)} usage rows", exc_info=True)
+            raise
+
+    async def list_user_ids(self, after: int = 0, limit: int = 100) -> List[int]:
+        """
+        Get one page of user ids in ascending order
+        Args:
+            after: Only ids greater than this, the last id of the previous page
+            limit: Page size
+        Returns:
+            List[int]: User ids
+        """
+        try:
+            response = (
+                self.client.table('users').select("id")
+                .gt('id', after).order('id').limit(limit).execute()
+            )
+            return [row['id'] for row in response.data or []]
+        except Exception as e:
+            logger.error(f"Error listing users after {after}", exc_info=True)
+            raise
+
+    async def list_user_preferences(self, page_size: int = 1000) -> List[Dict[str, Any]]:
+        """
+        Get the notification preferences of every user with daily summaries enabled
+        Args:
+            page_size: Rows fetched per request
+        Returns:
+            List[Dict[str, Any]]: Preference rows
+        """
+        try:
+            rows: List[Dict[str, Any]] = []
+            while True:
+                response = (
+                    self.client.table('user_preferences').select("*")
+                    .eq('daily_summary_enabled', True)
+                    .order('user_id')
+                    .range(len(rows), len(rows) + page_size - 1)
+                    .execute()
+                )
+                rows.extend(response.data or [])
+                if len(response.data or []) < page_size:
+                    return rows
+        except Exception as e:
+            logger.error("Error listing user preferences", exc_info=True)
+            raise
@@ -0,0 +1,76 @@
+import logging
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Optional
+from ..models import SimpleTask
+from .due_index import DueIndex
+from .search_index import TaskSearchIndex
+from .task_tree import Rollup, TaskTree
+
+logger = logging.getLogger(__name__)
+
+
+class TaskStore:
+    """Per-account mirror of Todoist tasks with derived indexes.
+
+    Fed with the deltas of every sync so indexes are maintained incrementally
+    rather than rebuilt from the full task list on each turn.
+    """
+
+    def __init__(self):
+        self.logger = logger.getChild('TaskStore')
+        self.tasks: Dict[str, SimpleTask] = {}
+        self.due_index = DueIndex()
+        self.search_index = TaskSearchIndex()
+        self.tree = TaskTree()
+        self.timezone: Optional[str] = None
+
+    def __len__(self) -> int:
+        return len(self.tasks)
+
+    def clear(self) -> None:
+        self.tasks.clear()
+        self.due_index.clear()
+        self.search_index.clear()
+        self.tree.clear()
+
+    def apply(self, tasks: Iterable[SimpleTask], deleted_ids: Iterable[str] = ()) -> None:
+        """Apply a batch of changed tasks and deleted task ids"""
+        for task in tasks:
+            self.tasks[task.id] = task
+            self.due_index.upsert(task)
+            self.search_index.upsert(task)
+            self.tree.upsert(task)
+        for task_id in deleted_ids:
+            self.tasks.pop(task_id, None)
+            self.due_index.remove(task_id)
+            self.search_index.remove(task_id)
+            self.tree.remove(task_id)
+
+    def get_many(self, task_ids: Iterable[str]) -> List[SimpleTask]:
+        return [self.tasks[task_id] for task_id in task_ids if task_id in self.tasks]
+
+    def overdue(self, now: Optional[datetime] = None) -> List[SimpleTask]:
+        return self.get_many(self.due_index.overdue(now or datetime.now(timezone.utc)))
+
+    def due_today(self, now: Optional[datetime] = None) -> List[SimpleTask]:
+        return self.get_many(
+            self.due_index.due_today(now or datetime.now(timezone.utc), self.timezone)
+        )
+
+    def due_within(self, days: int, now: Optional[datetime] = None) -> List[SimpleTask]:
+        return self.get_many(
+            self.due_index.due_within(now or datetime.now(timezone.utc), self.timezone, days)
+        )
+
+    def search(self, query: str, limit: int = 10) -> List[SimpleTask]:
+        """Open tasks matching the query by content, description or labels"""
+        return self.get_many(task_id for task_id, _ in self.search_index.search(query, limit))
+
+    def recurring(self) -> List[SimpleTask]:
+        return self.get_many(self.due_index.recurring)
+
+    def subtasks(self, task_id: str) -> List[SimpleTask]:
+        return self.get_many(self.tree.subtasks(task_id))
+
+    def rollup(self, task_id: str) -> Optional[Rollup]:
+        return self.tree.rollup(task_id)
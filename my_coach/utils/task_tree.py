@@ -0,0 +1,135 @@
+from collections import defaultdict
+from typing import Dict, List, Optional, Set, Tuple
+from ..models import SimpleTask
+
+
+class Rollup:
+    """Progress of all subtasks below one parent task"""
+
+    __slots__ = ("total", "completed", "next_due", "next_due_id", "top_priority")
+
+    def __init__(self, total: int = 0, completed: int = 0, next_due: Optional[float] = None,
+                 next_due_id: Optional[str] = None, top_priority: int = 0):
+        self.total = total
+        self.completed = completed
+        # Earliest deadline (epoch) among open subtasks and the subtask it belongs to
+        self.next_due = next_due
+        self.next_due_id = next_due_id
+        # Highest Todoist API priority among open subtasks (4 is most urgent)
+        self.top_priority = top_priority
+
+
+class TaskTree:
+    """Parent/child index of tasks with per-parent subtask rollups.
+
+    Updated per task as deltas arrive. A change only drops the cached
+    rollups of the task's ancestors; rollups are recomputed on demand from
+    the children's cached rollups, so a delta costs the depth of the tree
+    rather than a rebuild. Open and completed counts per project are kept
+    alongside for project-level summaries.
+    """
+
+    def __init__(self):
+        self.parents: Dict[str, Optional[str]] = {}
+        # Parent id -> {child id: child_order}
+        self.children: Dict[str, Dict[str, int]] = defaultdict(dict)
+        # Task id -> (completed, deadline epoch, priority, project id)
+        self._nodes: Dict[str, Tuple[bool, Optional[float], int, Optional[str]]] = {}
+        self._rollups: Dict[str, Rollup] = {}
+        # Project id -> [open, completed]
+        self.projects: Dict[str, List[int]] = defaultdict(lambda: [0, 0])
+
+    def __len__(self) -> int:
+        return len(self._nodes)
+
+    def clear(self) -> None:
+        self.parents.clear()
+        self.children.clear()
+        self._nodes.clear()
+        self._rollups.clear()
+        self.projects.clear()
+
+    def upsert(self, task: SimpleTask) -> None:
+        self.remove(task.id)
+        deadline = task.due_at.timestamp() if task.due_at else None
+        self._nodes[task.id] = (task.is_completed, deadline, task.priority, task.project_id)
+        self.parents[task.id] = task.parent_id
+        if task.parent_id:
+            self.children[task.parent_id][task.id] = task.child_order
+            self._invalidate(task.parent_id)
+        if task.project_id:
+            self.projects[task.project_id][1 if task.is_completed else 0] += 1
+
+    def remove(self, task_id: str) -> None:
+        """Drop a task; its own subtasks stay attached to its id"""
+        node = self._nodes.pop(task_id, None)
+        if node is None:
+            return
+        parent = self.parents.pop(task_id, None)
+        if parent:
+            siblings = self.children.get(parent)
+            if siblings is not None:
+                siblings.pop(task_id, None)
+                if not siblings:
+                    del self.children[parent]
+            self._invalidate(parent)
+        completed, _, _, project_id = node
+        if project_id and project_id in self.projects:
+            counts = self.projects[project_id]
+            counts[1 if completed else 0] -= 1
+            if not any(counts):
+                del self.projects[project_id]
+
+    def _invalidate(self, task_id: Optional[str]) -> None:
+        """Drop cached rollups of a task and its ancestors"""
+        seen: Set[str] = set()
+        while task_id and task_id not in seen:
+            seen.add(task_id)
+            self._rollups.pop(task_id, None)
+            task_id = self.parents.get(task_id)
+
+    @property
+    def has_subtasks(self) -> bool:
+        return bool(self.children)
+
+    def is_subtask(self, task_id: str) -> bool:
+        """Whether the task's parent is itself in the index"""
+        parent = self.parents.get(task_id)
+        return parent is not None and parent in self._nodes
+
+    def subtasks(self, task_id: str) -> List[str]:
+        """Ids of the direct subtasks of a task, in Todoist order"""
+        children = self.children.get(task_id, {})
+        return sorted(children, key=lambda child_id: (children[child_id], child_id))
+
+    def rollup(self, task_id: str) -> Optional[Rollup]:
+        """Progress of every subtask below a task, or None if it has none"""
+        if task_id not in self.children:
+            return None
+        cached = self._rollups.get(task_id)
+        if cached is not None:
+            return cached
+
+        rollup = Rollup()
+        for child_id in self.children[task_id]:
+            node = self._nodes.get(child_id)
+            if node is None:
+                continue
+            completed, deadline, priority, _ = node
+            rollup.total += 1
+            if completed:
+                rollup.completed += 1
+            else:
+                rollup.top_priority = max(rollup.top_priority, priority)
+                if deadline is not None and (rollup.next_due is None or deadline < rollup.next_due):
+                    rollup.next_due, rollup.next_due_id = deadline, child_id
+            below = self.rollup(child_id)
+            if below is not None:
+                rollup.total += below.total
+                rollup.completed += below.completed
+                rollup.top_priority = max(rollup.top_priority, below.top_priority)
+                if below.next_due is not None and (rollup.next_due is None or below.next_due < rollup.next_due):
+                    rollup.next_due, rollup.next_due_id = below.next_due, below.next_due_id
+
+        self._rollups[task_id] = rollup
+        return rollup
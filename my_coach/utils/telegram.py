@@ -1,21 +1,36 @@
 import asyncio
+import html
 import logging
-from typing import Dict, Any
+from typing import Optional
 from aiogram import Bot, Dispatcher
 from aiogram.enums import ParseMode
-from aiogram.filters import CommandStart
+from aiogram.filters import Command, CommandObject, CommandStart
 from aiogram.types import Message, User
 from aiogram.utils.markdown import hbold
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.fsm.storage.redis import RedisStorage
 import os
 from dotenv import load_dotenv
 from aiogram.client.default import DefaultBotProperties
 from .agent_handler import handle_agent_interaction
-from ..agent import create_agent
 from .logging_setup import setup_logging
 from .supabase_client import SupabaseClient
+from .outbound import OutboundSender
+from .sessions import SessionRegistry
+from .snapshots import SnapshotStore
+from .profiling import profiler
+from .update_ledger import GENERATED, UpdateLedger
+from .telegram_html import to_telegram_html
+from .cluster import ClusterCoordinator
+from .usage import usage_tracker
+from .long_term_memory import SupabaseMemoryIndex, memory_manager
+from .briefings import briefing_service
+from .prefetch import task_prefetcher
+from .backfill import FULL, DELTA, BackfillProgress, BackfillRunner, new_job_id
+from . import runtime
+from .diagnostics import AllocationTracer, SessionReaper, format_report, memory_report
 
 # Initialize logging
 logger = setup_logging("my_coach")
@@ -24,6 +39,12 @@ logger.info("Starting Telegram bot application")
 # Load environment variables
 load_dotenv()
 TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
+REDIS_URL = os.getenv("REDIS_URL")
+# standalone: poll and handle in one process; ingress: poll and route updates
+# to worker shards; worker: handle the updates routed to WORKER_ID
+BOT_ROLE = os.getenv("BOT_ROLE", "standalone")
+# Telegram user ids allowed to use admin commands such as /diag
+ADMIN_USER_IDS = {int(user_id) for user_id in os.getenv("ADMIN_USER_IDS", "").split(",") if user_id.strip()}
 
 if not TOKEN:
     logger.critical("TELEGRAM_BOT_TOKEN not found in environment variables")
@@ -39,15 +60,80 @@ class UserStates(StatesGroup):
 logger.info("Initializing bot components")
 try:
     bot = Bot(token=TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
-    dp = Dispatcher(storage=MemoryStorage())
+    # FSM state must be shared once users can be served by several processes
+    storage = RedisStorage.from_url(REDIS_URL) if REDIS_URL else MemoryStorage()
+    dp = Dispatcher(storage=storage)
     supabase = SupabaseClient()
+    outbound = OutboundSender(bot)
+    ledger = UpdateLedger()
+    # Replies restored from the outbound backlog complete their update
+    outbound.on_delivered = ledger.delivered
+    cluster: Optional[ClusterCoordinator] = (
+        ClusterCoordinator(REDIS_URL) if REDIS_URL and BOT_ROLE != "standalone" else None
+    )
     logger.info("Bot and dispatcher successfully initialized")
 except Exception as e:
     logger.critical("Failed to initialize bot components", exc_info=True)
     raise
 
-# Store user-specific graphs
-user_graphs: Dict[int, Any] = {}
+# Store user-specific graphs and Todoist clients
+sessions = SessionRegistry()
+sessions.snapshots = SnapshotStore()
+background_tasks = set()
+reaper = SessionReaper(sessions)
+backfill = BackfillRunner(sessions, supabase.list_user_ids)
+tracer = AllocationTracer()
+
+if cluster:
+    sessions.publisher = cluster.publish_invalidation
+
+
+@dp.startup()
+async def on_startup() -> None:
+    """Start the outbound delivery loop, replaying any persisted backlog"""
+    await outbound.start()
+    await usage_tracker.start(supabase)
+    await supabase.user_writes.start()
+    if os.getenv("MEMORY_BACKEND", "local") == "supabase":
+        memory_manager.index_factory = lambda user_id: SupabaseMemoryIndex(user_id, supabase)
+    task = asyncio.create_task(reaper.run())
+    background_tasks.add(task)
+    task = asyncio.create_task(sessions.snapshots.run(sessions))
+    background_tasks.add(task)
+    if briefing_service.enabled:
+        if cluster:
+            briefing_service.owns = lambda user_id: cluster.owner(user_id) == cluster.worker_id
+        task = asyncio.create_task(briefing_service.run(supabase.list_user_preferences, sessions))
+        background_tasks.add(task)
+    if task_prefetcher.enabled:
+        if cluster:
+            task_prefetcher.owns = lambda user_id: cluster.owner(user_id) == cluster.worker_id
+        task = asyncio.create_task(task_prefetcher.run(supabase.list_user_preferences, sessions))
+        background_tasks.add(task)
+    if cluster:
+        # Re-syncs are started on every worker, each syncing the users it owns
+        backfill.owns = lambda user_id: cluster.owner(user_id) == cluster.worker_id
+        backfill.on_progress = report_resync
+        cluster.command_handlers["resync"] = run_resync
+        task = asyncio.create_task(cluster.listen_invalidations(sessions.invalidate))
+        background_tasks.add(task)
+
+
+@dp.shutdown()
+async def on_shutdown() -> None:
+    """Drain queued outbound messages and pending writes before exiting"""
+    await outbound.stop()
+    # An interrupted re-sync is resumed with /resync resume
+    await backfill.stop()
+    backfill.close()
+    await sessions.snapshots.save_active(sessions)
+    await memory_manager.drain()
+    await usage_tracker.stop()
+    await supabase.user_writes.stop()
+    ledger.close()
+    briefing_service.close()
+    task_prefetcher.close()
+
 
 @dp.message(CommandStart())
 async def command_start(message: Message, state: FSMContext) -> None:
@@ -83,6 +169,126 @@ async def command_start(message: Message, state: FSMContext) -> None:
             "Sorry, there was an error initializing your session. Please try again later."
         )
 
+@dp.message(Command("diag"))
+async def command_diag(message: Message, command: CommandObject) -> None:
+    """Admin-only diagnostics: /diag [trace start|stop|diff] [reap] [profile <user_id>]"""
+    if not message.from_user or message.from_user.id not in ADMIN_USER_IDS:
+        return
+
+    args = (command.args or "").split()
+    try:
+        if args[:2] == ["trace", "start"]:
+            tracer.start()
+            text = "Allocation tracing started, baseline snapshot taken"
+        elif args[:2] == ["trace", "stop"]:
+            tracer.stop()
+            text = "Allocation tracing stopped"
+        elif args[:1] == ["trace"]:
+            text = "ALLOCATION GROWTH SINCE LAST SNAPSHOT\n" + "\n".join(tracer.diff())
+        elif args[:1] == ["profile"] and len(args) == 2:
+            enabled = profiler.toggle_user(args[1])
+            text = f"Profiling for user {args[1]} {'enabled' if enabled else 'disabled'}"
+        elif args[:1] == ["reap"]:
+            text = f"Reaped {await reaper.reap()} idle sessions"
+        else:
+            text = format_report(memory_report(sessions, storage))
+        # Stay under Telegram's 4096 character message limit
+        await message.answer(f"<pre>{html.escape(text[:4000])}</pre>")
+    except Exception as e:
+        logger.error("Failed to run diagnostics", exc_info=True, extra={"args": args})
+        await message.answer("Diagnostics failed, see logs.")
+
+async def report_resync(progress: BackfillProgress, running: bool) -> None:
+    """Share this worker's re-sync progress for /resync status on any worker"""
+    await cluster.report_resync(progress.job_id, {
+        "progress": progress.model_dump(),
+        "running": running,
+        "failures": backfill.failures(progress.job_id),
+    })
+
+
+async def run_resync(action: str, mode: str = DELTA, job_id: Optional[str] = None) -> None:
+    """Run this worker's share of a re-sync command broadcast by another worker"""
+    try:
+        if action == "stop":
+            await backfill.stop()
+        else:
+            backfill.start(mode, resume=action == "resume", job_id=job_id)
+    except (RuntimeError, ValueError) as e:
+        logger.info(f"Skipping re-sync {action}: {e}")
+
+
+async def resync_status() -> str:
+    if not cluster:
+        progress = backfill.latest()
+        if not progress:
+            return "No re-sync has run yet"
+        failures = backfill.failures(progress.job_id) if progress.failed else []
+        text = progress.describe(backfill.running)
+    else:
+        reports = await cluster.resync_reports()
+        if not reports:
+            return "No re-sync has run yet"
+        parts = {worker: BackfillProgress.model_validate(report["progress"]) for worker, report in reports.items()}
+        running = {worker for worker, report in reports.items() if report["running"]}
+        text = BackfillProgress.combine(list(parts.values())).describe(bool(running))
+        missing = [worker for worker in cluster.ring.nodes if worker not in reports]
+        text += f"\n{len(reports)}/{len(cluster.ring.nodes)} workers reported"
+        if missing:
+            text += f", missing: {', '.join(missing)}"
+        for worker, progress in sorted(parts.items()):
+            state = "running" if worker in running else "finished" if progress.finished_at else "stopped"
+            text += f"\n{worker}: {progress.synced} synced, {progress.failed} failed, {state}"
+        failures = [tuple(failure) for report in reports.values() for failure in report["failures"]]
+    if failures:
+        text += "\nFailed users:\n" + "\n".join(f"{user_id}: {error}" for user_id, error in failures)
+    return text
+
+
+@dp.message(Command("resync"))
+async def command_resync(message: Message, command: CommandObject) -> None:
+    """Admin-only bulk Todoist re-sync: /resync [full] | status | stop | resume
+
+    In a cluster, start, stop and resume are broadcast so every worker runs
+    the share of users it owns, and status combines their progress.
+    """
+    if not message.from_user or message.from_user.id not in ADMIN_USER_IDS:
+        return
+
+    args = (command.args or "").split()
+    scope = " on all workers" if cluster else ""
+    try:
+        if args[:1] == ["status"]:
+            text = await resync_status()
+        elif args[:1] == ["stop"]:
+            stopped = await backfill.stop()
+            if cluster:
+                await cluster.publish_command("resync", action="stop")
+            text = f"Re-sync stopped{scope}, /resync resume continues it" if stopped or cluster else "No re-sync running"
+        elif args[:1] == ["resume"]:
+            if cluster:
+                # Workers whose share is unfinished resume it, even if this one's is done
+                await cluster.publish_command("resync", action="resume")
+            try:
+                progress = backfill.start(resume=True)
+                text = f"Resuming re-sync {progress.job_id} ({progress.mode}) after user {progress.cursor}{scope}"
+            except ValueError:
+                if not cluster:
+                    raise
+                text = "Resuming unfinished re-sync shares on the other workers"
+        else:
+            mode = FULL if args[:1] == ["full"] else DELTA
+            progress = backfill.start(mode, job_id=new_job_id())
+            if cluster:
+                await cluster.publish_command("resync", action="start", mode=mode, job_id=progress.job_id)
+            text = f"Started re-sync {progress.job_id} ({progress.mode}){scope}, /resync status for progress"
+        await message.answer(f"<pre>{html.escape(text[:4000])}</pre>")
+    except (RuntimeError, ValueError) as e:
+        await message.answer(html.escape(str(e)))
+    except Exception as e:
+        logger.error("Failed to run re-sync command", exc_info=True, extra={"args": args})
+        await message.answer("Re-sync command failed, see logs.")
+
 @dp.message(UserStates.waiting_first_name)
 async def process_first_name(message: Message, state: FSMContext) -> None:
     """Handle first name collection"""
@@ -119,8 +325,9 @@ async def initialize_user_session(
             first_name=first_name
         )
     
-    # Initialize chat
-    user_graphs[user_id] = create_agent()
+    # Initialize chat, dropping stale copies of the session in any process
+    await sessions.broadcast_invalidation(user_id)
+    sessions.get(user_id)
     await state.set_state(UserStates.chatting)
     
     welcome_msg = (
@@ -134,6 +341,11 @@ async def initialize_user_session(
     await message.answer(welcome_msg)
     logger.info(f"Successfully initialized session for user {user_id}")
 
+async def send_reply(chat_id: int, content: str, update_key: Optional[str] = None) -> None:
+    """Send a model reply as Telegram HTML, split to fit the message limit"""
+    for part in to_telegram_html(content):
+        await outbound.send_message(chat_id, part, update_key=update_key)
+
 @dp.message(UserStates.chatting)
 async def handle_message(message: Message, state: FSMContext) -> None:
     """Handle chat messages"""
@@ -146,29 +358,54 @@ async def handle_message(message: Message, state: FSMContext) -> None:
     logger.info(f"Processing message from user {user_id}")
     logger.debug(f"Message preview: {message_preview}")
 
+    # Redelivered updates must not rerun the graph or duplicate the reply
+    update_key = ledger.message_key(message.chat.id, message.message_id)
+    entry = ledger.begin(update_key)
+    if entry:
+        if entry.state == GENERATED and outbound.has_pending(update_key):
+            # Restored from the outbound backlog; it marks the update delivered when sent
+            logger.info(f"Reply to update {update_key} is already queued, not replaying")
+        elif entry.state == GENERATED and entry.response is not None:
+            logger.info(f"Replaying undelivered response for update {update_key}")
+            await send_reply(message.chat.id, entry.response, update_key)
+            ledger.delivered(update_key)
+        else:
+            logger.info(f"Skipping duplicate update {update_key} ({entry.state})")
+        return
+
     try:
-        if user_id not in user_graphs:
-            logger.debug(f"Creating new agent for user {user_id}")
-            user_graphs[user_id] = create_agent()
+        if task_prefetcher.enabled:
+            task_prefetcher.record(user_id, cold=user_id not in sessions)
+        session = sessions.get(user_id)
 
         async def send_message(content: str):
-            await message.answer(content)
+            ledger.generated(update_key, content)
+            await send_reply(message.chat.id, content, update_key)
+            ledger.delivered(update_key)
             logger.debug(f"Sent response to user {user_id}")
 
+        async def send_error(content: str):
+            # Not a reply: a redelivery retries the message, or replays the
+            # reply if it was generated and only its delivery failed
+            ledger.release(update_key)
+            await send_reply(message.chat.id, content)
+
         async def show_typing():
-            await bot.send_chat_action(chat_id=message.chat.id, action="typing")
+            await outbound.send_chat_action(message.chat.id, "typing")
             logger.debug(f"Showing typing indicator to user {user_id}")
 
         await handle_agent_interaction(
             message_text=message.text or "",
-            graph=user_graphs[user_id],
+            graph=session.graph,
             send_message=send_message,
             show_typing=show_typing,
             user_id=str(user_id),
+            send_error=send_error,
         )
         logger.info(f"Successfully processed message from user {user_id}")
 
     except Exception as e:
+        ledger.release(update_key)
         logger.error(
             f"Failed to process message from user {user_id}",
             exc_info=True,
@@ -178,10 +415,37 @@ async def handle_message(message: Message, state: FSMContext) -> None:
             "Sorry, I encountered an error processing your message. Please try again."
         )
 
+async def run_worker() -> None:
+    """Handle updates routed to this worker's shard"""
+    await dp.emit_startup(bot=bot, dispatcher=dp)
+    try:
+        await cluster.run_worker(dp, bot)
+    finally:
+        await dp.emit_shutdown(bot=bot, dispatcher=dp)
+        await cluster.close()
+
+
+async def run_ingress() -> None:
+    """Poll Telegram and route updates to worker shards"""
+    try:
+        await cluster.run_ingress(bot)
+    finally:
+        await cluster.close()
+
+
 if __name__ == "__main__":
-    logger.info("Starting bot polling")
+    logger.info(f"Starting bot in {BOT_ROLE} mode on {runtime.describe()}")
     try:
-        asyncio.run(dp.start_polling(bot))
+        if BOT_ROLE == "standalone":
+            runtime.run(dp.start_polling(bot))
+        elif not cluster:
+            raise ValueError(f"BOT_ROLE={BOT_ROLE} requires REDIS_URL")
+        elif BOT_ROLE == "ingress":
+            runtime.run(run_ingress())
+        elif BOT_ROLE == "worker":
+            runtime.run(run_worker())
+        else:
+            raise ValueError(f"Unknown BOT_ROLE: {BOT_ROLE}")
     except KeyboardInterrupt:
         logger.info("Shutting down...")
     except Exception as e:
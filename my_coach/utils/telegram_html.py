@@ -0,0 +1,389 @@
+import re
+from typing import List, Optional, Tuple
+
+# Telegram limits a message to 4096 UTF-16 code units
+MESSAGE_LIMIT = 4096
+SPECIAL = re.compile(r"[*_~|`#\n&<>]")
+ESCAPES = {"&": "&amp;", "<": "&lt;", ">": "&gt;"}
+# Each tag is shown at most once at a time, so this bounds the closing tags of a message
+MAX_CLOSERS = len("</b></i></u></s></tg-spoiler></code></pre>")
+# Marker character -> (tag, run lengths that toggle it)
+EMPHASIS = {
+    "*": ("b", (1, 2)),
+    "~": ("s", (1, 2)),
+    "|": ("tg-spoiler", (2,)),
+}
+
+
+def escape(text: str) -> str:
+    if "&" in text:
+        text = text.replace("&", "&amp;")
+    if "<" in text:
+        text = text.replace("<", "&lt;")
+    if ">" in text:
+        text = text.replace(">", "&gt;")
+    return text
+
+
+def utf16_len(text: str) -> int:
+    if text.isascii():
+        return len(text)
+    return len(text.encode("utf-16-le")) // 2
+
+
+class _Open:
+    __slots__ = ("tag", "marker", "shown")
+
+    def __init__(self, tag: str, marker: str, shown: bool = True):
+        self.tag = tag
+        self.marker = marker
+        # False when the same tag is already open through another marker
+        self.shown = shown
+
+
+class TelegramHTMLFormatter:
+    """Streaming converter from the coach's markup to Telegram HTML.
+
+    Understands the markers the system prompt asks for (*bold*, _italic_,
+    __underline__, ~strike~, ||spoiler||, # headers) plus **bold**, `code`
+    and ``` blocks. Everything else is escaped, so model output can never
+    produce tags Telegram rejects. Markers only open before and close after
+    non-space text, underscores inside words stay literal, and emphasis does
+    not run past a blank line; whatever is still open at the end is closed.
+
+    Text can be fed in pieces as tokens arrive. Input whose meaning depends
+    on characters not seen yet (a trailing marker run) is held back until the
+    next piece. Output is split into messages under the length limit, at the
+    last line break when there is one; tags open at a split are closed at the
+    end of one message and reopened at the start of the next.
+    """
+
+    def __init__(self, limit: int = MESSAGE_LIMIT):
+        self.limit = limit
+        self.messages: List[str] = []
+        self._pending = ""
+        self._stack: List[_Open] = []
+        self._code: Optional[str] = None
+        # Text after an opening ``` until the line break, which may be a language name
+        self._language: Optional[str] = None
+        self._prev = "\n"
+        self._line_start = True
+        self._header = False
+        self._out: List[str] = []
+        self._out_len = 0
+        self._visible = False
+        # Last line break in the current message: (pieces, length, open tags, visible)
+        self._break: Optional[Tuple[int, int, List[_Open], bool]] = None
+
+    def feed(self, text: str) -> List[str]:
+        """Consume more model output, returning messages that are complete"""
+        self._pending += text
+        self._scan(final=False)
+        return self._take()
+
+    def finish(self) -> List[str]:
+        """Flush held-back input, close open tags and return the last messages"""
+        self._scan(final=True)
+        if self._code:
+            self._end_code()
+        self._close_all()
+        self._end_message()
+        return self._take()
+
+    def _take(self) -> List[str]:
+        messages, self.messages = self.messages, []
+        return messages
+
+    # Parsing
+
+    def _scan(self, final: bool) -> None:
+        text = self._pending
+        n = len(text)
+        i = 0
+        while i < n:
+            if self._code:
+                i = self._scan_code(text, i, final)
+                if i < 0:
+                    return
+                continue
+
+            match = SPECIAL.search(text, i)
+            end = match.start() if match else n
+            if end > i:
+                self._emit_text(text[i:end])
+                i = end
+                continue
+
+            char = text[i]
+            if char == "\n":
+                self._newline(text, i)
+                i += 1
+                continue
+            if char in ESCAPES:
+                self._emit_text(char)
+                i += 1
+                continue
+
+            j = i
+            while j < n and text[j] == char:
+                j += 1
+            if j == n and not final:
+                break
+            following = text[j] if j < n else ""
+            if char == "#" and self._line_start:
+                if following == " " or (not following and final):
+                    self._open_header(j - i)
+                    i = j + 1 if following == " " else j
+                else:
+                    self._emit_text(text[i:j])
+                    i = j
+                continue
+            self._marker(char, j - i, following, text[i:j])
+            i = j
+        self._pending = text[i:]
+
+    def _scan_code(self, text: str, i: int, final: bool) -> int:
+        """Scan inside code up to its closing backticks; -1 if more input is needed"""
+        fence = self._code
+        close = text.find(fence, i)
+        if close < 0:
+            # Keep back a partial fence at the end of the input
+            keep = 0 if final else min(len(fence) - 1, len(text) - i)
+            while keep and not text.endswith(fence[:keep]):
+                keep -= 1
+            self._emit_code_text(text[i:len(text) - keep])
+            self._pending = text[len(text) - keep:]
+            return -1
+        self._emit_code_text(text[i:close])
+        self._end_code()
+        return close + len(fence)
+
+    def _end_code(self) -> None:
+        if self._language:
+            # No line break after the fence: it was code, not a language
+            language, self._language = self._language, None
+            self._emit_text(language, code=True)
+        self._language = None
+        self._emit_tag("</code>" if self._code == "`" else "</pre>")
+        self._code = None
+        self._prev = "`"
+        self._line_start = False
+
+    def _marker(self, char: str, count: int, following: str, raw: str) -> None:
+        if char == "`":
+            if count == 1 or count >= 3:
+                self._reserve(13 if count == 1 else 11)
+                self._code = "`" if count == 1 else "```"
+                self._emit_tag("<code>" if count == 1 else "<pre>")
+                if count >= 3:
+                    self._language = ""
+            else:
+                self._emit_text(raw)
+            return
+
+        if char == "*" and self._line_start and count == 1 and following == " ":
+            self._emit_text("•")
+            return
+
+        if char == "_":
+            tag = {1: "i", 2: "u"}.get(count)
+        else:
+            tag, counts = EMPHASIS.get(char, (None, ()))
+            if count not in counts:
+                tag = None
+        if tag is None:
+            self._emit_text(raw)
+            return
+
+        marker = char * count
+        open_index = next(
+            (index for index in range(len(self._stack) - 1, -1, -1) if self._stack[index].marker == marker),
+            None,
+        )
+        word_char = char == "_"
+        if open_index is not None and not self._prev.isspace() and not (
+            word_char and following.isalnum()
+        ):
+            self._close(open_index)
+        elif following and not following.isspace() and not (word_char and self._prev.isalnum()):
+            shown = all(entry.tag != tag or not entry.shown for entry in self._stack)
+            if shown:
+                self._reserve(2 * len(tag) + 5)
+            self._stack.append(_Open(tag, marker, shown))
+            if shown:
+                self._emit_tag(f"<{tag}>")
+        else:
+            self._emit_text(raw)
+
+    def _open_header(self, level: int) -> None:
+        self._header = True
+        tags = ("b", "u") if level == 1 else ("b",)
+        self._reserve(sum(2 * len(tag) + 5 for tag in tags))
+        for tag in tags:
+            shown = all(entry.tag != tag or not entry.shown for entry in self._stack)
+            self._stack.append(_Open(tag, "#", shown))
+            if shown:
+                self._emit_tag(f"<{tag}>")
+
+    def _newline(self, text: str, i: int) -> None:
+        if self._header:
+            self._header = False
+            index = next((index for index, entry in enumerate(self._stack) if entry.marker == "#"), None)
+            if index is not None:
+                self._close(index, reopen=lambda entry: entry.marker != "#")
+        elif self._prev == "\n" and self._stack:
+            # Emphasis does not continue into the next paragraph
+            self._close_all()
+        self._emit_text("\n")
+        self._line_start = True
+        self._break = (len(self._out), self._out_len, list(self._stack), self._visible)
+
+    # Tag bookkeeping
+
+    def _close(self, index: int, reopen=lambda entry: True) -> None:
+        """Close the tag at `index`, reopening tags nested inside it"""
+        above = self._stack[index + 1:]
+        self._reserve(sum(2 * len(entry.tag) + 5 for entry in above))
+        for entry in reversed(above):
+            if entry.shown:
+                self._emit_tag(f"</{entry.tag}>")
+        removed = self._stack[index:index + 1]
+        del self._stack[index:]
+        if removed[0].shown:
+            self._emit_tag(f"</{removed[0].tag}>")
+        for entry in above:
+            if not reopen(entry):
+                continue
+            if entry.shown or all(other.tag != entry.tag or not other.shown for other in self._stack):
+                entry = _Open(entry.tag, entry.marker, True)
+                self._emit_tag(f"<{entry.tag}>")
+            self._stack.append(entry)
+
+    def _close_all(self) -> None:
+        if self._stack:
+            self._close(0, reopen=lambda entry: False)
+
+    @staticmethod
+    def _closers(stack: List[_Open]) -> str:
+        return "".join(f"</{entry.tag}>" for entry in reversed(stack) if entry.shown)
+
+    @staticmethod
+    def _openers(stack: List[_Open]) -> str:
+        return "".join(f"<{entry.tag}>" for entry in stack if entry.shown)
+
+    # Output
+
+    def _open_tags(self) -> str:
+        return self._openers(self._stack) + ("<pre>" if self._code == "```" else "<code>" if self._code else "")
+
+    def _close_tags(self) -> str:
+        return ("</pre>" if self._code == "```" else "</code>" if self._code else "") + self._closers(self._stack)
+
+    def _reserve(self, size: int) -> None:
+        """Start a new message unless `size` more units of tags still fit"""
+        if self._visible and self._out_len + size + len(self._close_tags()) > self.limit:
+            self._split_here()
+
+    def _emit_tag(self, tag: str) -> None:
+        self._out.append(tag)
+        self._out_len += len(tag)
+
+    def _emit_code_text(self, raw: str) -> None:
+        if self._language is not None:
+            raw = self._language + raw
+            newline = raw.find("\n")
+            if newline < 0:
+                self._language = raw
+                return
+            self._language = None
+            # A language name after the fence is not shown
+            if raw[:newline].strip() and " " not in raw[:newline].strip():
+                raw = raw[newline + 1:]
+        if raw:
+            self._emit_text(raw, code=True)
+
+    def _emit_text(self, raw: str, code: bool = False) -> None:
+        escaped = escape(raw)
+        size = utf16_len(escaped)
+        # Closing tags never take more than MAX_CLOSERS, so most text skips the exact check
+        while self._out_len + size + MAX_CLOSERS > self.limit and (
+            self._out_len + size + len(self._close_tags()) > self.limit
+        ):
+            room = self.limit - self._out_len - len(self._close_tags())
+            if self._break and self._break[1] > self.limit // 2:
+                self._split_at_break()
+                continue
+            cut = self._fit(raw, room)
+            if cut <= 0:
+                if not self._visible:
+                    # Tags alone exceed the limit; nothing sensible to split
+                    break
+                self._split_here()
+                continue
+            head, raw = raw[:cut], raw[cut:]
+            escaped = escape(head)
+            self._append(escaped, head, utf16_len(escaped))
+            self._split_here()
+            escaped = escape(raw)
+            size = utf16_len(escaped)
+        if not raw:
+            return
+        self._append(escaped, raw, size)
+        if not code:
+            self._prev = raw[-1]
+            if raw != "\n":
+                self._line_start = False
+
+    def _append(self, escaped: str, raw: str, size: int) -> None:
+        self._out.append(escaped)
+        self._out_len += size
+        if not self._visible and not raw.isspace():
+            self._visible = True
+
+    @staticmethod
+    def _fit(raw: str, room: int) -> int:
+        """Longest prefix of `raw` whose escaped form fits in `room`, cut at a space if possible"""
+        cut = min(len(raw), room)
+        # An escaped character takes at most five units, so dropping a fifth
+        # of the excess never cuts more than needed
+        excess = utf16_len(escape(raw[:cut])) - room
+        while cut > 0 and excess > 0:
+            cut -= max(1, excess // 5)
+            excess = utf16_len(escape(raw[:cut])) - room
+        if cut > 0 and cut < len(raw):
+            space = raw.rfind(" ", 0, cut)
+            if space > cut // 2:
+                cut = space + 1
+        return max(cut, 0)
+
+    def _split_here(self) -> None:
+        self._end_message(self._close_tags())
+        self._emit_tag(self._open_tags())
+
+    def _split_at_break(self) -> None:
+        index, _, stack, visible = self._break
+        head, tail = self._out[:index], self._out[index:]
+        if visible:
+            self.messages.append("".join(head) + self._closers(stack))
+        self._out, self._out_len, self._break = [], 0, None
+        self._visible = False
+        self._emit_tag(self._openers(stack))
+        for piece in tail:
+            self._out.append(piece)
+            self._out_len += utf16_len(piece)
+            if not self._visible and not piece.startswith("<") and not piece.isspace():
+                self._visible = True
+
+    def _end_message(self, closers: str = "") -> None:
+        if self._visible:
+            self.messages.append("".join(self._out) + closers)
+        self._out, self._out_len, self._break = [], 0, None
+        self._visible = False
+
+
+def to_telegram_html(text: str, limit: int = MESSAGE_LIMIT) -> List[str]:
+    """Convert a complete model reply to Telegram HTML messages"""
+    formatter = TelegramHTMLFormatter(limit)
+    messages = formatter.feed(text)
+    messages.extend(formatter.finish())
+    return messages
@@ -1,12 +1,19 @@
-from typing import List, Optional, Dict, Any
+from typing import AsyncIterator, List, Optional, Dict, Any, Tuple
+import asyncio
 import os
+import time
 import httpx
 from dotenv import load_dotenv
-import json
 import uuid
 import logging
-from ..models import Task, Project, SimpleTask
+from ..models import CompletedItems, Task, Project, SimpleTask
 from .logging_setup import setup_logging
+from .todoist_metadata import MetadataCache
+from .task_store import TaskStore
+from .due_index import parse_due
+from .profiling import span
+from .metrics import metrics
+from .runtime import json_dumps, json_loads
 
 # Initialize module logger
 logger = logging.getLogger(__name__)
@@ -14,7 +21,14 @@ logger = logging.getLogger(__name__)
 class TodoistClient:
     RESOURCE_ITEMS = "items"
     RESOURCE_PROJECTS = "projects"
+    RESOURCE_SECTIONS = "sections"
+    RESOURCE_LABELS = "labels"
+    RESOURCE_USER = "user"
     RESOURCE_ALL = "all"
+    # Items and the metadata joined into them travel in one sync request
+    TASK_RESOURCES = [
+        RESOURCE_ITEMS, RESOURCE_PROJECTS, RESOURCE_SECTIONS, RESOURCE_LABELS, RESOURCE_USER
+    ]
 
     def __init__(self):
         self.logger = logger.getChild('TodoistClient')
@@ -27,31 +41,104 @@ class TodoistClient:
         self.base_url = "https://api.todoist.com/sync/v9"
         self.headers = {"Authorization": f"Bearer {self.api_token}"}
         self.sync_token = "*"
+        # When the incremental sync_token last advanced (epoch), 0 if never
+        self.synced_at = 0.0
+        self._sync_lock = asyncio.Lock()
+        self._in_flight: Dict[Tuple[str, str, Tuple[str, ...]], asyncio.Future] = {}
+        self.metadata = MetadataCache()
+        self.store = TaskStore()
         self.logger.info("TodoistClient initialized successfully")
 
-    async def sync(self, resource_types: Optional[List[str]] = None) -> Dict[str, Any]:
-        """Perform a sync operation with Todoist"""
+    async def sync(
+        self,
+        resource_types: Optional[List[str]] = None,
+        sync_token: Optional[str] = None,
+        commands: Optional[List[Dict[str, Any]]] = None,
+    ) -> Dict[str, Any]:
+        """Perform a sync operation with Todoist
+
+        Passing an explicit sync_token performs an out-of-band sync that leaves
+        the client's incremental sync_token untouched. Commands are sent in the
+        same request, so the response carries both their status and the deltas.
+
+        Concurrent read syncs for the same token and resource types share one
+        in-flight request and its result. Syncs that advance the client's
+        sync_token run one at a time, so no delta is skipped or applied twice.
+        """
+        metrics.incr("todoist.sync.requests")
+        if commands:
+            # Writes are never shared between callers
+            return await self._locked_sync(resource_types, sync_token, commands)
+
+        key = (
+            self.api_token,
+            sync_token or self.sync_token,
+            tuple(sorted(resource_types or [self.RESOURCE_ALL])),
+        )
+        in_flight = self._in_flight.get(key)
+        if in_flight is not None:
+            metrics.incr("todoist.sync.deduplicated")
+            self.logger.debug(f"Joining in-flight sync for resources: {resource_types}")
+            # Shielded so one caller's cancellation does not cancel the others
+            return await asyncio.shield(in_flight)
+
+        in_flight = asyncio.ensure_future(self._locked_sync(resource_types, sync_token))
+        self._in_flight[key] = in_flight
+        in_flight.add_done_callback(lambda future: self._forget_sync(key, future))
+        return await asyncio.shield(in_flight)
+
+    def _forget_sync(self, key: Tuple[str, str, Tuple[str, ...]], future: asyncio.Future) -> None:
+        self._in_flight.pop(key, None)
+        # Mark the error as retrieved even if every waiter was cancelled
+        if not future.cancelled():
+            future.exception()
+
+    async def _locked_sync(
+        self,
+        resource_types: Optional[List[str]],
+        sync_token: Optional[str],
+        commands: Optional[List[Dict[str, Any]]] = None,
+    ) -> Dict[str, Any]:
+        if sync_token is not None:
+            return await self._sync_request(resource_types, sync_token, commands)
+        # Read the token and store its successor as one step
+        async with self._sync_lock:
+            return await self._sync_request(resource_types, None, commands)
+
+    async def _sync_request(
+        self,
+        resource_types: Optional[List[str]],
+        sync_token: Optional[str],
+        commands: Optional[List[Dict[str, Any]]] = None,
+    ) -> Dict[str, Any]:
         self.logger.debug(f"Starting sync operation for resources: {resource_types}")
         try:
             data = {
-                "sync_token": self.sync_token,
-                "resource_types": json.dumps(resource_types)
+                "sync_token": sync_token or self.sync_token,
+                "resource_types": json_dumps(resource_types)
                 if resource_types
-                else json.dumps(["all"]),
+                else json_dumps(["all"]),
             }
+            if commands:
+                data["commands"] = json_dumps(commands)
 
-            async with httpx.AsyncClient() as client:
-                self.logger.debug("Making sync API request")
-                response = await client.post(
-                    f"{self.base_url}/sync", headers=self.headers, data=data
-                )
-                response.raise_for_status()
-                result = response.json()
+            metrics.incr("todoist.sync.http_calls")
+            with span("todoist.sync"):
+                async with httpx.AsyncClient() as client:
+                    self.logger.debug("Making sync API request")
+                    response = await client.post(
+                        f"{self.base_url}/sync", headers=self.headers, data=data
+                    )
+                    response.raise_for_status()
+                    result = json_loads(response.content)
 
+            if sync_token is None:
                 self.sync_token = result.get("sync_token", self.sync_token)
-                self.logger.info("Sync operation completed successfully")
-                self.logger.debug(f"New sync token: {self.sync_token}")
-                return result
+                self.synced_at = time.time()
+            self.metadata.apply(result)
+            self.logger.info("Sync operation completed successfully")
+            self.logger.debug(f"New sync token: {self.sync_token}")
+            return result
 
         except httpx.HTTPError as e:
             self.logger.error(
@@ -75,35 +162,14 @@ class TodoistClient:
         """Get all active tasks using Todoist Sync API"""
         self.logger.info("Fetching all active tasks")
         try:
-            sync_data = await self.sync([self.RESOURCE_ITEMS])
+            sync_data = await self.sync(self.TASK_RESOURCES)
             items = sync_data.get("items", [])
             self.logger.debug(f"Retrieved {len(items)} items from sync")
 
-            tasks = []
-            for item in items:
-                try:
-                    task = await self._convert_item_to_task(item)
-                    tasks.append(
-                        SimpleTask(
-                            id=task.id,
-                            content=task.content,
-                            description=task.description,
-                            priority=task.priority,
-                            is_completed=task.is_completed,
-                            due=task.due,
-                            labels=task.labels,
-                        )
-                    )
-                except Exception as e:
-                    self.logger.error(
-                        "Error converting item to task",
-                        exc_info=True,
-                        extra={
-                            "item_id": item.get("id"),
-                            "content": item.get("content", "")[:100]
-                        }
-                    )
-
+            with span("todoist.convert"):
+                tasks = await self._convert_items_to_simple_tasks(items)
+            with span("task_store.apply"):
+                self._update_store(sync_data, tasks)
             self.logger.info(f"Successfully processed {len(tasks)} tasks")
             return tasks
 
@@ -111,6 +177,69 @@ class TodoistClient:
             self.logger.error("Failed to fetch tasks", exc_info=True)
             raise
 
+    async def execute_commands(
+        self, commands: List[Dict[str, Any]]
+    ) -> Tuple[Dict[str, Any], List[SimpleTask]]:
+        """Send a batch of Sync API commands in a single request
+
+        Returns the raw sync_status/temp_id_mapping response together with the
+        item deltas it carried, converted to SimpleTasks.
+        """
+        self.logger.info(f"Executing {len(commands)} commands in one sync request")
+        try:
+            result = await self.sync(self.TASK_RESOURCES, commands=commands)
+            tasks = await self._convert_items_to_simple_tasks(result.get("items", []))
+            self._update_store(result, tasks)
+            self.logger.debug(f"Command batch returned {len(tasks)} task updates")
+            return result, tasks
+
+        except Exception as e:
+            self.logger.error(
+                "Error executing command batch",
+                exc_info=True,
+                extra={"command_types": [command.get("type") for command in commands]}
+            )
+            raise
+
+    async def iter_completed_items(
+        self,
+        cursor: Optional[str] = None,
+        since: Optional[str] = None,
+        limit: int = 200,
+    ) -> AsyncIterator[CompletedItems]:
+        """Stream completed task history page by page, following next_cursor"""
+        self.logger.info("Fetching completed items history")
+        params: Dict[str, Any] = {"limit": limit, "annotate_items": "true"}
+        if since:
+            params["since"] = since
+
+        try:
+            async with httpx.AsyncClient() as client:
+                while True:
+                    page_params = {**params, **({"cursor": cursor} if cursor else {})}
+                    self.logger.debug(f"Requesting completed items page (cursor={cursor})")
+                    response = await client.get(
+                        f"{self.base_url}/completed/get_all",
+                        headers=self.headers,
+                        params=page_params,
+                    )
+                    response.raise_for_status()
+                    page = CompletedItems(**json_loads(response.content))
+                    self.logger.debug(f"Received {len(page.items)} completed items")
+                    yield page
+
+                    if not page.has_more or not page.next_cursor:
+                        break
+                    cursor = page.next_cursor
+
+        except Exception as e:
+            self.logger.error(
+                "Error fetching completed items",
+                exc_info=True,
+                extra={"cursor": cursor, "since": since}
+            )
+            raise
+
     async def add_task(
         self,
         content: str,
@@ -152,14 +281,14 @@ class TodoistClient:
         ]
 
         try:
-            data = {"commands": json.dumps(commands)}
+            data = {"commands": json_dumps(commands)}
             async with httpx.AsyncClient() as client:
                 self.logger.debug("Sending task creation request")
                 response = await client.post(
                     f"{self.base_url}/sync", headers=self.headers, data=data
                 )
                 response.raise_for_status()
-                result = response.json()
+                result = json_loads(response.content)
 
                 if "temp_id_mapping" in result:
                     task_id = result["temp_id_mapping"].get(temp_id)
@@ -196,7 +325,7 @@ class TodoistClient:
         ]
 
         try:
-            data = {"commands": json.dumps(commands)}
+            data = {"commands": json_dumps(commands)}
             
             async with httpx.AsyncClient() as client:
                 self.logger.debug("Sending task close request")
@@ -204,7 +333,7 @@ class TodoistClient:
                     f"{self.base_url}/sync", headers=self.headers, data=data
                 )
                 response.raise_for_status()
-                result = response.json()
+                result = json_loads(response.content)
                 
                 success = all(
                     status.get("error") is None
@@ -227,42 +356,14 @@ class TodoistClient:
             raise
 
     async def get_projects(self) -> List[Project]:
-        """Get all projects"""
+        """Get all projects from the metadata cache, loading it on first use"""
         self.logger.info("Fetching all projects")
         try:
-            sync_data = await self.sync(["projects"])
-            projects_data = sync_data.get("projects", [])
-            self.logger.debug(f"Retrieved {len(projects_data)} projects")
-            
-            projects = []
-            for project in projects_data:
-                try:
-                    project_data = {
-                        "id": project["id"],
-                        "name": project["name"],
-                        "color": project.get("color", ""),
-                        "parent_id": project.get("parent_id"),
-                        "order": project.get("order", 0),
-                        "comment_count": project.get("comment_count", 0),
-                        "is_shared": project.get("shared", False),
-                        "is_favorite": project.get("is_favorite", False),
-                        "is_inbox_project": project.get("is_inbox_project", False),
-                        "is_team_inbox": project.get("is_team_inbox", False),
-                        "view_style": project.get("view_style", "list"),
-                        "url": project.get("url", ""),
-                        "can_assign_tasks": project.get("can_assign_tasks", False),
-                    }
-                    projects.append(Project(**project_data))
-                except Exception as e:
-                    self.logger.error(
-                        "Error processing project data",
-                        exc_info=True,
-                        extra={
-                            "project_id": project.get("id"),
-                            "project_name": project.get("name")
-                        }
-                    )
-                    
+            if not self.metadata.loaded:
+                # Full out-of-band sync so pending item deltas aren't consumed
+                await self.sync(MetadataCache.RESOURCE_TYPES, sync_token="*")
+
+            projects = sorted(self.metadata.projects.values(), key=lambda p: p.order)
             self.logger.info(f"Successfully processed {len(projects)} projects")
             return projects
             
@@ -270,6 +371,52 @@ class TodoistClient:
             self.logger.error("Failed to fetch projects", exc_info=True)
             raise
 
+    def _update_store(self, sync_data: Dict[str, Any], tasks: List[SimpleTask]) -> None:
+        """Apply a sync response's item deltas to the task store and its indexes"""
+        if sync_data.get("full_sync"):
+            self.store.clear()
+        self.store.timezone = self.metadata.timezone
+        deleted_ids = {item["id"] for item in sync_data.get("items", []) if item.get("is_deleted")}
+        self.store.apply([task for task in tasks if task.id not in deleted_ids], deleted_ids)
+
+    async def _convert_items_to_simple_tasks(self, items: List[Dict[str, Any]]) -> List[SimpleTask]:
+        """Convert sync items to SimpleTasks with cached metadata joined in"""
+        tasks = []
+        for item in items:
+            try:
+                task = await self._convert_item_to_task(item)
+                # Parse and normalize the due date once, at ingest
+                due_at, due_timezone = parse_due(task.due, self.metadata.timezone)
+                tasks.append(
+                    self.metadata.annotate(
+                        SimpleTask(
+                            id=task.id,
+                            content=task.content,
+                            description=task.description,
+                            priority=task.priority,
+                            is_completed=task.is_completed,
+                            due=task.due,
+                            labels=task.labels,
+                            project_id=task.project_id,
+                            section_id=task.section_id,
+                            parent_id=task.parent_id,
+                            child_order=task.order,
+                            due_at=due_at,
+                            timezone=due_timezone,
+                        )
+                    )
+                )
+            except Exception as e:
+                self.logger.error(
+                    "Error converting item to task",
+                    exc_info=True,
+                    extra={
+                        "item_id": item.get("id"),
+                        "content": item.get("content", "")[:100]
+                    }
+                )
+        return tasks
+
     async def _convert_item_to_task(self, item: Dict[str, Any]) -> Task:
         """Helper method to convert an item dict to a Task object"""
         self.logger.debug(f"Converting item to task: {item.get('id')}")
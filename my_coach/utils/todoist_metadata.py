@@ -0,0 +1,144 @@
+import logging
+from typing import Any, Dict, List, Optional
+from ..models import Label, Project, Section, SimpleTask
+
+logger = logging.getLogger(__name__)
+
+
+class MetadataCache:
+    """In-memory cache of Todoist projects, sections and labels indexed by id.
+
+    Populated from the same sync responses as items and kept current by
+    applying each delta, so tasks can be annotated without extra requests.
+    """
+
+    RESOURCE_TYPES = ["projects", "sections", "labels"]
+
+    def __init__(self):
+        self.logger = logger.getChild('MetadataCache')
+        self.projects: Dict[str, Project] = {}
+        self.sections: Dict[str, Section] = {}
+        self.labels: Dict[str, Label] = {}
+        self.labels_by_name: Dict[str, Label] = {}
+        # Account timezone from the "user" resource, used to read floating dues
+        self.timezone: Optional[str] = None
+        self.loaded = False
+        # Bumped whenever cached data changes so callers can re-annotate tasks
+        self.revision = 0
+
+    def apply(self, sync_data: Dict[str, Any]) -> bool:
+        """Apply a sync response to the cache, returning whether anything changed"""
+        full_sync = sync_data.get("full_sync", False)
+        changed = False
+
+        if "projects" in sync_data:
+            changed |= self._apply_resource(
+                self.projects, sync_data["projects"], full_sync, self._to_project
+            )
+        if "sections" in sync_data:
+            changed |= self._apply_resource(
+                self.sections, sync_data["sections"], full_sync, self._to_section
+            )
+        if "labels" in sync_data:
+            label_changed = self._apply_resource(
+                self.labels, sync_data["labels"], full_sync, self._to_label
+            )
+            if label_changed:
+                self.labels_by_name = {label.name: label for label in self.labels.values()}
+            changed |= label_changed
+
+        user = sync_data.get("user") or {}
+        timezone = (user.get("tz_info") or {}).get("timezone")
+        if timezone and timezone != self.timezone:
+            self.timezone = timezone
+            changed = True
+
+        if full_sync and all(key in sync_data for key in self.RESOURCE_TYPES):
+            self.loaded = True
+        if changed:
+            self.revision += 1
+            self.logger.debug(
+                f"Metadata cache updated (revision {self.revision}): "
+                f"{len(self.projects)} projects, {len(self.sections)} sections, "
+                f"{len(self.labels)} labels"
+            )
+        return changed
+
+    def annotate(self, task: SimpleTask) -> SimpleTask:
+        """Return the task with project and section names joined from the cache"""
+        project = self.projects.get(task.project_id) if task.project_id else None
+        section = self.sections.get(task.section_id) if task.section_id else None
+        project_name = project.name if project else None
+        section_name = section.name if section else None
+
+        if task.project_name == project_name and task.section_name == section_name:
+            return task
+        return task.model_copy(
+            update={"project_name": project_name, "section_name": section_name}
+        )
+
+    def get_label(self, name: str) -> Optional[Label]:
+        """Look up a label by the name items reference it with"""
+        return self.labels_by_name.get(name)
+
+    def _apply_resource(self, cache: Dict[str, Any], records: List[Dict[str, Any]],
+                        full_sync: bool, convert) -> bool:
+        changed = False
+        if full_sync and cache:
+            cache.clear()
+            changed = True
+
+        for record in records:
+            record_id = record.get("id")
+            if not record_id:
+                continue
+            if record.get("is_deleted") or record.get("is_archived"):
+                changed |= cache.pop(record_id, None) is not None
+                continue
+            try:
+                cache[record_id] = convert(record)
+                changed = True
+            except Exception:
+                self.logger.error(
+                    "Error caching metadata record",
+                    exc_info=True,
+                    extra={"record_id": record_id, "name": record.get("name")}
+                )
+        return changed
+
+    @staticmethod
+    def _to_project(project: Dict[str, Any]) -> Project:
+        return Project(
+            id=project["id"],
+            name=project["name"],
+            color=project.get("color", ""),
+            parent_id=project.get("parent_id"),
+            order=project.get("child_order", project.get("order", 0)),
+            comment_count=project.get("comment_count", 0),
+            is_shared=project.get("shared", False),
+            is_favorite=project.get("is_favorite", False),
+            is_inbox_project=project.get("inbox_project", project.get("is_inbox_project", False)),
+            is_team_inbox=project.get("team_inbox", project.get("is_team_inbox", False)),
+            view_style=project.get("view_style", "list"),
+            url=project.get("url", ""),
+            can_assign_tasks=project.get("can_assign_tasks", False),
+        )
+
+    @staticmethod
+    def _to_section(section: Dict[str, Any]) -> Section:
+        return Section(
+            id=section["id"],
+            name=section["name"],
+            order=section.get("section_order", section.get("order", 0)),
+            project_id=section["project_id"],
+        )
+
+    @staticmethod
+    def _to_label(label: Dict[str, Any]) -> Label:
+        return Label(
+            id=label["id"],
+            name=label["name"],
+            color=label.get("color", ""),
+            order=label.get("item_order", label.get("order", 0)),
+            is_favorite=label.get("is_favorite", False),
+        )
@@ -0,0 +1,157 @@
+import logging
+import os
+import sqlite3
+import time
+import uuid
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional
+from .metrics import metrics
+from .runtime import data_path
+
+logger = logging.getLogger(__name__)
+
+PROCESSING = "processing"
+GENERATED = "generated"
+DELIVERED = "delivered"
+
+
+class LedgerEntry:
+    __slots__ = ("key", "state", "response", "owner", "updated_at")
+
+    def __init__(self, key: str, state: str, response: Optional[str], owner: str, updated_at: float):
+        self.key = key
+        self.state = state
+        self.response = response
+        self.owner = owner
+        self.updated_at = updated_at
+
+
+class UpdateLedger:
+    """Processing state of incoming messages, to make redeliveries idempotent.
+
+    Each message key moves from processing to generated (reply computed)
+    to delivered. Recent entries are kept in a bounded LRU in front of a
+    SQLite table, and rows older than the TTL are pruned as new ones arrive,
+    so both memory and disk stay bounded. An entry still processing under a
+    previous process instance, or for longer than the processing timeout,
+    is treated as abandoned and may be processed again.
+    """
+
+    PRUNE_EVERY = 1000
+
+    def __init__(self, path: Optional[str] = None, cache_size: Optional[int] = None,
+                 ttl: Optional[float] = None, processing_timeout: Optional[float] = None):
+        self.logger = logger.getChild('UpdateLedger')
+        path = path or os.getenv("UPDATE_LEDGER_PATH") or data_path("updates.db")
+        self.cache_size = cache_size or int(os.getenv("UPDATE_LEDGER_CACHE_SIZE", "10000"))
+        # Telegram stops redelivering updates after 24 hours
+        self.ttl = ttl or float(os.getenv("UPDATE_LEDGER_TTL", str(48 * 3600)))
+        self.processing_timeout = processing_timeout or float(
+            os.getenv("UPDATE_LEDGER_PROCESSING_TIMEOUT", "300")
+        )
+        self.instance = uuid.uuid4().hex
+        self.cache: "OrderedDict[str, LedgerEntry]" = OrderedDict()
+        self._writes = 0
+
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS updates ("
+            "key TEXT PRIMARY KEY, state TEXT NOT NULL, response TEXT, "
+            "owner TEXT NOT NULL, updated_at REAL NOT NULL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS updates_updated_at ON updates (updated_at)")
+        self.conn.commit()
+
+    @staticmethod
+    def message_key(chat_id: int, message_id: int) -> str:
+        return f"{chat_id}:{message_id}"
+
+    def get(self, key: str) -> Optional[LedgerEntry]:
+        entry = self.cache.get(key)
+        if entry is not None:
+            self.cache.move_to_end(key)
+            return entry
+        row = self.conn.execute(
+            "SELECT state, response, owner, updated_at FROM updates WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        entry = LedgerEntry(key, *row)
+        self._cache(entry)
+        return entry
+
+    def begin(self, key: str) -> Optional[LedgerEntry]:
+        """Claim a message for processing; returns the existing entry for duplicates"""
+        entry = self.get(key)
+        if entry is not None and not self._abandoned(entry):
+            metrics.incr(f"updates.duplicate.{entry.state}")
+            return entry
+        if entry is not None:
+            self.logger.info(f"Reprocessing abandoned update {key}")
+            metrics.incr("updates.abandoned")
+        self._write(key, PROCESSING, None)
+        return None
+
+    def generated(self, key: str, response: str) -> None:
+        """Record the reply before delivery so a redelivery can replay it"""
+        self._write(key, GENERATED, response)
+
+    def delivered(self, key: str) -> None:
+        # The reply is no longer needed once delivered
+        self._write(key, DELIVERED, None)
+
+    def release(self, key: str) -> None:
+        """Forget a message whose processing failed so a redelivery retries it
+
+        A generated reply is kept so that the retry replays it instead.
+        """
+        entry = self.get(key)
+        if entry is None or entry.state != PROCESSING:
+            return
+        self.cache.pop(key, None)
+        self.conn.execute("DELETE FROM updates WHERE key = ?", (key,))
+        self.conn.commit()
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def _abandoned(self, entry: LedgerEntry) -> bool:
+        return entry.state == PROCESSING and (
+            entry.owner != self.instance
+            or time.time() - entry.updated_at > self.processing_timeout
+        )
+
+    def _write(self, key: str, state: str, response: Optional[str]) -> None:
+        now = time.time()
+        self.conn.execute(
+            "INSERT INTO updates (key, state, response, owner, updated_at) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET state = excluded.state, response = excluded.response, "
+            "owner = excluded.owner, updated_at = excluded.updated_at",
+            (key, state, response, self.instance, now),
+        )
+        self.conn.commit()
+        self._cache(LedgerEntry(key, state, response, self.instance, now))
+
+        self._writes += 1
+        if self._writes % self.PRUNE_EVERY == 0:
+            self.prune(now)
+
+    def _cache(self, entry: LedgerEntry) -> None:
+        self.cache[entry.key] = entry
+        self.cache.move_to_end(entry.key)
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+    def prune(self, now: Optional[float] = None) -> int:
+        """Delete rows older than the TTL"""
+        cursor = self.conn.execute(
+            "DELETE FROM updates WHERE updated_at < ?", ((now or time.time()) - self.ttl,)
+        )
+        self.conn.commit()
+        if cursor.rowcount:
+            self.logger.debug(f"Pruned {cursor.rowcount} expired ledger entries")
+        return cursor.rowcount
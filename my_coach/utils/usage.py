@@ -0,0 +1,171 @@
+import asyncio
+import logging
+import os
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional, Set, Tuple
+from pydantic import BaseModel
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# DailyUsage fields that accumulate over the day
+COUNTERS = ("requests", "prompt_tokens", "completion_tokens", "cached_tokens", "cost_usd")
+
+
+class DailyUsage(BaseModel):
+    """Token and cost totals of one user for one UTC day"""
+
+    user_id: str
+    day: str
+    requests: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    cached_tokens: int = 0
+    cost_usd: float = 0.0
+
+    @property
+    def total_tokens(self) -> int:
+        return self.prompt_tokens + self.completion_tokens
+
+
+def utc_day(now: Optional[datetime] = None) -> str:
+    return (now or datetime.now(timezone.utc)).strftime("%Y-%m-%d")
+
+
+class UsageTracker:
+    """Per-user daily LLM usage, aggregated in memory and flushed in batches.
+
+    Responses only bump in-memory counters; a background loop upserts the
+    totals of every user that changed since the last flush as one batch.
+    A user's row for the day is loaded once before it is first checked, so
+    totals and quotas survive restarts. Rows hold absolute daily totals,
+    which is safe because each user is served by a single process. A row
+    is only written back once the stored totals were read: after a failed
+    load, usage keeps accumulating in memory and the load is retried on the
+    next check or flush.
+    """
+
+    def __init__(self):
+        self.logger = logger.getChild('UsageTracker')
+        self.daily_token_quota = int(os.getenv("USER_DAILY_TOKEN_QUOTA", "200000"))
+        self.daily_cost_quota = float(os.getenv("USER_DAILY_COST_QUOTA", "0.50"))
+        self.flush_interval = float(os.getenv("USAGE_FLUSH_SECONDS", "60"))
+        self.usage: Dict[Tuple[str, str], DailyUsage] = {}
+        self.dirty: Set[Tuple[str, str]] = set()
+        # Rows that include the totals stored before this process saw them
+        self.loaded: Set[Tuple[str, str]] = set()
+        self.sink: Optional[Any] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self, sink: Any) -> None:
+        """Start flushing to a store with get_usage/upsert_usage (e.g. SupabaseClient)"""
+        self.sink = sink
+        if not self._task:
+            self._task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    async def load(self, user_id: str) -> DailyUsage:
+        """Today's usage for a user, loading the persisted row on first access"""
+        return await self._load((user_id, utc_day()))
+
+    async def _load(self, key: Tuple[str, str]) -> DailyUsage:
+        if key in self.loaded or not self.sink:
+            return self.usage.setdefault(key, DailyUsage(user_id=key[0], day=key[1]))
+
+        try:
+            row = await self.sink.get_usage(*key)
+        except Exception:
+            metrics.incr("usage.load_failed")
+            self.logger.error(
+                "Error loading usage, retrying on next access",
+                exc_info=True,
+                extra={"user_id": key[0]}
+            )
+            # Not marked loaded: flushing a total counted from zero would overwrite the stored one
+            return self.usage.get(key) or DailyUsage(user_id=key[0], day=key[1])
+
+        usage = self.usage.setdefault(key, DailyUsage(user_id=key[0], day=key[1]))
+        if row and key not in self.loaded:
+            # Responses recorded before or while loading add to the stored totals
+            for field in COUNTERS:
+                setattr(usage, field, getattr(usage, field) + (row.get(field) or 0))
+        self.loaded.add(key)
+        return usage
+
+    def record(self, user_id: str, usage_metadata: Optional[Dict[str, Any]], cost: float) -> None:
+        """Add one model response's usage to the user's daily totals"""
+        if not user_id or not usage_metadata:
+            return
+        key = (user_id, utc_day())
+        usage = self.usage.get(key)
+        if usage is None:
+            usage = self.usage[key] = DailyUsage(user_id=user_id, day=key[1])
+
+        usage.requests += 1
+        usage.prompt_tokens += usage_metadata.get("input_tokens", 0)
+        usage.completion_tokens += usage_metadata.get("output_tokens", 0)
+        usage.cached_tokens += (usage_metadata.get("input_token_details") or {}).get("cache_read", 0) or 0
+        usage.cost_usd += cost
+        self.dirty.add(key)
+
+    async def over_quota(self, user_id: str) -> bool:
+        """Whether the user has used up today's token or cost quota"""
+        usage = await self.load(user_id)
+        exceeded = (
+            usage.total_tokens >= self.daily_token_quota
+            or usage.cost_usd >= self.daily_cost_quota
+        )
+        if exceeded:
+            metrics.incr("usage.quota_exceeded")
+            self.logger.info(
+                f"User {user_id} over daily quota: {usage.total_tokens} tokens, "
+                f"${usage.cost_usd:.4f}"
+            )
+        return exceeded
+
+    async def flush(self) -> int:
+        """Upsert every changed daily total in one batch, returning the row count"""
+        if not self.dirty or not self.sink:
+            return 0
+        keys, self.dirty = self.dirty, set()
+        for key in keys - self.loaded:
+            await self._load(key)
+        # Rows whose stored totals are still unknown wait for a later flush
+        self.dirty |= keys - self.loaded
+        keys &= self.loaded
+        rows = [self.usage[key].model_dump() for key in keys if key in self.usage]
+        if not rows:
+            return 0
+        try:
+            await self.sink.upsert_usage(rows)
+        except Exception:
+            # Keep the rows dirty so the next flush retries them
+            self.dirty |= keys
+            self.logger.error("Error flushing usage", exc_info=True, extra={"rows": len(rows)})
+            return 0
+
+        # Only today's totals can still change
+        today = utc_day()
+        for key in [key for key in self.usage if key[1] != today and key not in self.dirty]:
+            del self.usage[key]
+            self.loaded.discard(key)
+        metrics.incr("usage.rows_flushed", len(rows))
+        self.logger.debug(f"Flushed {len(rows)} usage rows")
+        return len(rows)
+
+    async def _flush_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+
+usage_tracker = UsageTracker()
@@ -0,0 +1,117 @@
+import asyncio
+import logging
+import os
+from collections import defaultdict
+from typing import Any, Dict, FrozenSet, List, Optional
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class UserWriteBuffer:
+    """Write-behind buffer for rows of the users table.
+
+    Writes are merged per user in call order, so a user's latest value for
+    each field wins and any number of writes becomes a single row. Rows are
+    flushed as bulk upserts keyed on id, on a timer or once `max_pending`
+    users are waiting. Flushes are serialized, and a failed batch is put back
+    underneath anything written since, so a newer value is never overwritten
+    by an older one. Rows being flushed stay visible to `pending_fields`
+    until their upsert has finished.
+    """
+
+    def __init__(self, supabase: Any, flush_interval: Optional[float] = None,
+                 max_pending: Optional[int] = None):
+        self.logger = logger.getChild('UserWriteBuffer')
+        self.supabase = supabase
+        self.flush_interval = flush_interval or float(os.getenv("USER_WRITE_FLUSH_SECONDS", "5"))
+        self.max_pending = max_pending or int(os.getenv("USER_WRITE_BATCH_SIZE", "500"))
+        self.pending: Dict[int, Dict[str, Any]] = {}
+        # Rows of the batch being flushed whose upsert has not finished
+        self.inflight: Dict[int, Dict[str, Any]] = {}
+        self._lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self._threshold_flush: Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        return len(self.pending)
+
+    async def start(self) -> None:
+        if not self._task:
+            self._task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self) -> None:
+        """Stop the timer and flush everything still buffered"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    def write(self, user_id: int, **fields: Any) -> None:
+        """Buffer field values for a user, creating the row if it does not exist"""
+        self.pending.setdefault(user_id, {}).update(fields)
+        metrics.incr("user_writes.buffered")
+        if len(self.pending) >= self.max_pending and not self._threshold_flush:
+            self._threshold_flush = asyncio.create_task(self._flush_at_threshold())
+
+    def pending_fields(self, user_id: int) -> Dict[str, Any]:
+        """Buffered values not yet written, to overlay on rows read back"""
+        return {**self.inflight.get(user_id, {}), **self.pending.get(user_id, {})}
+
+    async def flush(self) -> int:
+        """Upsert every buffered row, returning how many rows were written"""
+        async with self._lock:
+            if not self.pending:
+                return 0
+            batch, self.pending = self.pending, {}
+            self.inflight = dict(batch)
+
+            # Rows are grouped by column set: a bulk upsert sends one column
+            # list, and columns missing from a row would be overwritten
+            groups: Dict[FrozenSet[str], List[Dict[str, Any]]] = defaultdict(list)
+            for user_id, fields in batch.items():
+                groups[frozenset(fields)].append({**fields, "id": user_id})
+
+            written = 0
+            try:
+                for rows in groups.values():
+                    try:
+                        await self.supabase.upsert_users(rows)
+                        written += len(rows)
+                    except Exception:
+                        self.logger.error(
+                            "Error flushing user writes, requeueing",
+                            exc_info=True,
+                            extra={"rows": len(rows)}
+                        )
+                        for row in rows:
+                            self.pending[row["id"]] = {
+                                **batch[row["id"]], **self.pending.get(row["id"], {})
+                            }
+                    for row in rows:
+                        self.inflight.pop(row["id"], None)
+            finally:
+                # Left over only if the flush was cancelled mid-batch
+                for user_id, fields in self.inflight.items():
+                    self.pending[user_id] = {**fields, **self.pending.get(user_id, {})}
+                self.inflight = {}
+
+            metrics.incr("user_writes.flushed_rows", written)
+            if written:
+                self.logger.debug(f"Flushed {written} user rows in {len(groups)} upserts")
+            return written
+
+    async def _flush_at_threshold(self) -> None:
+        try:
+            await self.flush()
+        finally:
+            self._threshold_flush = None
+
+    async def _flush_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
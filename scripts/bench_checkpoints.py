@@ -0,0 +1,141 @@
+"""Measure checkpoint bytes written per turn, with delta and full node outputs.
+
+Runs the real agent graph for --turns turns against a local Todoist sync
+server holding --tasks tasks. Every other turn brings one edited task, and
+one turn deletes a task. The model is a fake OpenAI-compatible endpoint.
+MeasuredMemorySaver counts the bytes stored each turn.
+
+The graph runs twice. The first run uses GetTasksNode, which emits only the
+tasks that changed. The second reproduces the node's earlier output: the
+full message history and task list after every sync, or the whole state
+when nothing changed.
+
+    python scripts/bench_checkpoints.py [--tasks 500] [--turns 10]
+"""
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import tempfile
+from pathlib import Path
+from typing import Any, Dict, List
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+os.environ.setdefault("TODOIST_API_TOKEN", "bench")
+os.environ.setdefault("OPENAI_API_KEY", "bench")
+os.environ["MEMORY_ENABLED"] = "false"
+os.environ["HISTORY_DIR"] = tempfile.mkdtemp()
+
+from aiohttp import web
+from bench_hedging import FakeOpenAI
+from my_coach import agent
+from my_coach.nodes.get_tasks import GetTasksNode
+from my_coach.state import State
+from my_coach.utils.todoist import TodoistClient
+
+
+class FakeTodoist:
+    """Sync endpoint: a full sync, then one turn's worth of changes per call"""
+
+    def __init__(self, tasks: int):
+        self.tasks = tasks
+        self.turn = 0
+
+    def item(self, i: int, revision: int = 0) -> Dict[str, Any]:
+        return {
+            "id": str(i), "content": f"Task {i} rev {revision} about groceries and taxes",
+            "description": "some notes here", "project_id": "p1", "priority": 1 + i % 4,
+            "due": {"date": f"2026-10-2{i % 9}", "string": "soon", "is_recurring": False},
+        }
+
+    async def sync(self, request: web.Request) -> web.Response:
+        form = await request.post()
+        if form.get("sync_token", "*") == "*":
+            return web.json_response({
+                "sync_token": "bench", "full_sync": True,
+                "items": [self.item(i) for i in range(self.tasks)],
+                "projects": [{"id": "p1", "name": "Home"}], "sections": [], "labels": [],
+                "user": {"tz_info": {"timezone": "UTC"}},
+            })
+        items = [self.item(self.turn, self.turn)] if self.turn % 2 else []
+        if self.turn == 4:
+            items.append({**self.item(self.tasks - 1), "is_deleted": True})
+        return web.json_response({"sync_token": "bench", "full_sync": False, "items": items,
+                                  "projects": [], "sections": [], "labels": []})
+
+    async def completed(self, request: web.Request) -> web.Response:
+        return web.json_response({"items": [], "total": 0, "completed_info": [], "has_more": False})
+
+
+class FullOutputGetTasksNode(GetTasksNode):
+    """GetTasksNode's earlier output: the whole history and task list"""
+
+    async def __call__(self, state: State) -> dict:
+        updates = await self.todoist_client.get_tasks()
+        if not updates:
+            return state
+        tasks_by_id = {task.id: task for task in state.get("tasks", [])}
+        for update in updates:
+            tasks_by_id[update.id] = update
+        return {"msgs": state.get("msgs", []), "tasks": list(tasks_by_id.values())}
+
+
+async def run_turns(todoist: FakeTodoist, base_url: str, turns: int) -> List[int]:
+    client = TodoistClient()
+    client.base_url = base_url
+    graph = agent.create_agent(client)
+    saver = graph.checkpointer
+    config = {"configurable": {"thread_id": "42"}}
+    written = []
+    for turn in range(turns):
+        todoist.turn = turn
+        before = saver.bytes_by_thread["42"]
+        await graph.ainvoke({"msgs": [("user", f"message {turn} about my taxes")]}, config)
+        written.append(saver.bytes_by_thread["42"] - before)
+    return written
+
+
+async def run(args: argparse.Namespace) -> None:
+    todoist = FakeTodoist(args.tasks)
+    model = FakeOpenAI(fast_ms=2, slow_share=0, slow_seconds=0)
+    app = web.Application()
+    app.router.add_post("/sync", todoist.sync)
+    app.router.add_get("/completed/get_all", todoist.completed)
+    app.router.add_post("/v1/chat/completions", model.handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    base_url = f"http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}"
+    os.environ["COACH_LLM_BASE_URL"] = f"{base_url}/v1"
+
+    try:
+        results = {"delta outputs": await run_turns(todoist, base_url, args.turns)}
+        agent.GetTasksNode = FullOutputGetTasksNode
+        try:
+            results["full outputs"] = await run_turns(todoist, base_url, args.turns)
+        finally:
+            agent.GetTasksNode = GetTasksNode
+    finally:
+        await runner.cleanup()
+
+    for name, written in results.items():
+        # The first turn is the full sync in both runs
+        steady = written[1:]
+        print(f"{name:14} KB per turn: {' '.join(f'{size / 1024:.0f}' for size in written)} | "
+              f"mean after the first {sum(steady) / len(steady) / 1024:.1f} KB")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--tasks", type=int, default=500)
+    parser.add_argument("--turns", type=int, default=10)
+    args = parser.parse_args()
+    logging.disable(logging.CRITICAL)
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+"""Benchmark hedged model requests against a fake OpenAI-compatible endpoint.
+
+Starts a local chat completions server that streams a fixed reply after an
+injected delay: most requests start within --fast-ms, but --slow-share of
+them stall for --slow-seconds before the first token, like a provider with
+a long tail. Requests go through ChatNode._generate and the real
+langchain_openai client, with HedgedRequests off and then on, and the run
+reports p50/p90/p99 latency, hedges sent, won, lost and capped, and how
+many requests the server saw cancelled.
+
+    python scripts/bench_hedging.py [--requests 1000] [--slow-share 0.08] [--slow-seconds 3]
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import sys
+import time
+from pathlib import Path
+from typing import Any, Dict, List
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+# ChatNode builds the Todoist and memory singletons; nothing here calls them
+os.environ.setdefault("TODOIST_API_TOKEN", "bench")
+os.environ.setdefault("OPENAI_API_KEY", "bench")
+os.environ["COACH_LLM_API_KEY"] = "bench"
+
+from aiohttp import web
+from my_coach.nodes.chat import ChatNode
+from my_coach.utils.hedging import HedgedRequests
+from my_coach.utils.metrics import metrics
+
+REPLY = "Sure, here is your plan for today"
+
+
+class FakeOpenAI:
+    """Streaming chat completions endpoint with injected first-token delays"""
+
+    def __init__(self, fast_ms: float, slow_share: float, slow_seconds: float, seed: int = 7):
+        self.fast = fast_ms / 1000
+        self.slow_share = slow_share
+        self.slow_seconds = slow_seconds
+        self.rng = random.Random(seed)
+        self.requests = 0
+        self.cancelled = 0
+
+    def delay(self) -> float:
+        if self.rng.random() < self.slow_share:
+            return self.slow_seconds
+        return self.rng.uniform(self.fast / 2, self.fast)
+
+    def _chunk(self, model: str, **fields: Any) -> bytes:
+        data = {"id": "bench", "object": "chat.completion.chunk", "created": int(time.time()),
+                "model": model, **fields}
+        return f"data: {json.dumps(data)}\n\n".encode()
+
+    async def handle(self, request: web.Request) -> web.StreamResponse:
+        body = await request.json()
+        self.requests += 1
+        try:
+            await asyncio.sleep(self.delay())
+        except asyncio.CancelledError:
+            # The client closed the connection: a hedge or primary that lost
+            self.cancelled += 1
+            raise
+        model = body["model"]
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        for word in REPLY.split():
+            await response.write(self._chunk(model, choices=[
+                {"index": 0, "delta": {"role": "assistant", "content": word + " "}, "finish_reason": None}
+            ]))
+        await response.write(self._chunk(model, choices=[{"index": 0, "delta": {}, "finish_reason": "stop"}]))
+        if body.get("stream_options", {}).get("include_usage"):
+            await response.write(self._chunk(model, choices=[], usage={
+                "prompt_tokens": 100, "completion_tokens": 8, "total_tokens": 108,
+            }))
+        await response.write(b"data: [DONE]\n\n")
+        return response
+
+
+def percentile(samples: List[float], q: float) -> float:
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, round(q / 100 * (len(samples) - 1)))]
+
+
+async def measure(node, requests: int, concurrency: int) -> List[float]:
+    latencies: List[float] = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one() -> None:
+        async with semaphore:
+            started = time.perf_counter()
+            response = await node._generate("small", {"input": "how are my tasks looking?"}, "1")
+            latencies.append(time.perf_counter() - started)
+            assert response.content.strip() == REPLY, response
+
+    await asyncio.gather(*(one() for _ in range(requests)))
+    return latencies
+
+
+async def run(args: argparse.Namespace) -> None:
+    api = FakeOpenAI(args.fast_ms, args.slow_share, args.slow_seconds)
+    app = web.Application()
+    app.router.add_post("/v1/chat/completions", api.handle)
+    # Cancel handlers on disconnect so losing requests show up as cancelled
+    runner = web.AppRunner(app, handler_cancellation=True)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    # Read by ModelRouter when each ChatNode is built
+    os.environ["COACH_LLM_BASE_URL"] = f"http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}/v1"
+
+    try:
+        for enabled in (False, True):
+            hedging = HedgedRequests(max_rate=args.max_rate)
+            hedging.enabled = enabled
+            node = ChatNode(hedging=hedging)
+            # Fill the first-token percentiles the hedge delay is based on
+            await measure(node, 100, args.concurrency)
+            counters: Dict[str, float] = metrics.counters
+            before = {name: counters.get(f"llm.hedge.{name}", 0) for name in ("sent", "won", "lost", "capped")}
+            requests, cancelled = api.requests, api.cancelled
+            latencies = await measure(node, args.requests, args.concurrency)
+            hedges = {name: counters.get(f"llm.hedge.{name}", 0) - count for name, count in before.items()}
+            print(
+                f"hedging {'on ' if enabled else 'off'}: p50 {percentile(latencies, 50) * 1e3:.0f} ms, "
+                f"p90 {percentile(latencies, 90) * 1e3:.0f} ms, p99 {percentile(latencies, 99) * 1e3:.0f} ms, "
+                f"max {max(latencies) * 1e3:.0f} ms | {api.requests - requests} requests, "
+                f"{api.cancelled - cancelled} cancelled"
+            )
+            if enabled:
+                print(f"  hedges sent {hedges['sent']:.0f}, won {hedges['won']:.0f}, lost {hedges['lost']:.0f}, "
+                      f"capped {hedges['capped']:.0f}; hedge delay {hedging.delay('small') * 1e3:.0f} ms")
+    finally:
+        await runner.cleanup()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--fast-ms", type=float, default=110, help="upper bound of a normal first-token delay")
+    parser.add_argument("--slow-share", type=float, default=0.08, help="share of requests that stall")
+    parser.add_argument("--slow-seconds", type=float, default=3, help="first-token delay of a stalled request")
+    parser.add_argument("--max-rate", type=float, default=0.15, help="LLM_HEDGE_MAX_RATE for the run")
+    args = parser.parse_args()
+    logging.disable(logging.CRITICAL)
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
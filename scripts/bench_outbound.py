@@ -0,0 +1,146 @@
+"""Benchmark the outbound sender against a fake Telegram Bot API.
+
+Starts a local HTTP server speaking the Bot API and points a real aiogram
+Bot at it. Like Telegram, the server answers 429 with retry_after when
+more than --global-rate requests arrive in a second, or more than one
+message for the same chat. It can also impose a bot-wide flood wait.
+
+A broadcast to --chats chats is queued, then interactive replies, each
+after a typing action, arrive behind it. The run reports sustained
+throughput, 429s, and how quickly the interactive replies went out.
+
+    python scripts/bench_outbound.py [--chats 600] [--replies 20] [--flood 2]
+"""
+import argparse
+import asyncio
+import statistics
+import sys
+import tempfile
+import time
+from collections import deque
+from pathlib import Path
+from typing import Deque, Dict, List
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from aiohttp import web
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from my_coach.utils.outbound import OutboundSender
+
+TOKEN = "42:fake"
+
+
+class FakeBotAPI:
+    """Bot API stand-in enforcing Telegram's global and per-chat limits"""
+
+    def __init__(self, global_rate: int, latency: float):
+        self.global_rate = global_rate
+        self.latency = latency
+        self.recent: Deque[float] = deque()
+        self.last_message: Dict[int, float] = {}
+        self.flood_until = 0.0
+        self.sent: List[float] = []
+        self.actions = 0
+        self.errors = 0
+        self.message_id = 0
+
+    def flood(self, seconds: float) -> None:
+        self.flood_until = time.monotonic() + seconds
+
+    def _retry_after(self, seconds: int) -> web.Response:
+        self.errors += 1
+        return web.json_response({
+            "ok": False, "error_code": 429,
+            "description": f"Too Many Requests: retry after {seconds}",
+            "parameters": {"retry_after": seconds},
+        })
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        data = await request.post()
+        chat_id = int(data["chat_id"])
+        await asyncio.sleep(self.latency)
+
+        now = time.monotonic()
+        if now < self.flood_until:
+            return self._retry_after(max(1, round(self.flood_until - now)))
+        while self.recent and now - self.recent[0] >= 1:
+            self.recent.popleft()
+        if len(self.recent) >= self.global_rate:
+            return self._retry_after(1)
+        self.recent.append(now)
+
+        if method == "sendChatAction":
+            self.actions += 1
+            return web.json_response({"ok": True, "result": True})
+        if now - self.last_message.get(chat_id, float("-inf")) < 1:
+            return self._retry_after(1)
+        self.last_message[chat_id] = now
+        self.sent.append(now)
+        self.message_id += 1
+        return web.json_response({"ok": True, "result": {
+            "message_id": self.message_id, "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"}, "text": data["text"],
+        }})
+
+
+async def reply(sender: OutboundSender, chat_id: int) -> float:
+    started = time.monotonic()
+    await sender.send_chat_action(chat_id)
+    await sender.send_message(chat_id, "Here is your plan for today")
+    return time.monotonic() - started
+
+
+async def run(args: argparse.Namespace) -> None:
+    api = FakeBotAPI(args.global_rate, args.latency)
+    app = web.Application()
+    app.router.add_post("/bot{token}/{method}", api.handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+
+    bot = Bot(TOKEN, session=AiohttpSession(api=TelegramAPIServer.from_base(f"http://127.0.0.1:{port}")))
+    with tempfile.TemporaryDirectory() as directory:
+        sender = OutboundSender(bot, global_rate=args.global_rate, chat_rate=1,
+                                backlog_path=f"{directory}/outbound.db")
+        await sender.start()
+        started = time.monotonic()
+        await sender.broadcast(range(args.chats), "Your daily summary is ready")
+        await asyncio.sleep(0.5)
+        replies = asyncio.gather(*(reply(sender, 1_000_000 + i) for i in range(args.replies)))
+        if args.flood:
+            await asyncio.sleep(1)
+            api.flood(args.flood)
+        latencies = await replies
+        total = args.chats + args.replies
+        while len(api.sent) < total:
+            await asyncio.sleep(0.05)
+        elapsed = time.monotonic() - started
+        await sender.stop()
+    await bot.session.close()
+    await runner.cleanup()
+
+    # Throughput over the steady part, excluding the flood wait
+    busy = elapsed - args.flood
+    print(f"{total} messages and {api.actions} chat actions in {elapsed:.1f}s: "
+          f"{total / busy:.1f} msg/s outside the flood wait (limit {args.global_rate}), {api.errors} 429s")
+    print(f"interactive replies after typing: p50 {statistics.median(latencies):.2f}s, "
+          f"max {max(latencies):.2f}s")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--chats", type=int, default=600, help="chats in the broadcast")
+    parser.add_argument("--replies", type=int, default=20, help="interactive replies queued behind it")
+    parser.add_argument("--global-rate", type=int, default=30, help="requests per second before a 429")
+    parser.add_argument("--latency", type=float, default=0.02, help="seconds the fake API takes per request")
+    parser.add_argument("--flood", type=float, default=0, help="seconds of bot-wide flood wait during the run")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
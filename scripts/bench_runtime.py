@@ -0,0 +1,197 @@
+"""Benchmark the default runtime against FAST_RUNTIME (uvloop and orjson).
+
+Times, once per profile, the hot paths the profile changes:
+
+- a full Todoist sync of --items tasks, served by a local HTTP server to a
+  real TodoistClient (request, JSON parse, task conversion)
+- dumping a batch of 50 sync commands
+- an update's trip from ingress to worker: dump, queue, load and validate
+  as an aiogram Update. Pass --redis-url to queue it through Redis, as the
+  cluster does; without it only the serialization is timed
+- formatting a JSON log record
+- queue handoffs between many small coroutines, as the workers do
+
+    python scripts/bench_runtime.py [--items 2000] [--redis-url redis://localhost:6379/0]
+"""
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+# The client is pointed at the local server; the token is never checked
+os.environ.setdefault("TODOIST_API_TOKEN", "bench")
+
+from aiohttp import web
+from aiogram.types import Update
+from my_coach.utils import runtime
+from my_coach.utils.logging_setup import JsonFormatter
+from my_coach.utils.todoist import TodoistClient
+
+UPDATE = {
+    "update_id": 123456789,
+    "message": {
+        "message_id": 4242, "date": 1760000000,
+        "from": {"id": 1, "is_bot": False, "first_name": "Ann", "language_code": "en"},
+        "chat": {"id": 1, "first_name": "Ann", "type": "private"},
+        "text": "What should I focus on today? I have a lot going on this week.",
+    },
+}
+COMMANDS = [
+    {"type": "item_add", "temp_id": f"t{i}", "uuid": f"{i:032x}",
+     "args": {"content": f"Buy milk {i}", "project_id": "2200000000", "due": {"string": "tomorrow"},
+              "labels": ["home"]}}
+    for i in range(50)
+]
+
+
+def sync_payload(items: int) -> Dict[str, Any]:
+    def item(i: int) -> Dict[str, Any]:
+        return {
+            "id": str(6000000000 + i), "v2_id": f"6X{i:08d}", "user_id": "1",
+            "project_id": str(2200000000 + i % 12), "section_id": None if i % 3 else str(130000000 + i % 7),
+            "parent_id": None, "child_order": i,
+            "content": f"Task number {i} with a realistic title about the quarterly report",
+            "description": "Some notes\n- a\n- b" if i % 4 == 0 else "", "priority": 1 + i % 4,
+            "due": {
+                "date": f"2026-10-{1 + i % 28:02d}", "is_recurring": i % 10 == 0,
+                "string": "every monday" if i % 10 == 0 else f"Oct {1 + i % 28}",
+                "lang": "en", "timezone": None, "datetime": None,
+            } if i % 2 else None,
+            "labels": ["work", "deep"] if i % 5 == 0 else [], "checked": False, "is_deleted": False,
+            "added_at": "2026-01-02T10:00:00Z", "added_by_uid": "1", "assigned_by_uid": None,
+            "responsible_uid": None, "collapsed": False, "sync_id": None, "note_count": 0, "day_order": -1,
+            "duration": None, "updated_at": "2026-10-01T12:00:00Z",
+        }
+
+    return {
+        "sync_token": "bench", "full_sync": True, "items": [item(i) for i in range(items)],
+        "projects": [
+            {"id": str(2200000000 + p), "name": f"Project {p}", "color": "blue", "parent_id": None,
+             "child_order": p, "collapsed": False, "shared": False, "is_deleted": False,
+             "is_archived": False, "is_favorite": False, "view_style": "list", "inbox_project": p == 0}
+            for p in range(12)
+        ],
+        "sections": [
+            {"id": str(130000000 + s), "name": f"Section {s}", "project_id": "2200000000", "section_order": s}
+            for s in range(7)
+        ],
+        "labels": [{"id": "1", "name": "work"}, {"id": "2", "name": "deep"}],
+        "user": {"tz_info": {"timezone": "Europe/Berlin"}},
+    }
+
+
+def per_call(run: Callable[[], Any], repeat: int) -> float:
+    started = time.perf_counter()
+    for _ in range(repeat):
+        run()
+    return (time.perf_counter() - started) / repeat
+
+
+async def full_syncs(body: bytes, repeat: int) -> float:
+    async def handle(request: web.Request) -> web.Response:
+        return web.Response(body=body, content_type="application/json")
+
+    app = web.Application()
+    app.router.add_post("/sync", handle)
+    server = web.AppRunner(app)
+    await server.setup()
+    site = web.TCPSite(server, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    try:
+        started = time.perf_counter()
+        for _ in range(repeat):
+            client = TodoistClient()
+            client.base_url = f"http://127.0.0.1:{port}"
+            await client.get_tasks()
+        return (time.perf_counter() - started) / repeat
+    finally:
+        await server.cleanup()
+
+
+async def redis_trips(redis_url: str, repeat: int) -> float:
+    from redis.asyncio import Redis
+
+    redis = Redis.from_url(redis_url)
+    key = "focuscoach:bench:runtime"
+    try:
+        started = time.perf_counter()
+        for _ in range(repeat):
+            await redis.rpush(key, runtime.json_dumps(UPDATE))
+            _, raw = await redis.blpop([key], timeout=5)
+            Update.model_validate(runtime.json_loads(raw))
+        return (time.perf_counter() - started) / repeat
+    finally:
+        await redis.delete(key)
+        await redis.aclose()
+
+
+async def queue_handoffs(items: int = 200000, consumers: int = 50) -> float:
+    queue: asyncio.Queue = asyncio.Queue()
+
+    async def consume() -> None:
+        while True:
+            await queue.get()
+            await asyncio.sleep(0)
+            queue.task_done()
+
+    tasks = [asyncio.create_task(consume()) for _ in range(consumers)]
+    started = time.perf_counter()
+    for i in range(items):
+        await queue.put(i)
+    await queue.join()
+    elapsed = time.perf_counter() - started
+    for task in tasks:
+        task.cancel()
+    return items / elapsed
+
+
+def measure(body: bytes, redis_url: Optional[str]) -> List[str]:
+    formatter = JsonFormatter()
+    record = logging.LogRecord("my_coach.bench", logging.INFO, __file__, 1,
+                               "Processing message from user %s", (1,), None)
+    record.user_id = 1
+    record.message_preview = "What should I focus on today?"
+
+    lines = [
+        f"full sync parse     {runtime.run(full_syncs(body, 10)) * 1e3:8.2f} ms",
+        f"command dump        {per_call(lambda: runtime.json_dumps(COMMANDS), 2000) * 1e6:8.2f} us",
+    ]
+    if redis_url:
+        lines.append(f"update via Redis    {runtime.run(redis_trips(redis_url, 2000)) * 1e6:8.2f} us")
+    else:
+        lines.append("update serialize    {:8.2f} us".format(per_call(
+            lambda: Update.model_validate(runtime.json_loads(runtime.json_dumps(UPDATE))), 20000) * 1e6))
+    lines += [
+        f"log record          {per_call(lambda: formatter.format(record), 20000) * 1e6:8.2f} us",
+        f"queue handoffs      {runtime.run(queue_handoffs()):8.0f} /s",
+    ]
+    return lines
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--items", type=int, default=2000, help="tasks in the full sync")
+    parser.add_argument("--redis-url", help="time the update trip through this Redis")
+    args = parser.parse_args()
+    logging.disable(logging.CRITICAL)
+    body = runtime.json_dumps(sync_payload(args.items)).encode()
+
+    # The profile is read from FAST_RUNTIME at import; switch it in place
+    for fast in (False, True):
+        runtime.FAST_RUNTIME = fast
+        runtime.USE_ORJSON = fast and runtime.orjson is not None
+        runtime.USE_UVLOOP = fast and runtime.uvloop is not None
+        print(runtime.describe())
+        for line in measure(body, args.redis_url):
+            print("  " + line)
+
+
+if __name__ == "__main__":
+    main()
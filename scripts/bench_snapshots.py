@@ -0,0 +1,161 @@
+"""Benchmark session snapshots at the scale of a 10k-user deployment.
+
+Builds one realistic session (--tasks tasks, 20 messages) and writes its
+snapshot for every one of --users users into a temporary SNAPSHOT_DIR.
+Reports the snapshot size and encode time, the decode latency of every
+user's snapshot, and session create against create-and-restore, as paid
+on a user's first message after a restart.
+
+It then restores --active sessions and times one snapshot pass over them,
+written inline on the event loop and through SnapshotStore.save_active,
+reporting the longest the loop went without running a 1 ms ticker.
+
+    python scripts/bench_snapshots.py [--users 10000] [--active 500]
+"""
+import argparse
+import asyncio
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Awaitable, Callable, List
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+# Sessions build Todoist and OpenAI clients; nothing here calls out
+os.environ.setdefault("TODOIST_API_TOKEN", "bench")
+os.environ.setdefault("OPENAI_API_KEY", "bench")
+
+from langchain_core.messages import AIMessage, HumanMessage, messages_from_dict
+from my_coach.models import Due, Project, SimpleTask
+from my_coach.utils.sessions import SessionRegistry, create_session
+from my_coach.utils.snapshots import TASK_LIST, SnapshotStore
+
+
+def make_session(user_id: int, task_count: int):
+    tasks = [
+        SimpleTask(
+            id=str(10 ** 9 + i), content=f"Task {i} call the dentist about the appointment",
+            description="notes " * 5, priority=1 + i % 4, is_completed=False,
+            due=Due(date=f"2026-10-2{i % 9}", is_recurring=False, string="Oct 2"),
+            labels=["home"], timezone="UTC", project_id="p1", project_name="Home",
+            due_at=datetime(2026, 10, 21, tzinfo=timezone.utc),
+        )
+        for i in range(task_count)
+    ]
+    msgs = [
+        message
+        for i in range(10)
+        for message in (HumanMessage(content=f"question {i} about my week and priorities"),
+                        AIMessage(content="Here is a plan: " + "do things. " * 30))
+    ]
+    session = create_session(user_id)
+    client = session.todoist_client
+    client.store.apply(tasks)
+    client.sync_token = "token"
+    client.metadata.projects = {"p1": Project(
+        id="p1", name="Home", color="red", comment_count=0, is_favorite=False, is_inbox_project=False,
+        is_shared=False, is_team_inbox=False, can_assign_tasks=False, order=1, parent_id=None, url="",
+        view_style="list",
+    )}
+    session.graph.update_state({"configurable": {"thread_id": str(user_id)}},
+                               {"msgs": msgs, "tasks": tasks}, as_node="chat_node")
+    return session
+
+
+def percentiles(samples: List[float]) -> str:
+    samples = sorted(samples)
+    return (f"p50 {samples[len(samples) // 2] * 1e3:.2f} ms, "
+            f"p99 {samples[int(len(samples) * 0.99)] * 1e3:.2f} ms")
+
+
+async def longest_stall(work: Callable[[], Awaitable[None]]) -> float:
+    """Run work alongside a 1 ms ticker and return the longest gap between ticks"""
+    longest = 0.0
+    done = False
+
+    async def ticker() -> None:
+        nonlocal longest
+        last = time.perf_counter()
+        while not done:
+            await asyncio.sleep(0.001)
+            now = time.perf_counter()
+            longest = max(longest, now - last)
+            last = now
+
+    ticks = asyncio.create_task(ticker())
+    await asyncio.sleep(0.01)
+    await work()
+    done = True
+    await ticks
+    return longest
+
+
+async def snapshot_pass(registry: SessionRegistry, store: SnapshotStore) -> None:
+    async def inline() -> None:
+        for _, session in registry.items():
+            store.save(session)
+
+    for name, work in (("inline on the loop", inline), ("save_active", lambda: store.save_active(registry))):
+        for _, session in registry.items():
+            session.last_seen = time.time()
+        started = time.perf_counter()
+        stall = await longest_stall(work)
+        print(f"snapshot pass over {len(registry.sessions)} sessions, {name}: "
+              f"{time.perf_counter() - started:.2f}s, longest loop stall {stall * 1e3:.1f} ms")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=10000, help="users with a snapshot on disk")
+    parser.add_argument("--tasks", type=int, default=100, help="tasks per user")
+    parser.add_argument("--active", type=int, default=500, help="sessions in the timed snapshot pass")
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+
+    with tempfile.TemporaryDirectory() as directory:
+        store = SnapshotStore(base_dir=directory)
+        session = make_session(0, args.tasks)
+        # The first encode also pays for importing the chat node
+        store.encode(session)
+        started = time.perf_counter()
+        raw = store.encode(session)
+        encoded = time.perf_counter() - started
+        started = time.perf_counter()
+        for user_id in range(1, args.users + 1):
+            store.path(user_id).write_bytes(raw)
+        print(f"snapshot {len(raw) / 1024:.1f} KiB, encoded in {encoded * 1e3:.2f} ms; "
+              f"wrote {args.users} in {time.perf_counter() - started:.2f}s")
+
+        latencies = []
+        for user_id in range(1, args.users + 1):
+            started = time.perf_counter()
+            data = store.decode(store.path(user_id).read_bytes())
+            TASK_LIST.validate_python(data["tasks"])
+            messages_from_dict(data["msgs"])
+            latencies.append(time.perf_counter() - started)
+        print(f"decode {args.users} snapshots: {sum(latencies):.2f}s total, {percentiles(latencies)}")
+
+        registry = SessionRegistry()
+        registry.snapshots = store
+        cold, warm = [], []
+        for user_id in range(1, args.active + 1):
+            started = time.perf_counter()
+            create_session(-user_id)
+            cold.append(time.perf_counter() - started)
+            started = time.perf_counter()
+            session = registry.get(user_id)
+            warm.append(time.perf_counter() - started)
+            assert len(session.todoist_client.store) == args.tasks
+        print(f"session create {statistics.median(cold) * 1e3:.2f} ms, "
+              f"create and restore {statistics.median(warm) * 1e3:.2f} ms (median)")
+
+        asyncio.run(snapshot_pass(registry, store))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""Benchmark the task search index at the size of a large Todoist account.
+
+Builds a TaskStore of --tasks synthetic tasks (a fifth of them completed,
+which are not indexed), then times chat-style queries with exact terms,
+typos and prefixes, both with the fuzzy expansion cache warm and cold
+(as right after a sync adds new vocabulary), and incremental updates.
+
+    python scripts/bench_task_search.py [--tasks 10000]
+"""
+import argparse
+import random
+import string
+import sys
+import time
+from pathlib import Path
+from typing import Callable, List
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from my_coach.models import SimpleTask
+from my_coach.utils.task_store import TaskStore
+
+COMMON_WORDS = [
+    "taxes", "invoice", "dentist", "groceries", "report", "gym", "call", "mom", "review",
+    "budget", "email", "client", "meeting", "renew", "passport", "insurance", "plan", "slides",
+]
+QUERIES = [
+    "how's the tax thing going?", "taxs", "dentist appointment", "call mom",
+    "groceries work", "invoce report", "renew passport before trip", "budg",
+]
+
+
+def make_tasks(count: int, rng: random.Random) -> List[SimpleTask]:
+    words = COMMON_WORDS + [
+        "".join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(4, 9)))
+        for _ in range(5000)
+    ]
+    return [
+        SimpleTask(
+            id=str(i), content=" ".join(rng.choices(words, k=5)),
+            description=" ".join(rng.choices(words, k=12)), priority=rng.randint(1, 4),
+            is_completed=rng.random() < 0.2, due=None,
+            labels=rng.choices(["home", "work", "errand", "finance"], k=1),
+        )
+        for i in range(count)
+    ]
+
+
+def percentiles(run: Callable[[], None], repeat: int) -> str:
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        run()
+        samples.append(time.perf_counter() - started)
+    samples.sort()
+    return (f"p50 {samples[len(samples) // 2] * 1e3:.3f} ms, "
+            f"p99 {samples[int(len(samples) * 0.99)] * 1e3:.3f} ms")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--tasks", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=300, help="timed runs per query")
+    args = parser.parse_args()
+
+    rng = random.Random(1)
+    tasks = make_tasks(args.tasks, rng)
+    store = TaskStore()
+    started = time.perf_counter()
+    store.apply(tasks)
+    index = store.search_index
+    print(f"indexed {len(index)} open of {len(tasks)} tasks in {time.perf_counter() - started:.2f}s")
+
+    for query in QUERIES:
+        store.search(query, 15)
+        warm = percentiles(lambda: store.search(query, 15), args.repeat)
+
+        def cold() -> None:
+            # What the first query after new vocabulary arrives pays
+            index._expansions.clear()
+            store.search(query, 15)
+
+        print(f"{query!r:32} warm {warm} | cold {percentiles(cold, args.repeat)}")
+
+    updates = [task.model_copy(update={"content": "updated " + task.content}) for task in tasks[:1000]]
+    started = time.perf_counter()
+    for task in updates:
+        store.apply([task])
+    print(f"incremental update: {(time.perf_counter() - started) / len(updates) * 1e3:.3f} ms per task")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+"""Fuzz and benchmark the Telegram HTML formatter.
+
+Feeds random model-style markup through TelegramHTMLFormatter, both in one
+piece and in random token-sized pieces, and checks every message against
+what Telegram's HTML parse mode accepts:
+
+- only the supported tags, properly nested and all closed in each message
+- no tags inside code or pre
+- no raw <, > or & outside an entity
+- at most the limit in UTF-16 code units
+
+Streamed output must carry the same text with the same formatting as the
+one-shot output; only where messages are split may differ.
+
+    python scripts/check_telegram_html.py [--inputs 5000] [--seed 1]
+"""
+import argparse
+import html
+import random
+import re
+import sys
+import time
+from pathlib import Path
+from typing import List, Tuple
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from my_coach.utils.telegram_html import TelegramHTMLFormatter, to_telegram_html, utf16_len
+
+ALLOWED = {"b", "i", "u", "s", "tg-spoiler", "code", "pre"}
+TOKEN = re.compile(r"<(/?)([a-z-]+)>|&(?:amp|lt|gt|quot);|[<>&]")
+# Pieces of the markup the system prompt asks for, plus characters that need escaping
+ALPHABET = [
+    "*", "**", "_", "__", "~", "||", "|", "`", "```", "```python\n", "#", "# ", "## ",
+    "\n", "\n\n", "* ", " ", "  ", "<", ">", "&", "&amp;", "<b>", "</i>",
+    "a", "word", "snake_case", "1 * 2", "é", "🙂", "👍🏽",
+]
+# Above the worst case of tags reopened and closed around a split; nothing fits below that
+LIMITS = (200, 500, 4096)
+
+
+def parse(message: str, limit: int) -> List[Tuple[str, frozenset]]:
+    """Validate one message, returning its visible characters with the tags applied to each"""
+    assert utf16_len(message) <= limit, f"{utf16_len(message)} UTF-16 units over the limit of {limit}"
+    stack: List[str] = []
+    chars: List[Tuple[str, frozenset]] = []
+
+    def text(raw: str) -> None:
+        chars.extend((char, frozenset(stack)) for char in raw)
+
+    pos = 0
+    for token in TOKEN.finditer(message):
+        text(message[pos:token.start()])
+        pos = token.end()
+        closing, tag = token.group(1), token.group(2)
+        if tag:
+            assert tag in ALLOWED, f"unsupported tag {token.group(0)}"
+            if closing:
+                assert stack and stack[-1] == tag, f"{token.group(0)} closes {stack[-1:] or 'nothing'}"
+                stack.pop()
+            else:
+                assert not stack or stack[-1] not in ("code", "pre"), f"{token.group(0)} inside {stack[-1]}"
+                stack.append(tag)
+        elif token.group(0) in "<>&":
+            raise AssertionError(f"unescaped {token.group(0)!r} in {message[max(0, token.start() - 20):pos + 20]!r}")
+        else:
+            text(html.unescape(token.group(0)))
+    text(message[pos:])
+    assert not stack, f"unclosed {stack}"
+    assert any(not char.isspace() for char, _ in chars), "empty message"
+    return chars
+
+
+def formatted(messages: List[str], limit: int) -> List[Tuple[str, frozenset]]:
+    # Whitespace may be dropped or moved where a message is split
+    return [(char, tags) for message in messages for char, tags in parse(message, limit) if not char.isspace()]
+
+
+def fuzz(inputs: int, seed: int) -> int:
+    rng = random.Random(seed)
+    messages = 0
+    for _ in range(inputs):
+        text = "".join(rng.choice(ALPHABET) for _ in range(rng.randint(0, 300)))
+        limit = rng.choice(LIMITS)
+        try:
+            whole = to_telegram_html(text, limit)
+            formatter = TelegramHTMLFormatter(limit)
+            streamed = []
+            i = 0
+            while i < len(text):
+                size = rng.randint(1, 8)
+                streamed += formatter.feed(text[i:i + size])
+                i += size
+            streamed += formatter.finish()
+            assert formatted(streamed, limit) == formatted(whole, limit), "streamed output differs from one-shot"
+        except AssertionError as e:
+            print(f"FAIL (limit {limit}): {e}\ninput: {text!r}", file=sys.stderr)
+            raise SystemExit(1)
+        messages += len(whole) + len(streamed)
+    return messages
+
+
+def benchmark() -> None:
+    reply = Path(__file__).resolve().parent.parent.joinpath("my_coach/utils/prompts.py").read_text()[:2500]
+    runs = 2000
+    started = time.perf_counter()
+    for _ in range(runs):
+        to_telegram_html(reply)
+    print(f"{len(reply)}-char reply: {(time.perf_counter() - started) / runs * 1e6:.0f} us one-shot")
+
+    runs = 200
+    started = time.perf_counter()
+    for _ in range(runs):
+        formatter = TelegramHTMLFormatter()
+        for i in range(0, len(reply), 4):
+            formatter.feed(reply[i:i + 4])
+        formatter.finish()
+    print(f"{len(reply)}-char reply: {(time.perf_counter() - started) / runs * 1e6:.0f} us streamed in 4-char tokens")
+
+    long_reply = reply * 20
+    started = time.perf_counter()
+    messages = to_telegram_html(long_reply)
+    print(f"{len(long_reply)} chars: {len(messages)} messages in {(time.perf_counter() - started) * 1e3:.1f} ms")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--inputs", type=int, default=5000, help="random inputs to check")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--no-benchmark", action="store_true")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    messages = fuzz(args.inputs, args.seed)
+    print(f"fuzz: {args.inputs} inputs, {messages} messages valid, "
+          f"streamed matches one-shot ({time.perf_counter() - started:.1f}s)")
+    if not args.no_benchmark:
+        benchmark()
+
+
+if __name__ == "__main__":
+    main()